@@ -0,0 +1,98 @@
+"""
+Compares per-mesh light selection with clustered shading as the number of point lights grows.
+Renders offscreen, so runs on machines without a display, like the flythrough benchmark
+Run from the repository root with: python -m bench.clustered_lights
+"""
+import os
+
+# PyOpenGL chooses how to create contexts when OpenGL is first imported, so the benchmark selects EGL first
+os.environ.setdefault("PYOPENGL_PLATFORM", "egl")
+
+import time
+import numpy as np
+import pygame
+from OpenGL.GL import glFinish
+
+from main import Main
+from core.renderer import Renderer
+from light.point_light import PointLight
+
+# Numbers of point lights to sweep
+LIGHT_COUNTS = [4, 16, 64, 256, 1024]
+# Frames rendered for each measurement, after one warm-up frame
+FRAME_COUNT = 30
+
+
+def add_street_lights(scene, count, seed=0):
+    """
+    Scatters point lights along the street
+    :param scene: scene to add lights to
+    :param count: number of lights
+    :param seed: seed of random placement, so every run uses the same lights
+    :return: list of lights added
+    """
+    random = np.random.default_rng(seed)
+    lights = []
+    for i in range(count):
+        position = [random.uniform(-50, 50), random.uniform(0.2, 3), random.uniform(-4, 4)]
+        colour = list(random.uniform(0.3, 1, 3))
+        light = PointLight(colour=colour, position=position, attenuation=[1, 0, 40])
+        scene.add(light)
+        lights.append(light)
+    return lights
+
+
+def time_frames(app, frame_count):
+    """
+    Renders frames and measures the average frame time, waiting for the GPU after each frame
+    :param app: initialised Main application
+    :param frame_count: number of frames to measure
+    :return: average frame time in milliseconds
+    """
+    app.renderer.render(app.scene, app.camera)
+    glFinish()
+
+    start = time.perf_counter()
+    for i in range(frame_count):
+        pygame.event.pump()
+        app.renderer.render(app.scene, app.camera)
+        glFinish()
+    return (time.perf_counter() - start) / frame_count * 1000
+
+
+def run():
+    """
+    Builds the street scene, then measures both lighting paths for each light count
+    """
+    app = Main(screen_size=[960, 500], headless=True)
+    app.initialise()
+
+    print(f"{'lights':>8} {'per-mesh ms':>12} {'clustered ms':>13} {'assign ms':>10} {'pairs':>8}")
+    for count in LIGHT_COUNTS:
+        lights = add_street_lights(app.scene, count)
+
+        app.renderer = Renderer(clustered_shading=False)
+        per_mesh_time = time_frames(app, FRAME_COUNT)
+
+        app.renderer = Renderer(clustered_shading=True)
+        clustered_time = time_frames(app, FRAME_COUNT)
+
+        # Time the CPU side of light assignment alone
+        clusters = app.renderer.light_clusters
+        start = time.perf_counter()
+        for i in range(FRAME_COUNT):
+            clusters.assign(app.camera, app.renderer.light_buffer)
+        assign_time = (time.perf_counter() - start) / FRAME_COUNT * 1000
+
+        print(f"{count:>8} {per_mesh_time:>12.2f} {clustered_time:>13.2f} {assign_time:>10.2f} "
+              f"{clusters.assignment_count:>8}")
+
+        for light in lights:
+            app.scene.remove(light)
+
+    app.context.release()
+    pygame.quit()
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,115 @@
+"""
+Compares shading the street scene directly against shading it after a depth pre-pass, counting in each pass
+the fragment shader invocations and the samples passing the depth test.
+Renders offscreen, so runs on machines without a display, like the flythrough benchmark
+Run from the repository root with: python -m bench.depth_prepass
+"""
+import os
+
+# PyOpenGL chooses how to create contexts when OpenGL is first imported, so the benchmark selects EGL first
+os.environ.setdefault("PYOPENGL_PLATFORM", "egl")
+
+import time
+import pygame
+from OpenGL.GL import (GL_COLOR_BUFFER_BIT, GL_DEPTH_BUFFER_BIT, GL_QUERY_RESULT, GL_SAMPLES_PASSED, glBeginQuery,
+                       glClear, glDeleteQueries, glEndQuery, glFinish, glGenQueries, glGetQueryObjectuiv)
+from OpenGL.GL.ARB.pipeline_statistics_query import GL_FRAGMENT_SHADER_INVOCATIONS_ARB
+
+from main import Main
+from core.renderer import Renderer
+
+# Frames rendered for each measurement, after one warm-up frame
+FRAME_COUNT = 30
+# Statistics counted for each pass
+QUERY_TARGETS = [GL_FRAGMENT_SHADER_INVOCATIONS_ARB, GL_SAMPLES_PASSED]
+
+
+def count_pass(draw):
+    """
+    Runs a pass, counting its fragment shader invocations and the samples passing the depth test
+    :param draw: function drawing the pass
+    :return: (invocations, samples passed)
+    """
+    counts = []
+    for target in QUERY_TARGETS:
+        query_ref = glGenQueries(1)[0]
+        glBeginQuery(target, query_ref)
+        draw()
+        glEndQuery(target)
+        # Waits for the pass to finish
+        counts.append(int(glGetQueryObjectuiv(query_ref, GL_QUERY_RESULT)))
+        glDeleteQueries(1, [query_ref])
+    return counts
+
+
+def count_frame(renderer, scene, camera):
+    """
+    Renders one frame as Renderer.render does, counting the pre-pass and shading pass separately
+    :param renderer: forward Renderer
+    :param scene: scene to render
+    :param camera: camera to render with
+    :return: ((invocations, samples) of pre-pass, (invocations, samples) of shading pass)
+    """
+    def depth_pass():
+        if renderer.depth_prepass:
+            glClear(GL_DEPTH_BUFFER_BIT)
+            renderer.depth_pass(mesh_list)
+
+    def shading_pass():
+        # Without a pre-pass, depth is cleared so each count draws the pass from the same state
+        if not renderer.depth_prepass:
+            glClear(GL_DEPTH_BUFFER_BIT)
+        for mesh_index, mesh in enumerate(mesh_list):
+            renderer.draw_mesh(mesh_index, mesh)
+
+    glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+    mesh_list = renderer.prepare_frame(scene, camera)
+    # Each statistic is counted over its own run of the pass; the shading pass leaves the pre-pass depth untouched
+    prepass_counts = count_pass(depth_pass)
+    shading_counts = count_pass(shading_pass)
+    renderer.finish_frame()
+    return prepass_counts, shading_counts
+
+
+def time_frames(app, frame_count):
+    """
+    Renders frames and measures the average frame time, waiting for the GPU after each frame
+    :param app: initialised Main application
+    :param frame_count: number of frames to measure
+    :return: average frame time in milliseconds
+    """
+    app.renderer.render(app.scene, app.camera)
+    glFinish()
+
+    start = time.perf_counter()
+    for i in range(frame_count):
+        pygame.event.pump()
+        app.renderer.render(app.scene, app.camera)
+        glFinish()
+    return (time.perf_counter() - start) / frame_count * 1000
+
+
+def run():
+    """
+    Builds the street scene, then measures it with and without the pre-pass
+    """
+    app = Main(screen_size=[960, 500], headless=True)
+    app.initialise()
+
+    print(f"{'pre-pass':>9} {'pre-pass invocations':>21} {'shading invocations':>20} {'shaded samples':>15} "
+          f"{'frame ms':>9}")
+    for depth_prepass in [False, True]:
+        app.renderer = Renderer(depth_prepass=depth_prepass)
+        app.renderer.compile_materials(app.scene)
+        frame_time = time_frames(app, FRAME_COUNT)
+        (prepass_invocations, prepass_samples), (shading_invocations, shading_samples) = \
+            count_frame(app.renderer, app.scene, app.camera)
+        print(f"{'on' if depth_prepass else 'off':>9} {prepass_invocations:>21} {shading_invocations:>20} "
+              f"{shading_samples:>15} {frame_time:>9.2f}")
+
+    app.context.release()
+    pygame.quit()
+
+
+if __name__ == '__main__':
+    run()
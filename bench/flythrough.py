@@ -0,0 +1,367 @@
+"""
+Flies the camera down the street scene along a scripted path while the car drives, reporting frame times,
+draw calls, triangles and startup time as JSON, and optionally comparing them against a saved baseline.
+Renders offscreen, so runs the same on machines without a display or GPU, such as under Mesa's llvmpipe.
+The street can be repeated to measure how the renderer scales with scene size
+Run from the repository root with: python -m bench.flythrough --output report.json
+Compare against an earlier report with: python -m bench.flythrough --baseline report.json
+"""
+import os
+
+# PyOpenGL chooses how to create contexts when OpenGL is first imported, so the benchmark selects EGL first
+os.environ.setdefault("PYOPENGL_PLATFORM", "egl")
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pygame
+from OpenGL.GL import (GL_PRIMITIVES_GENERATED, GL_QUERY_RESULT, GL_RENDERER, GL_VERSION, glBeginQuery,
+                       glDeleteQueries, glEndQuery, glFinish, glGenQueries, glGetQueryObjectuiv, glGetString)
+
+from main import Main
+from core.frame_profiler import FrameProfiler
+from core.input import Input
+from core.matrix import Matrix
+from core.mesh import Mesh
+from light.light import Light
+from light.point_light import PointLight
+from texture.texture import Texture
+
+# Frames per second of scripted time; Main.update moves the rig by 1/60 of a second per frame
+FRAME_RATE = 60
+
+# Keys held during each span of the flythrough, as (start seconds, end seconds, key)
+SCRIPT = [
+    # The car drives along the road throughout, turning once
+    (0.0, 4.0, "i"),
+    (2.0, 2.5, "j"),
+    # Walk down the street, turning towards the buildings and looking up at them
+    (0.0, 1.5, "w"),
+    (1.0, 2.0, "left"),
+    (1.5, 2.5, "up"),
+    # Jump to the far end of the street, then back away while turning
+    (2.5, 2.6, "2"),
+    (2.6, 4.0, "s"),
+    (3.0, 4.0, "right")
+]
+
+# Distance between copies of the street when the scene is scaled; the grass floor covers 7 streets
+STREET_SPACING = 16
+
+# Fractional increase over the baseline counted as a regression
+THRESHOLD = 0.1
+# Startup reads files and compiles shaders, so varies far more between runs than frame times; llvmpipe on one core
+# was seen to vary by about 20%
+STARTUP_THRESHOLD = 0.5
+
+# Metrics compared against the baseline, all of which are better when lower
+COMPARED_METRICS = [("frame_ms", "p50"), ("frame_ms", "p95"), ("frame_ms", "p99"), ("startup_ms", "total"),
+                    ("draw_calls", "mean"), ("triangles", "mean")]
+
+
+class ScriptedInput(Input):
+    """
+    Input holding down keys at scripted times instead of reading the keyboard, advancing a fixed step each frame
+    so every run sees the same keys on the same frames
+    """
+    def __init__(self, script, frame_rate=FRAME_RATE):
+        """
+        Creates an input following a script
+        :param script: list of (start seconds, end seconds, key name)
+        :param frame_rate: frames per second of scripted time
+        """
+        super().__init__()
+        self.script = script
+        self.frame_rate = frame_rate
+        self.frame = 0
+
+    def get_duration(self):
+        """
+        Returns the length of the script
+        :return: time the last key is released, in seconds
+        """
+        return max(end for start, end, key in self.script)
+
+    def update(self):
+        """
+        Presses and releases the keys scheduled for the next frame
+        """
+        # Events are still pumped, so SDL keeps running as it would with a window
+        pygame.event.pump()
+
+        step = 1 / self.frame_rate
+        time = self.frame * step
+        self.key_pressed_list = [key for start, end, key in self.script if start <= time < end]
+        self.key_down_list = [key for start, end, key in self.script if start <= time < start + step]
+        self.key_up_list = [key for start, end, key in self.script if end <= time < end + step]
+        self.frame += 1
+
+
+def scale_scene(app, street_count, spacing=STREET_SPACING):
+    """
+    Repeats the street beside itself, alternating sides; copies share the geometry and materials of the original,
+    and floors and the sky box, which span every copy, are not repeated
+    :param app: initialised Main application
+    :param street_count: number of streets in the scaled scene, including the original
+    :param spacing: distance between streets
+    """
+    # Floors and the sky box are the only meshes that do not cast shadows
+    meshes = [node for node in app.scene.get_descendant_list() if isinstance(node, Mesh) and node.cast_shadow]
+    lights = [node for node in app.scene.get_descendant_list()
+              if isinstance(node, Light) and node.light_type == Light.POINT]
+
+    for copy in range(1, street_count):
+        # Copies at +1, -1, +2, -2, ... streets, so the camera's street stays in the middle
+        offset = Matrix.make_translation(0, 0, spacing * (copy + 1) // 2 * (1 if copy % 2 else -1))
+        for mesh in meshes:
+            # Copies of the car stay parked
+            mesh_copy = Mesh(mesh.geometry, mesh.material)
+            mesh_copy.transform = offset @ mesh.transform
+            app.scene.add(mesh_copy)
+        for light in lights:
+            light_copy = PointLight(colour=light.colour, attenuation=light.attenuation)
+            light_copy.transform = offset @ light.transform
+            app.scene.add(light_copy)
+
+    # Material variants for the larger number of lights are compiled before timing starts
+    app.renderer.compile_materials(app.scene)
+
+
+def wait_for_textures():
+    """
+    Uploads every texture still decoding or streaming, so each run renders the same textures on the same frames
+    """
+    while Texture.loading or (Texture.streamer is not None and Texture.streamer.uploads):
+        if Texture.upload_loaded() == 0:
+            time.sleep(0.001)
+    glFinish()
+
+
+def render_frame(app, query_ref):
+    """
+    Updates and renders one frame, waiting for the GPU to finish it
+    :param app: initialised Main application
+    :param query_ref: query counting the triangles drawn
+    :return: (frame time in milliseconds, draw calls, triangles)
+    """
+    start = time.perf_counter()
+    glBeginQuery(GL_PRIMITIVES_GENERATED, query_ref)
+    app.input.update()
+    app.update()
+    glEndQuery(GL_PRIMITIVES_GENERATED)
+    glFinish()
+    frame_time = (time.perf_counter() - start) * 1000
+    return frame_time, app.renderer.draw_count, int(glGetQueryObjectuiv(query_ref, GL_QUERY_RESULT))
+
+
+def summarise(values):
+    """
+    Summarises a list of per-frame measurements
+    :param values: list of numbers
+    :return: dictionary of mean, p50, p95, p99 and max
+    """
+    values = np.array(values, dtype=np.float64)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"mean": float(values.mean()), "p50": float(p50), "p95": float(p95), "p99": float(p99),
+            "max": float(values.max())}
+
+
+def run(street_count=1, size=[640, 360], deferred=False, clustered=False, depth_prepass=False, duration=None,
+        profile=False):
+    """
+    Builds the scene, then flies through it
+    :param street_count: number of copies of the street
+    :param size: [width, height] of rendered frames
+    :param deferred: whether lit materials are shaded with the deferred renderer
+    :param clustered: whether the forward renderer assigns point lights to clusters
+    :param depth_prepass: whether the forward renderer draws a depth pre-pass
+    :param duration: seconds of the script to fly, or None for all of it
+    :param profile: whether the report includes the time of each phase from FrameProfiler
+    :return: report dictionary
+    """
+    start = time.perf_counter()
+    app = Main(screen_size=size, deferred=deferred, clustered=clustered, depth_prepass=depth_prepass,
+               headless=True)
+    app.initialise()
+    scale_scene(app, street_count)
+    initialise_time = time.perf_counter()
+    wait_for_textures()
+    texture_time = time.perf_counter()
+
+    # The first frame draws the cached shadow maps and finishes linking programs, so is counted as startup
+    app.input = ScriptedInput(SCRIPT)
+    query_ref = glGenQueries(1)[0]
+    render_frame(app, query_ref)
+    first_frame_time = time.perf_counter()
+
+    profiler = FrameProfiler() if profile else None
+    FrameProfiler.active = profiler
+    script_duration = app.input.get_duration() if duration is None else min(duration, app.input.get_duration())
+    frame_times, draw_counts, triangle_counts = [], [], []
+    for frame in range(int(round(script_duration * FRAME_RATE)) - 1):
+        if profiler is not None:
+            profiler.begin_frame()
+        frame_time, draw_count, triangle_count = render_frame(app, query_ref)
+        if profiler is not None:
+            profiler.end_frame()
+        frame_times.append(frame_time)
+        draw_counts.append(draw_count)
+        triangle_counts.append(triangle_count)
+    if profiler is not None:
+        profiler.finish()
+        FrameProfiler.active = None
+    glDeleteQueries(1, [query_ref])
+
+    descendants = app.scene.get_descendant_list()
+    report = {
+        "scene": {
+            "streets": street_count,
+            "size": size,
+            "renderer": "deferred" if deferred else "clustered" if clustered else "forward",
+            "depth_prepass": depth_prepass,
+            "meshes": sum(isinstance(node, Mesh) for node in descendants),
+            "lights": sum(isinstance(node, Light) for node in descendants),
+            "frames": len(frame_times)
+        },
+        "startup_ms": {
+            "initialise": (initialise_time - start) * 1000,
+            "textures": (texture_time - initialise_time) * 1000,
+            "first_frame": (first_frame_time - texture_time) * 1000,
+            "total": (first_frame_time - start) * 1000
+        },
+        "frame_ms": summarise(frame_times),
+        "draw_calls": summarise(draw_counts),
+        "triangles": summarise(triangle_counts),
+        "environment": {
+            "gl_renderer": glGetString(GL_RENDERER).decode(),
+            "gl_version": glGetString(GL_VERSION).decode(),
+            "python": platform.python_version(),
+            "machine": platform.machine()
+        }
+    }
+    if profiler is not None:
+        report["phases_ms"] = profiler.summary()
+
+    app.context.release()
+    pygame.quit()
+    return report
+
+
+def sweep(street_counts, options):
+    """
+    Runs the benchmark for each scene size in a separate process, as the context and the resources shared
+    between scenes are only created once per process
+    :param street_counts: list of numbers of copies of the street
+    :param options: command line arguments passed on to each run
+    :return: list of reports
+    """
+    reports = []
+    for street_count in street_counts:
+        with tempfile.TemporaryDirectory() as folder:
+            output_route = os.path.join(folder, "report.json")
+            subprocess.run([sys.executable, "-m", "bench.flythrough", "--streets", str(street_count),
+                            "--output", output_route, "--quiet"] + options, check=True)
+            with open(output_route) as file:
+                reports.append(json.load(file))
+    return reports
+
+
+def compare(report, baseline, threshold=THRESHOLD, startup_threshold=STARTUP_THRESHOLD):
+    """
+    Compares a report against a baseline, printing the change in each metric
+    :param report: report returned by run
+    :param baseline: report of an earlier run
+    :param threshold: fractional increase counted as a regression
+    :param startup_threshold: fractional increase of startup time counted as a regression
+    :return: list of names of metrics that regressed
+    """
+    if report["scene"] != baseline["scene"]:
+        print(f"Warning: baseline measured a different scene: {baseline['scene']}")
+    if report["environment"] != baseline["environment"]:
+        print(f"Warning: baseline measured on a different machine: {baseline['environment']}")
+
+    regressions = []
+    print(f"{'metric':<20}{'baseline':>12}{'current':>12}{'change':>9}")
+    for group, statistic in COMPARED_METRICS:
+        name = f"{group}.{statistic}"
+        old, new = baseline[group][statistic], report[group][statistic]
+        change = (new - old) / old if old > 0 else 0
+        regressed = change > (startup_threshold if group == "startup_ms" else threshold)
+        if regressed:
+            regressions.append(name)
+        print(f"{name:<20}{old:>12.2f}{new:>12.2f}{change:>+9.1%}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Scripted flythrough benchmark of the street scene")
+    parser.add_argument("--streets", type=int, nargs="+", default=[1],
+                        help="number of copies of the street; several values sweep the scene size")
+    parser.add_argument("--size", default="640x360", help="width and height of rendered frames, as WIDTHxHEIGHT")
+    parser.add_argument("--deferred", action="store_true", help="use deferred shading for lit materials")
+    parser.add_argument("--clustered", action="store_true", help="use clustered forward shading for point lights")
+    parser.add_argument("--depth-prepass", action="store_true", help="draw depth before shading")
+    parser.add_argument("--duration", type=float, help="seconds of the scripted path to fly, for shorter runs")
+    parser.add_argument("--profile", action="store_true", help="include the time of each phase of the frame")
+    parser.add_argument("--output", help="JSON file the report is written to")
+    parser.add_argument("--baseline", help="JSON report of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="fractional increase over the baseline counted as a regression")
+    parser.add_argument("--startup-threshold", type=float, default=STARTUP_THRESHOLD,
+                        help="fractional increase of startup time over the baseline counted as a regression")
+    parser.add_argument("--quiet", action="store_true", help="only write the report, without printing it")
+    args = parser.parse_args()
+
+    # Loading models changes the working directory, so routes are resolved first
+    output_route = None if args.output is None else os.path.abspath(args.output)
+    baseline_route = None if args.baseline is None else os.path.abspath(args.baseline)
+
+    if len(args.streets) > 1:
+        options = ["--size", args.size]
+        options += [flag for flag, enabled in [("--deferred", args.deferred), ("--clustered", args.clustered),
+                                               ("--depth-prepass", args.depth_prepass),
+                                               ("--profile", args.profile)] if enabled]
+        if args.duration is not None:
+            options += ["--duration", str(args.duration)]
+        reports = sweep(args.streets, options)
+    else:
+        size = [int(value) for value in args.size.lower().split("x")]
+        reports = [run(args.streets[0], size, args.deferred, args.clustered, args.depth_prepass, args.duration,
+                       args.profile)]
+
+    # A sweep is reported as a list with a report for each scene size
+    result = reports[0] if len(reports) == 1 else reports
+    if not args.quiet:
+        print(json.dumps(result, indent=2))
+    if output_route is not None:
+        with open(output_route, "w") as file:
+            json.dump(result, file, indent=2)
+
+    if len(reports) > 1:
+        print(f"{'streets':>8}{'meshes':>8}{'lights':>8}{'p50 ms':>10}{'p95 ms':>10}{'draws':>8}{'triangles':>11}")
+        for report in reports:
+            print(f"{report['scene']['streets']:>8}{report['scene']['meshes']:>8}{report['scene']['lights']:>8}"
+                  f"{report['frame_ms']['p50']:>10.2f}{report['frame_ms']['p95']:>10.2f}"
+                  f"{report['draw_calls']['mean']:>8.0f}{report['triangles']['mean']:>11.0f}")
+
+    if baseline_route is not None:
+        with open(baseline_route) as file:
+            baseline = json.load(file)
+        baseline_reports = baseline if isinstance(baseline, list) else [baseline]
+        regressions = []
+        for report in reports:
+            # Each scene size is compared with the baseline of the same size
+            matches = [old for old in baseline_reports if old["scene"]["streets"] == report["scene"]["streets"]]
+            if not matches:
+                print(f"No baseline for {report['scene']['streets']} streets")
+                continue
+            print(f"{report['scene']['streets']} streets:")
+            regressions += compare(report, matches[0], args.threshold, args.startup_threshold)
+        if regressions:
+            print(f"Regressed beyond the threshold: {', '.join(regressions)}")
+            sys.exit(1)
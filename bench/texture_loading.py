@@ -0,0 +1,85 @@
+"""
+Compares loading textures by decoding images with pygame against loading baked texture files
+Run from the repository root with: python -m bench.texture_loading
+"""
+import os
+import tempfile
+import time
+import pygame
+from OpenGL.GL import glFinish
+
+from texture.texture import Texture
+from texture.texture_container import TextureContainer
+
+# Folder of images to load, relative to the repository root
+IMAGE_FOLDER = "images"
+# Loads measured for each image and path, after one warm-up load
+LOAD_COUNT = 10
+
+
+def time_loads(load, load_count):
+    """
+    Loads a texture repeatedly and measures the median load time, waiting for the GPU after each load
+    :param load: function filling a new Texture
+    :param load_count: number of loads to measure
+    :return: median load time in milliseconds
+    """
+    times = []
+    for i in range(load_count + 1):
+        texture = Texture()
+        start = time.perf_counter()
+        load(texture)
+        glFinish()
+        times.append((time.perf_counter() - start) * 1000)
+        texture.release()
+    times = sorted(times[1:])
+    return times[len(times) // 2]
+
+
+def load_image(texture, file_route):
+    """
+    Loads a texture the pygame way, decoding the image and generating mipmaps
+    :param texture: empty Texture
+    :param file_route: route to image file
+    """
+    texture.load_image(file_route)
+    texture.upload_data()
+
+
+def load_baked(texture, baked_route):
+    """
+    Loads a texture from a baked file with precomputed mipmaps
+    :param texture: empty Texture
+    :param baked_route: route to baked file
+    """
+    texture.upload_container(TextureContainer(baked_route))
+
+
+def run():
+    """
+    Bakes each image into a temporary folder, then measures both ways of loading it
+    """
+    pygame.init()
+    pygame.display.set_mode([64, 64], pygame.OPENGL | pygame.DOUBLEBUF | pygame.HIDDEN)
+
+    print(f"{'image':>32} {'pygame ms':>10} {'baked ms':>9} {'speed-up':>9} {'image KB':>9} {'baked KB':>9}")
+    image_routes = sorted(
+        os.path.join(root, file_name) for root, folders, file_names in os.walk(IMAGE_FOLDER) for file_name in file_names
+        if os.path.splitext(file_name)[1].lower() in TextureContainer.IMAGE_TYPES
+    )
+    with tempfile.TemporaryDirectory() as folder:
+        for file_route in image_routes:
+            baked_route = os.path.join(folder, os.path.basename(TextureContainer.baked_route(file_route)))
+            TextureContainer.bake(file_route, baked_route)
+
+            image_time = time_loads(lambda texture: load_image(texture, file_route), LOAD_COUNT)
+            baked_time = time_loads(lambda texture: load_baked(texture, baked_route), LOAD_COUNT)
+
+            print(f"{file_route:>32} {image_time:>10.2f} {baked_time:>9.2f} {image_time / baked_time:>8.1f}x "
+                  f"{os.path.getsize(file_route) / 1024:>9.0f} {os.path.getsize(baked_route) / 1024:>9.0f}")
+
+    pygame.quit()
+
+
+if __name__ == '__main__':
+    run()
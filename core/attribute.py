@@ -1,5 +1,6 @@
 import numpy as np
 from OpenGL.GL import *
+from core.program_reflection import ProgramReflection
 
 
 class Attribute(object):
@@ -16,16 +17,18 @@ class Attribute(object):
         # Data array to be stored in buffer
         self.data = data
 
-        # Reference to available buffer
-        self.buffer_ref = glGenBuffers(1)
-
-        # Upload data to buffer
-        self.upload_data()
+        # Reference to buffer, created and filled when a program first reads the attribute
+        self.buffer_ref = None
 
     def upload_data(self):
         """
-        Uploads given data to a GPU buffer
+        Uploads given data to a GPU buffer; until a program reads the attribute, there is no buffer to upload to
         """
+        if self.buffer_ref is None:
+            return
+        if self.data is None:
+            raise Exception("Error: Attribute data has been released")
+
         # Convert data to numpy float array
         data = np.array(self.data).astype(np.float32)
         # Select buffer for use
@@ -38,12 +41,18 @@ class Attribute(object):
         Associates variable in program to buffer
         :param program_ref: GPU program to use
         :param variable_name: name of variable
+        :return: location of variable, or -1 if the program does not read it
         """
-        # Get reference for program variable
-        variable_ref = glGetAttribLocation(program_ref, variable_name)
+        # Get reference for program variable from the program's reflection
+        variable_ref = ProgramReflection.get(program_ref).locate_attribute(variable_name)
         # Check that program references variable
         if variable_ref == -1:
-            return
+            return variable_ref
+
+        # Upload data the first time any program reads it
+        if self.buffer_ref is None:
+            self.buffer_ref = glGenBuffers(1)
+            self.upload_data()
 
         # Select buffer for use
         glBindBuffer(GL_ARRAY_BUFFER, self.buffer_ref)
@@ -63,3 +72,19 @@ class Attribute(object):
 
         # Stream data from variable to buffer
         glEnableVertexAttribArray(variable_ref)
+        return variable_ref
+
+    def release_data(self):
+        """
+        Frees the CPU-side copy of the data once it is held in a GPU buffer
+        """
+        if self.buffer_ref is not None:
+            self.data = None
+
+    def delete_buffer(self):
+        """
+        Frees the GPU buffer, if one was created
+        """
+        if self.buffer_ref is not None:
+            glDeleteBuffers(1, [self.buffer_ref])
+            self.buffer_ref = None
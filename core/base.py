@@ -1,5 +1,7 @@
+import os
 import pygame
 import sys
+from core.frame_profiler import FrameProfiler
 from core.input import Input
 
 
@@ -7,25 +9,46 @@ class Base(object):
     """
     Base model class, all other models will inherit from this
     """
-    def __init__(self, screen_size=[768, 768]):
+    def __init__(self, screen_size=[768, 768], headless=False, samples=4):
+        """
+        Opens a window, or creates an OpenGL context rendering without one
+        :param screen_size: [width, height] of window, or of the image rendered without a window
+        :param headless: whether to render offscreen without a window, for machines without a display;
+                         PYOPENGL_PLATFORM must then be set to "egl" or "osmesa" before OpenGL is imported
+        :param samples: number of samples per pixel used for antialiasing
+        """
+        self.headless = headless
+        self.screen_size = screen_size
+        if headless:
+            # Without a display, the event loop and clock still run on SDL's dummy video driver
+            os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
         # Initialise pygame modules
         pygame.init()
 
-        # Set screen size to 768x768, with Double Buffering and using OpenGL
-        screen_size = screen_size
-        display_flags = pygame.DOUBLEBUF | pygame.OPENGL
+        if headless:
+            # Imported here, as it requires PyOpenGL's EGL or OSMesa platform
+            from core.headless_context import HeadlessContext
+            self.context = HeadlessContext(screen_size, samples)
+            self.screen = None
+        else:
+            self.context = None
+
+            # Set screen size to 768x768, with Double Buffering and using OpenGL
+            screen_size = screen_size
+            display_flags = pygame.DOUBLEBUF | pygame.OPENGL
 
-        # Enable 4x Antialiasing
-        pygame.display.gl_set_attribute(pygame.GL_MULTISAMPLEBUFFERS, 1)
-        pygame.display.gl_set_attribute(pygame.GL_MULTISAMPLESAMPLES, 4)
-        self.screen = pygame.display.set_mode(screen_size, display_flags)
+            # Enable 4x Antialiasing
+            pygame.display.gl_set_attribute(pygame.GL_MULTISAMPLEBUFFERS, int(samples > 0))
+            pygame.display.gl_set_attribute(pygame.GL_MULTISAMPLESAMPLES, samples)
+            self.screen = pygame.display.set_mode(screen_size, display_flags)
 
-        # Enable cross-OS compatability
-        pygame.display.gl_set_attribute(pygame.GL_CONTEXT_PROFILE_MASK,
-                                        pygame.GL_CONTEXT_PROFILE_CORE)
+            # Enable cross-OS compatability
+            pygame.display.gl_set_attribute(pygame.GL_CONTEXT_PROFILE_MASK,
+                                            pygame.GL_CONTEXT_PROFILE_CORE)
 
-        # Set window name
-        pygame.display.set_caption("Street Scene")
+            # Set window name
+            pygame.display.set_caption("Street Scene")
 
         # Set running flag
         self.running = True
@@ -46,28 +69,99 @@ class Base(object):
         """
         pass
 
-    def run(self):
+    def run(self, frame_count=None, output_route=None, capture_route=None, profiler=None, trace_route=None):
         """
         Renders scene
+        :param frame_count: number of frames to render before stopping, or None to run until closed
+        :param output_route: route of image file the last frame is saved to, when rendering without a window
+        :param capture_route: route of video file, or of numbered images such as frames/%05d.png,
+                              every frame is recorded to
+        :param profiler: FrameProfiler timing each frame, or None to run without timing
+        :param trace_route: route of JSON file the profiler's trace is written to
         """
+        # Models are loaded by changing the working directory, so relative routes are resolved first
+        output_route, capture_route, trace_route = [None if route is None else os.path.abspath(route)
+                                                    for route in [output_route, capture_route, trace_route]]
+
         self.initialise()
+        FrameProfiler.active = profiler
+
+        capture = None
+        if capture_route is not None:
+            # Imported here, as only needed when recording
+            from core.frame_capture import FrameCapture
+            capture = FrameCapture(self.screen_size, capture_route)
 
         # main loop
+        frame = 0
         while self.running:
+            if profiler is not None:
+                profiler.begin_frame()
+                profiler.begin("input")
+
             # process input
             self.input.update()
             if self.input.quit:
                 self.running = False
 
             # update
+            if profiler is not None:
+                profiler.end()
+                profiler.begin("update")
             self.update()
+            if profiler is not None:
+                profiler.end()
+
+            # Record the frame before it is shown, reading the back buffer or the offscreen framebuffer
+            if capture is not None:
+                if profiler is not None:
+                    profiler.begin("capture")
+                capture.capture(self.context.resolve() if self.headless else 0)
+                if profiler is not None:
+                    profiler.end()
 
             # render
-            pygame.display.flip()
+            if self.headless:
+                # Nothing is shown, so frames are rendered as fast as possible
+                self.clock.tick()
+            else:
+                if profiler is not None:
+                    profiler.begin("flip")
+                pygame.display.flip()
+                if profiler is not None:
+                    profiler.end()
+
+                # make 60 FPS; time spent waiting is timed apart from the frame's work
+                if profiler is not None:
+                    profiler.begin("frame limit")
+                self.clock.tick(60)
+                if profiler is not None:
+                    profiler.end()
+            if profiler is not None:
+                profiler.end_frame()
+
+            frame += 1
+            if frame_count is not None and frame >= frame_count:
+                self.running = False
+
+        # Write the frames still being read
+        if capture is not None:
+            capture.finish()
+
+        # Read the timings still in flight, then report them
+        if profiler is not None:
+            profiler.finish()
+            FrameProfiler.active = None
+            profiler.print_summary()
+            if trace_route is not None:
+                profiler.write_trace(trace_route)
 
-            # make 60 FPS
-            self.clock.tick(60)
+        # Keep the last frame rendered without a window
+        if self.headless and output_route is not None:
+            self.context.save_image(output_route)
 
         # shutdown
+        if self.headless:
+            self.context.release()
         pygame.quit()
         sys.exit()
@@ -9,6 +9,9 @@ class Camera(Object3D):
     """
     def __init__(self, angle_of_view=60, aspect_ratio=1, near=0.1, far=1000):
         super().__init__()
+        # Store distances to near and far planes, used to divide frustum into clusters
+        self.near = near
+        self.far = far
         # Create projection and view matrix of camera
         self.project_matrix = Matrix.make_perspective(angle_of_view, aspect_ratio, near, far)
         self.view_matrix = Matrix.make_identity()
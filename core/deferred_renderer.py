@@ -0,0 +1,532 @@
+import numpy as np
+from OpenGL.GL import *
+from core.renderer import Renderer
+from core.frame_profiler import FrameProfiler
+from core.openGLUtils import OpenGLUtils
+from core.uniform import Uniform
+from core.uniform_buffer import UniformBuffer, CameraBuffer, DrawBuffer
+from core.texture_buffer import TextureBuffer, LightBuffer
+from core.shadow_cascades import ShadowCascades
+from geometry.box_geometry import BoxGeometry
+from light.light import Light
+from material.lambert_material import LambertMaterial
+from material.phong_material import PhongMaterial
+
+
+class DeferredRenderer(Renderer):
+    """
+    Renders lit materials into a G-buffer of albedo, normal and position, then shades each light once
+    over the pixels it reaches; unlit materials are drawn afterwards as in the forward renderer
+    """
+    # Texture units of the G-buffer textures read by the lighting and present passes
+    ALBEDO_UNIT = 6
+    NORMAL_UNIT = 7
+    POSITION_UNIT = 8
+    ACCUMULATION_UNIT = 9
+
+    # Materials whose lighting is calculated from the G-buffer
+    DEFERRED_MATERIALS = (LambertMaterial, PhongMaterial)
+
+    def __init__(self, clear_colour=[0, 0, 0]):
+        """
+        Creates the G-buffer and the programs of each pass
+        :param clear_colour: colour of background
+        """
+        super().__init__(clear_colour)
+        self.clear_colour = clear_colour
+
+        # G-buffer: albedo, normal with specular strength, world position with shininess, and depth
+        self.albedo_texture = self.create_texture(GL_RGBA8, GL_RGBA, GL_UNSIGNED_BYTE)
+        self.normal_texture = self.create_texture(GL_RGBA16F, GL_RGBA, GL_FLOAT)
+        self.position_texture = self.create_texture(GL_RGBA32F, GL_RGBA, GL_FLOAT)
+        self.depth_texture = self.create_texture(GL_DEPTH_COMPONENT24, GL_DEPTH_COMPONENT, GL_FLOAT)
+        self.gbuffer_ref = self.create_framebuffer(
+            [self.albedo_texture, self.normal_texture, self.position_texture], self.depth_texture)
+
+        # Lighting is accumulated into a separate target sharing the G-buffer depth,
+        # so unlit meshes can then be depth tested against lit ones
+        self.accumulation_texture = self.create_texture(GL_RGBA16F, GL_RGBA, GL_FLOAT)
+        self.lighting_ref = self.create_framebuffer([self.accumulation_texture], self.depth_texture)
+
+        # Geometry pass variants keyed by the name of the material's sampler, None for untextured materials,
+        # and the sampler of each textured variant
+        self.gbuffer_programs = {}
+        self.gbuffer_textures = {}
+        for sampler_name, data_type in [(None, None), ("texture", "sampler2D"), ("texture_array", "sampler2DArray")]:
+            header = (f"#define HAS_TEXTURE {int(sampler_name == 'texture')}\n"
+                      f"#define HAS_TEXTURE_ARRAY {int(sampler_name == 'texture_array')}\n")
+            program_ref = self.create_program(header + self.gbuffer_vs_code(), header + self.gbuffer_fs_code())
+            self.gbuffer_programs[sampler_name] = program_ref
+            if data_type is not None:
+                self.gbuffer_textures[sampler_name] = self.create_uniform(program_ref, sampler_name, data_type, [0, 1])
+
+        self.fullscreen_program_ref = self.create_program(self.fullscreen_vs_code(), self.lighting_fs_code())
+        self.volume_program_ref = self.create_program(self.volume_vs_code(), self.lighting_fs_code())
+        self.present_program_ref = self.create_program(self.present_vs_code(), self.present_fs_code())
+        # Index into the light list of each lighting program's first light, located once the programs link
+        self.fullscreen_first_light = self.create_uniform(self.fullscreen_program_ref, "first_light", "int", 0)
+        self.volume_first_light = self.create_uniform(self.volume_program_ref, "first_light", "int", 0)
+
+        # Indices of lights to shade, global lights first, then point lights
+        self.light_list_buffer = TextureBuffer("deferred_lights", TextureBuffer.DEFERRED_LIGHTS, GL_R32I)
+
+        # Cube of half-width 1, scaled by each point light's radius to enclose its volume
+        self.volume_geometry = BoxGeometry(width=2, height=2, depth=2)
+        self.volume_vao_ref = glGenVertexArrays(1)
+        glBindVertexArray(self.volume_vao_ref)
+        self.volume_geometry.attributes["vertex_position"].associate_variable(self.volume_program_ref,
+                                                                              "vertex_position")
+        # Full-screen passes generate their vertices from gl_VertexID
+        self.empty_vao_ref = glGenVertexArrays(1)
+        glBindVertexArray(0)
+
+    def create_texture(self, internal_format, pixel_format, pixel_type):
+        """
+        Creates a texture the size of the window to render into
+        :return: texture reference
+        """
+        width, height = self.window_size
+        texture_ref = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, texture_ref)
+        glTexImage2D(GL_TEXTURE_2D, 0, internal_format, width, height, 0, pixel_format, pixel_type, None)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        glBindTexture(GL_TEXTURE_2D, 0)
+        return texture_ref
+
+    @staticmethod
+    def create_framebuffer(colour_textures, depth_texture):
+        """
+        Creates a framebuffer rendering into the given textures
+        :param colour_textures: list of colour texture references, attached in order
+        :param depth_texture: depth texture reference
+        :return: framebuffer reference
+        """
+        # The render target bound by the caller, which may be an offscreen framebuffer, is bound again afterwards
+        target_ref = glGetIntegerv(GL_DRAW_FRAMEBUFFER_BINDING)
+        framebuffer_ref = glGenFramebuffers(1)
+        glBindFramebuffer(GL_FRAMEBUFFER, framebuffer_ref)
+        for index, texture_ref in enumerate(colour_textures):
+            glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0 + index, GL_TEXTURE_2D, texture_ref, 0)
+        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_TEXTURE_2D, depth_texture, 0)
+        glDrawBuffers(len(colour_textures), [GL_COLOR_ATTACHMENT0 + i for i in range(len(colour_textures))])
+
+        if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+            raise Exception("Error: G-buffer framebuffer is incomplete")
+        glBindFramebuffer(GL_FRAMEBUFFER, target_ref)
+        return framebuffer_ref
+
+    @staticmethod
+    def create_program(vs_code, fs_code):
+        """
+        Compiles a program and connects it to the shared blocks and samplers
+        :return: program reference
+        """
+        program_ref = OpenGLUtils.initialise_program(vs_code, fs_code, "DeferredRenderer")
+
+        def bind_shared_data():
+            UniformBuffer.bind_block(program_ref, "CameraBlock", UniformBuffer.CAMERA)
+            UniformBuffer.bind_block(program_ref, "DrawBlock", UniformBuffer.DRAW)
+            UniformBuffer.bind_block(program_ref, "ShadowBlock", UniformBuffer.SHADOW)
+            TextureBuffer.bind_sampler(program_ref, "light_data", TextureBuffer.LIGHT_DATA)
+            TextureBuffer.bind_sampler(program_ref, "shadow_map", ShadowCascades.TEXTURE_UNIT)
+            TextureBuffer.bind_sampler(program_ref, "deferred_lights", TextureBuffer.DEFERRED_LIGHTS)
+            TextureBuffer.bind_sampler(program_ref, "albedo_buffer", DeferredRenderer.ALBEDO_UNIT)
+            TextureBuffer.bind_sampler(program_ref, "normal_buffer", DeferredRenderer.NORMAL_UNIT)
+            TextureBuffer.bind_sampler(program_ref, "position_buffer", DeferredRenderer.POSITION_UNIT)
+            TextureBuffer.bind_sampler(program_ref, "accumulation_buffer", DeferredRenderer.ACCUMULATION_UNIT)
+
+        # Program may still be compiling during a batch
+        OpenGLUtils.when_linked(program_ref, bind_shared_data)
+        return program_ref
+
+    @staticmethod
+    def create_uniform(program_ref, variable_name, data_type, data):
+        """
+        Creates a Uniform, located in a program once it has linked
+        :param program_ref: reference to OpenGL program
+        :param variable_name: name of uniform variable
+        :param data_type: data type of uniform, such as int or sampler2D
+        :param data: initial data of uniform
+        :return: Uniform
+        """
+        uniform_object = Uniform(data_type, data)
+        OpenGLUtils.when_linked(program_ref, lambda: uniform_object.locate_variable(program_ref, variable_name))
+        return uniform_object
+
+    @staticmethod
+    def gbuffer_vs_code():
+        """
+        Vertex shader of the geometry pass, matching Lambert and Phong materials
+        """
+        return CameraBuffer.block_code + DrawBuffer.block_code + """
+        in vec3 vertex_position;
+        in vec2 vertex_uv;
+        in vec3 vertex_normal;
+
+        out vec3 position;
+        out vec2 UV;
+        out vec3 normal;
+
+        void main() {
+            gl_Position = projection_matrix * view_matrix * model_matrix * vec4(vertex_position, 1);
+            position = vec3(model_matrix * vec4(vertex_position, 1));
+            UV = vertex_uv;
+
+            normal = normalize(mat3(model_matrix) * vertex_normal);
+        }
+        """
+
+    @staticmethod
+    def gbuffer_fs_code():
+        """
+        Fragment shader of the geometry pass, writing surface properties instead of lighting
+        """
+        return DrawBuffer.block_code + """
+        #if HAS_TEXTURE
+        uniform sampler2D texture;
+        #endif
+        #if HAS_TEXTURE_ARRAY
+        uniform sampler2DArray texture_array;
+        #endif
+
+        in vec3 position;
+        in vec2 UV;
+        in vec3 normal;
+
+        layout(location = 0) out vec4 albedo;
+        layout(location = 1) out vec4 normal_specular;
+        layout(location = 2) out vec4 position_shininess;
+
+        void main() {
+            vec4 colour = vec4(base_colour, 1.0);
+
+            #if HAS_TEXTURE
+            colour *= texture2D(texture, UV);
+            #endif
+            #if HAS_TEXTURE_ARRAY
+            colour *= texture(texture_array, vec3(UV, texture_layer));
+            #endif
+
+            albedo = colour;
+            normal_specular = vec4(normalize(normal), specular_strength);
+            position_shininess = vec4(position, shininess);
+        }
+        """
+
+    @staticmethod
+    def fullscreen_vs_code():
+        """
+        Vertex shader covering the whole screen, used for lights without a position
+        """
+        return """
+        uniform isamplerBuffer deferred_lights;
+        uniform int first_light;
+
+        flat out int light_index;
+
+        void main() {
+            light_index = texelFetch(deferred_lights, first_light + gl_InstanceID).x;
+
+            // Single triangle covering the screen
+            vec2 corner = vec2((gl_VertexID << 1) & 2, gl_VertexID & 2);
+            gl_Position = vec4(corner * 2.0 - 1.0, 0.0, 1.0);
+        }
+        """
+
+    @staticmethod
+    def volume_vs_code():
+        """
+        Vertex shader scaling a cube around each point light to the light's radius
+        """
+        return CameraBuffer.block_code + LightBuffer.block_code + """
+        uniform isamplerBuffer deferred_lights;
+        uniform int first_light;
+
+        in vec3 vertex_position;
+        flat out int light_index;
+
+        void main() {
+            light_index = texelFetch(deferred_lights, first_light + gl_InstanceID).x;
+
+            // Radius of influence is stored alongside direction
+            vec4 direction_radius = texelFetch(light_data, light_index * 4 + 1);
+            vec3 centre = texelFetch(light_data, light_index * 4 + 2).xyz;
+            gl_Position = projection_matrix * view_matrix * vec4(centre + vertex_position * direction_radius.w, 1.0);
+        }
+        """
+
+    @staticmethod
+    def lighting_fs_code():
+        """
+        Fragment shader adding the contribution of one light to each pixel, using Phong shading
+        """
+        return CameraBuffer.block_code + LightBuffer.block_code + ShadowCascades.block_code + """
+        uniform sampler2D albedo_buffer;
+        uniform sampler2D normal_buffer;
+        uniform sampler2D position_buffer;
+
+        flat in int light_index;
+        out vec4 fragColor;
+
+        vec3 lightCalc(Light light, vec3 point_position, vec3 point_normal, float specular_strength, float shininess) {
+            float ambient = 0;
+            float diffuse = 0;
+            float specular = 0;
+            float attenuation = 1;
+            vec3 light_direction = vec3(0, 0, 0);
+
+            if (light.light_type == 1)
+            {
+                ambient = 1;
+            }
+            else if (light.light_type == 2)
+            {
+                light_direction = normalize(light.direction);
+            }
+            else if (light.light_type == 3)
+            {
+                light_direction = normalize(point_position - light.position);
+                float distance = length(light.position - point_position);
+
+                attenuation = 1.0 / (light.attenuation[0] +
+                                    light.attenuation[1] * distance +
+                                    light.attenuation[2] * distance * distance);
+            }
+
+            if (light.light_type > 1)
+            {
+                diffuse = max(dot(point_normal, -light_direction), 0.0);
+                diffuse *= attenuation;
+
+                if (diffuse > 0 && specular_strength > 0)
+                {
+                    vec3 view_direction = normalize(view_position - point_position);
+                    vec3 reflect_direction = reflect(light_direction, point_normal);
+                    specular = max(dot(view_direction, reflect_direction), 0.0);
+                    specular = specular_strength * pow(specular, shininess);
+                }
+            }
+
+            return light.colour * (ambient + diffuse + specular);
+        }
+
+        void main() {
+            ivec2 pixel = ivec2(gl_FragCoord.xy);
+            vec4 normal_specular = texelFetch(normal_buffer, pixel, 0);
+
+            // Pixels without a lit surface have no normal
+            if (normal_specular.xyz == vec3(0, 0, 0))
+            {
+                discard;
+            }
+
+            vec4 albedo = texelFetch(albedo_buffer, pixel, 0);
+            vec4 position_shininess = texelFetch(position_buffer, pixel, 0);
+
+            vec3 total = lightCalc(getLight(light_index), position_shininess.xyz, normal_specular.xyz,
+                                   normal_specular.w, position_shininess.w);
+            // One directional light may be blocked by shadow casters
+            if (light_index == shadow_light)
+            {
+                total *= getShadow(position_shininess.xyz, normal_specular.xyz);
+            }
+            fragColor = vec4(albedo.rgb * total, 1.0);
+        }
+        """
+
+    @staticmethod
+    def present_vs_code():
+        """
+        Vertex shader covering the whole screen, used to copy the lit image to the render target
+        """
+        return """
+        void main() {
+            vec2 corner = vec2((gl_VertexID << 1) & 2, gl_VertexID & 2);
+            gl_Position = vec4(corner * 2.0 - 1.0, 0.0, 1.0);
+        }
+        """
+
+    @staticmethod
+    def present_fs_code():
+        """
+        Fragment shader copying the lit image
+        """
+        return """
+        uniform sampler2D accumulation_buffer;
+        out vec4 fragColor;
+
+        void main() {
+            fragColor = texelFetch(accumulation_buffer, ivec2(gl_FragCoord.xy), 0);
+        }
+        """
+
+    def select_variants(self, mesh_list):
+        """
+        Switches the material of each mesh drawn by the forward pass to the variant matching the scene;
+        lit materials are drawn with the geometry pass programs instead
+        :param mesh_list: list of meshes to draw
+        """
+        for mesh in mesh_list:
+            if not isinstance(mesh.material, DeferredRenderer.DEFERRED_MATERIALS):
+                mesh.material.select_variant(self.scene_defines)
+
+    @staticmethod
+    def get_sort_key(mesh):
+        """
+        Returns the key meshes are ordered by when drawn; lit materials are grouped by
+        the geometry pass variant they use
+        :param mesh: mesh to draw
+        :return: key grouping meshes by program and texture, with meshes drawn last after all others
+        """
+        if isinstance(mesh.material, DeferredRenderer.DEFERRED_MATERIALS):
+            textures = mesh.material.get_sort_key()[1]
+            # Geometry pass programs are not material programs, so group them before all others
+            return False, -1, textures
+        return (mesh.material.draw_last,) + mesh.material.get_sort_key()
+
+    def render(self, scene, camera):
+        """
+        Renders the given scene using the given camera
+        :param scene: scene to render
+        :param camera: camera to render with
+        """
+        # Final image is copied to whichever framebuffer was bound by the caller
+        target_ref = glGetIntegerv(GL_DRAW_FRAMEBUFFER_BINDING)
+
+        mesh_list = self.prepare_frame(scene, camera)
+        deferred = [isinstance(mesh.material, DeferredRenderer.DEFERRED_MATERIALS) for mesh in mesh_list]
+
+        profiler = FrameProfiler.active
+        if profiler is not None:
+            profiler.begin("geometry pass", gpu=True)
+        self.geometry_pass(mesh_list, deferred)
+        if profiler is not None:
+            profiler.end()
+            profiler.begin("lighting pass", gpu=True)
+        self.lighting_pass()
+        if profiler is not None:
+            profiler.end()
+            profiler.begin("draw submission", gpu=True)
+
+        # Unlit meshes are drawn over the lit image, tested against the G-buffer depth
+        glEnable(GL_DEPTH_TEST)
+        for mesh_index, mesh in enumerate(mesh_list):
+            if not deferred[mesh_index]:
+                self.draw_mesh(mesh_index, mesh)
+
+        if profiler is not None:
+            profiler.end()
+            profiler.begin("present", gpu=True)
+        self.present(target_ref)
+        if profiler is not None:
+            profiler.end()
+        self.finish_frame()
+
+    def geometry_pass(self, mesh_list, deferred):
+        """
+        Writes albedo, normal and position of lit meshes into the G-buffer
+        :param mesh_list: list of meshes returned by prepare_frame
+        :param deferred: whether each mesh is lit from the G-buffer
+        """
+        glBindFramebuffer(GL_FRAMEBUFFER, self.gbuffer_ref)
+        glClearColor(0, 0, 0, 0)
+        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        glEnable(GL_DEPTH_TEST)
+        glDisable(GL_BLEND)
+
+        for mesh_index, mesh in enumerate(mesh_list):
+            if not deferred[mesh_index]:
+                continue
+
+            # Choose the variant matching the material, taking the texture from the material
+            material_uniforms = mesh.material.uniforms
+            sampler_name = next((name for name in self.gbuffer_textures if name in material_uniforms), None)
+            program_ref = self.gbuffer_programs[sampler_name]
+            self.use_program(program_ref)
+            if sampler_name is not None:
+                sampler = self.gbuffer_textures[sampler_name]
+                sampler.data = material_uniforms[sampler_name].data
+                sampler.upload_data()
+
+            mesh.bind_vertex_array(program_ref)
+            self.draw_buffer.bind_record(mesh_index)
+
+            glDrawArrays(mesh.material.settings["draw_style"], 0, mesh.geometry.vertex_count)
+            self.draw_count += 1
+
+        glEnable(GL_BLEND)
+
+    def lighting_pass(self):
+        """
+        Adds the contribution of every light, with a full-screen pass for ambient and directional lights
+        and a volume around each point light
+        """
+        glBindFramebuffer(GL_FRAMEBUFFER, self.lighting_ref)
+        glClearColor(self.clear_colour[0], self.clear_colour[1], self.clear_colour[2], 1.0)
+        glClear(GL_COLOR_BUFFER_BIT)
+
+        # Bind G-buffer textures for reading
+        for unit, texture_ref in [(DeferredRenderer.ALBEDO_UNIT, self.albedo_texture),
+                                  (DeferredRenderer.NORMAL_UNIT, self.normal_texture),
+                                  (DeferredRenderer.POSITION_UNIT, self.position_texture)]:
+            glActiveTexture(GL_TEXTURE0 + unit)
+            glBindTexture(GL_TEXTURE_2D, texture_ref)
+
+        # Lights without a position first, followed by point lights
+        light_types = self.light_buffer.light_types
+        global_lights = np.flatnonzero((light_types == Light.AMBIENT) | (light_types == Light.DIRECTIONAL))
+        point_lights = np.flatnonzero(light_types == Light.POINT)
+        self.light_list_buffer.upload_data(np.concatenate([global_lights, point_lights]).astype(np.int32))
+        self.light_list_buffer.bind()
+
+        # Each light adds to the accumulated colour, without testing or writing depth
+        glDisable(GL_DEPTH_TEST)
+        glDepthMask(GL_FALSE)
+        glEnable(GL_BLEND)
+        glBlendFunc(GL_ONE, GL_ONE)
+
+        if len(global_lights) > 0:
+            self.use_program(self.fullscreen_program_ref)
+            self.fullscreen_first_light.data = 0
+            self.fullscreen_first_light.upload_data()
+            glBindVertexArray(self.empty_vao_ref)
+            glDrawArraysInstanced(GL_TRIANGLES, 0, 3, len(global_lights))
+            self.draw_count += 1
+
+        if len(point_lights) > 0:
+            # Draw back faces only, so each pixel is shaded once even when the camera is inside a volume
+            glEnable(GL_CULL_FACE)
+            glCullFace(GL_FRONT)
+            self.use_program(self.volume_program_ref)
+            self.volume_first_light.data = len(global_lights)
+            self.volume_first_light.upload_data()
+            glBindVertexArray(self.volume_vao_ref)
+            glDrawArraysInstanced(GL_TRIANGLES, 0, self.volume_geometry.vertex_count, len(point_lights))
+            self.draw_count += 1
+            glCullFace(GL_BACK)
+            glDisable(GL_CULL_FACE)
+
+        glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+        glDepthMask(GL_TRUE)
+        glEnable(GL_DEPTH_TEST)
+
+    def present(self, target_ref):
+        """
+        Copies the lit image into the render target
+        :param target_ref: framebuffer bound when rendering started
+        """
+        glBindFramebuffer(GL_FRAMEBUFFER, target_ref)
+        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        glDisable(GL_DEPTH_TEST)
+        glDisable(GL_BLEND)
+
+        glActiveTexture(GL_TEXTURE0 + DeferredRenderer.ACCUMULATION_UNIT)
+        glBindTexture(GL_TEXTURE_2D, self.accumulation_texture)
+        self.use_program(self.present_program_ref)
+        glBindVertexArray(self.empty_vao_ref)
+        glDrawArrays(GL_TRIANGLES, 0, 3)
+        self.draw_count += 1
+
+        glEnable(GL_BLEND)
+        glEnable(GL_DEPTH_TEST)
@@ -0,0 +1,161 @@
+import ctypes
+import os
+import queue
+import subprocess
+import threading
+import numpy as np
+import pygame
+from OpenGL.GL import *
+
+
+class FrameCapture(object):
+    """
+    Records rendered frames to a video through ffmpeg, or to a numbered sequence of PNG images, without
+    stalling rendering. Each frame is read into one of a ring of pixel buffers, which is only mapped once
+    the ring comes round to it again, by when the GPU has long finished writing it; the pixels are then
+    encoded on a background thread
+    """
+    # Pixel buffers in the ring, so a buffer is mapped this many frames after it was read into
+    BUFFER_COUNT = 3
+
+    # Frames waiting to be written before capturing blocks, so memory use is bounded if writing falls behind
+    QUEUE_LENGTH = 8
+
+    def __init__(self, size, output_route, frame_rate=60, buffer_count=BUFFER_COUNT):
+        """
+        Creates the pixel buffers and starts the writer
+        :param size: [width, height] of frames
+        :param output_route: route of video file, or of images with a number pattern such as frames/%05d.png
+        :param frame_rate: frames per second of video
+        :param buffer_count: number of pixel buffers in the ring
+        """
+        self.width, self.height = size
+        self.output_route = output_route
+        # 4 bytes per pixel, so rows need no padding and reads take the driver's fast path
+        self.frame_size = self.width * self.height * 4
+
+        self.buffer_refs = glGenBuffers(buffer_count)
+        for buffer_ref in self.buffer_refs:
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, buffer_ref)
+            glBufferData(GL_PIXEL_PACK_BUFFER, self.frame_size, None, GL_STREAM_READ)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+
+        # Buffer the next frame is read into, and the fence of each buffer's read still in flight
+        self.buffer_index = 0
+        self.fences = [None] * buffer_count
+
+        # Arrays receiving mapped pixels, reused once the writer is done with them
+        self.free_frames = queue.Queue()
+        for i in range(buffer_count + FrameCapture.QUEUE_LENGTH):
+            self.free_frames.put(np.empty((self.height, self.width, 4), dtype=np.uint8))
+        self.frames = queue.Queue(maxsize=FrameCapture.QUEUE_LENGTH)
+
+        # Number of frames captured, and written by the writer
+        self.frame_count = 0
+        self.written_count = 0
+
+        # Image sequences are written by the writer itself, videos through an ffmpeg pipe
+        self.process = None
+        if "%" not in output_route:
+            self.process = subprocess.Popen([
+                "ffmpeg", "-y", "-loglevel", "error",
+                "-f", "rawvideo", "-pix_fmt", "rgba", "-s", f"{self.width}x{self.height}", "-r", str(frame_rate),
+                "-i", "-",
+                # OpenGL reads the bottom row first
+                "-vf", "vflip", "-pix_fmt", "yuv420p", output_route
+            ], stdin=subprocess.PIPE)
+        else:
+            folder = os.path.dirname(output_route)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+
+        self.error = None
+        self.writer = threading.Thread(target=self.write_frames, daemon=True)
+        self.writer.start()
+
+    def capture(self, framebuffer_ref=0):
+        """
+        Starts reading the finished frame into the next pixel buffer, and passes on the frame read
+        into it a ring earlier
+        :param framebuffer_ref: framebuffer to read, by default the window's back buffer
+        """
+        if self.error is not None:
+            raise self.error
+
+        # The buffer's previous frame is passed on before the buffer is reused
+        if self.fences[self.buffer_index] is not None:
+            self.map_frame(self.buffer_index)
+
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, framebuffer_ref)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, self.buffer_refs[self.buffer_index])
+        # With a pixel buffer bound, the read is queued and returns without waiting for rendering to finish
+        glReadPixels(0, 0, self.width, self.height, GL_RGBA, GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        self.fences[self.buffer_index] = glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+
+        self.buffer_index = (self.buffer_index + 1) % len(self.buffer_refs)
+        self.frame_count += 1
+
+    def map_frame(self, index):
+        """
+        Copies the pixels of a buffer, once read, into a free array and queues them for writing
+        :param index: index of buffer in the ring
+        """
+        # Normally long signalled, so returns immediately
+        glClientWaitSync(self.fences[index], GL_SYNC_FLUSH_COMMANDS_BIT, 1000000000)
+        glDeleteSync(self.fences[index])
+        self.fences[index] = None
+
+        frame = self.free_frames.get()
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, self.buffer_refs[index])
+        address = glMapBufferRange(GL_PIXEL_PACK_BUFFER, 0, self.frame_size, GL_MAP_READ_BIT)
+        ctypes.memmove(frame.ctypes.data, address, self.frame_size)
+        glUnmapBuffer(GL_PIXEL_PACK_BUFFER)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+
+        # Blocks only if the writer has fallen QUEUE_LENGTH frames behind
+        self.frames.put(frame)
+
+    def write_frames(self):
+        """
+        Writes queued frames in order until the capture finishes; runs on the writer thread
+        """
+        try:
+            while True:
+                frame = self.frames.get()
+                if frame is None:
+                    break
+                if self.process is not None:
+                    self.process.stdin.write(frame.data)
+                else:
+                    # Rows are stored bottom first, so are flipped while saving
+                    image = pygame.image.frombuffer(frame.data, (self.width, self.height), "RGBA")
+                    pygame.image.save(pygame.transform.flip(image, False, True),
+                                      self.output_route % self.written_count)
+                self.written_count += 1
+                self.free_frames.put(frame)
+        except Exception as error:
+            # Raised on the main thread by the next capture or by finish
+            self.error = error
+            # Keep consuming, so the main thread never blocks on a full queue
+            while self.frames.get() is not None:
+                pass
+
+    def finish(self):
+        """
+        Passes on the frames still being read, waits for every frame to be written and deletes the buffers
+        """
+        for offset in range(len(self.buffer_refs)):
+            index = (self.buffer_index + offset) % len(self.buffer_refs)
+            if self.fences[index] is not None:
+                self.map_frame(index)
+        self.frames.put(None)
+        self.writer.join()
+
+        if self.process is not None:
+            self.process.stdin.close()
+            self.process.wait()
+        glDeleteBuffers(len(self.buffer_refs), self.buffer_refs)
+
+        if self.error is not None:
+            raise self.error
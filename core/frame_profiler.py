@@ -0,0 +1,200 @@
+import collections
+import ctypes
+import json
+import time
+import numpy as np
+from OpenGL.GL import *
+
+
+class FrameProfiler(object):
+    """
+    Times the phases of each frame on the CPU, and the passes of each frame on the GPU through elapsed time
+    queries. Timings are kept as a rolling summary of recent frames and, if a trace is wanted, as events
+    in Chrome's trace format, which can be opened in chrome://tracing or Perfetto.
+    Code being timed finds the profiler in FrameProfiler.active, which is None unless profiling, so timing
+    costs a single comparison per phase when turned off
+    """
+    # Profiler timing the current frame, or None when profiling is off
+    active = None
+
+    # Sets of queries in flight; a set is read when reused, by when the GPU has normally finished its frame
+    QUERY_SETS = 2
+
+    # Frames over which the rolling summary is calculated
+    WINDOW = 300
+
+    # Thread ids of the CPU and GPU tracks of the trace
+    CPU_TRACK = 1
+    GPU_TRACK = 2
+
+    def __init__(self, trace=False, window=WINDOW):
+        """
+        Creates a profiler, which times frames once made active
+        :param trace: whether every event is kept for export as a trace, rather than only the rolling summary
+        :param window: number of frames the rolling summary is calculated over
+        """
+        self.trace = trace
+        self.events = []
+
+        # Recent durations in milliseconds, keyed by "cpu/<phase>" or "gpu/<pass>"
+        self.window = window
+        self.durations = {}
+
+        # Phases begun and not yet ended, as (name, start time, whether timed on the GPU)
+        self.stack = []
+        self.start_time = time.perf_counter()
+        self.frame_index = -1
+
+        # Query objects of each set, with the names and submission times of the passes they timed
+        self.query_refs = [[] for i in range(FrameProfiler.QUERY_SETS)]
+        self.query_passes = [[] for i in range(FrameProfiler.QUERY_SETS)]
+        # Time the previous GPU event ends on the trace's GPU track
+        self.gpu_track_end = 0
+        # Receives each query's result; PyOpenGL cannot allocate 64-bit results itself
+        self.query_result = ctypes.c_uint64()
+
+    def now(self):
+        """
+        Returns the time since the profiler was created
+        :return: time in microseconds, the unit of trace events
+        """
+        return (time.perf_counter() - self.start_time) * 1000000
+
+    def begin_frame(self):
+        """
+        Starts timing a frame, reading the GPU timings of the frame that last used this frame's query set
+        """
+        self.frame_index += 1
+        query_set = self.frame_index % FrameProfiler.QUERY_SETS
+        self.read_queries(query_set)
+        self.begin("frame")
+
+    def end_frame(self):
+        """
+        Finishes timing a frame
+        """
+        self.end()
+
+    def begin(self, name, gpu=False):
+        """
+        Starts timing a phase of the frame, which may contain other phases
+        :param name: name of phase
+        :param gpu: whether the GPU time of the pass drawn by this phase is also measured;
+                    elapsed time queries cannot overlap, so GPU passes must not contain one another
+        """
+        self.stack.append((name, self.now(), gpu))
+        if gpu:
+            query_set = self.frame_index % FrameProfiler.QUERY_SETS
+            refs = self.query_refs[query_set]
+            passes = self.query_passes[query_set]
+            # Queries are created as the first frames need them, then reused
+            if len(passes) == len(refs):
+                refs.append(glGenQueries(1)[0])
+            glBeginQuery(GL_TIME_ELAPSED, refs[len(passes)])
+            passes.append((name, self.stack[-1][1]))
+
+    def end(self):
+        """
+        Finishes timing the most recently begun phase
+        """
+        name, start, gpu = self.stack.pop()
+        if gpu:
+            glEndQuery(GL_TIME_ELAPSED)
+        end = self.now()
+        self.add_event("cpu", name, start, end - start, FrameProfiler.CPU_TRACK)
+
+    def read_queries(self, query_set):
+        """
+        Reads the GPU times of the passes timed by a set of queries; with the set two frames old, the results
+        are normally available, and are otherwise waited for, as the GPU is then more than a frame behind
+        :param query_set: index of query set
+        """
+        passes = self.query_passes[query_set]
+        read_time = self.now()
+        total = 0
+        for query_ref, (name, submit_time) in zip(self.query_refs[query_set], passes):
+            glGetQueryObjectui64v(query_ref, GL_QUERY_RESULT, ctypes.byref(self.query_result))
+            duration = self.query_result.value / 1000
+            # A pass cannot take longer than has passed since it was submitted; some drivers, such as llvmpipe,
+            # report such times for the first queries made, which are discarded
+            if duration > read_time - submit_time:
+                continue
+            # Elapsed time queries give durations only, so each pass is placed on the GPU track when it was
+            # submitted, or once the previous pass ended if later
+            start = max(submit_time, self.gpu_track_end)
+            self.add_event("gpu", name, start, duration, FrameProfiler.GPU_TRACK)
+            self.gpu_track_end = start + duration
+            total += duration
+        # GPU time of the whole frame is the sum of its passes, excluding the gaps between them
+        if passes:
+            self.add_duration("gpu/frame", total)
+        self.query_passes[query_set] = []
+
+    def add_event(self, category, name, start, duration, track):
+        """
+        Records the duration of a phase or pass
+        :param category: "cpu" or "gpu"
+        :param name: name of phase or pass
+        :param start: start time in microseconds
+        :param duration: duration in microseconds
+        :param track: thread id of the trace track the event is shown on
+        """
+        self.add_duration(f"{category}/{name}", duration)
+        if self.trace:
+            self.events.append({"name": name, "cat": category, "ph": "X", "ts": start, "dur": duration,
+                                "pid": 1, "tid": track})
+
+    def add_duration(self, key, duration):
+        """
+        Adds a duration to the rolling summary, dropping the oldest once the window is full
+        :param key: "cpu/<phase>" or "gpu/<pass>"
+        :param duration: duration in microseconds
+        """
+        durations = self.durations.get(key)
+        if durations is None:
+            durations = self.durations[key] = collections.deque(maxlen=self.window)
+        durations.append(duration / 1000)
+
+    def finish(self):
+        """
+        Reads the GPU timings still in flight and deletes the queries
+        """
+        for offset in range(1, FrameProfiler.QUERY_SETS + 1):
+            query_set = (self.frame_index + offset) % FrameProfiler.QUERY_SETS
+            self.read_queries(query_set)
+            if self.query_refs[query_set]:
+                glDeleteQueries(len(self.query_refs[query_set]), self.query_refs[query_set])
+            self.query_refs[query_set] = []
+
+    def summary(self):
+        """
+        Summarises the durations of each phase and pass over the recent frames
+        :return: dictionary of {"cpu/<phase>" or "gpu/<pass>": {"count", "mean", "p50", "p95", "p99"}},
+                 durations in milliseconds
+        """
+        summary = {}
+        for key, durations in self.durations.items():
+            values = np.array(durations)
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            summary[key] = {"count": len(values), "mean": float(values.mean()),
+                            "p50": float(p50), "p95": float(p95), "p99": float(p99)}
+        return summary
+
+    def print_summary(self):
+        """
+        Prints the rolling summary as a table
+        """
+        print(f"{'phase':<28}{'frames':>8}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}  (ms)")
+        for key, values in sorted(self.summary().items()):
+            print(f"{key:<28}{values['count']:>8}{values['mean']:>10.3f}{values['p50']:>10.3f}"
+                  f"{values['p95']:>10.3f}{values['p99']:>10.3f}")
+
+    def write_trace(self, file_route):
+        """
+        Writes the recorded events as a Chrome trace
+        :param file_route: route of JSON file
+        """
+        metadata = [{"name": "thread_name", "ph": "M", "pid": 1, "tid": track, "args": {"name": name}}
+                    for track, name in [(FrameProfiler.CPU_TRACK, "CPU"), (FrameProfiler.GPU_TRACK, "GPU")]]
+        with open(file_route, "w") as file:
+            json.dump({"traceEvents": metadata + self.events, "displayTimeUnit": "ms"}, file)
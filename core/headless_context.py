@@ -0,0 +1,188 @@
+import ctypes
+import os
+import numpy as np
+import pygame
+import OpenGL.platform
+from OpenGL.GL import *
+
+
+class HeadlessContext(object):
+    """
+    OpenGL context without a window, rendering into a framebuffer object of any size. The context is created
+    through EGL, or through OSMesa on systems without EGL; either runs on Mesa's llvmpipe without a GPU.
+    PyOpenGL loads one of them when OpenGL is first imported, so PYOPENGL_PLATFORM must be set to "egl"
+    or "osmesa" before then
+    """
+    # OpenGL version requested, matching the shaders' #version
+    VERSION = (3, 3)
+
+    def __init__(self, size, samples=0):
+        """
+        Creates a context and makes its framebuffer the render target
+        :param size: [width, height] of framebuffer
+        :param samples: number of samples per pixel, or 0 to render without multisampling
+        """
+        self.size = tuple(size)
+        self.samples = samples
+
+        platform = type(OpenGL.platform.PLATFORM).__name__
+        if platform == "EGLPlatform":
+            self.create_egl_context()
+        elif platform == "OSMesaPlatform":
+            self.create_osmesa_context()
+        else:
+            raise Exception(f"Headless rendering needs PYOPENGL_PLATFORM set to egl or osmesa before OpenGL "
+                            f"is imported, but {platform} was loaded")
+        self.platform = platform
+
+        self.framebuffer_ref, self.renderbuffer_refs = self.create_framebuffer(samples)
+        # Multisampled pixels are resolved into a second framebuffer before being read
+        if samples > 0:
+            self.resolve_ref, self.resolve_renderbuffer_refs = self.create_framebuffer(0)
+        else:
+            self.resolve_ref, self.resolve_renderbuffer_refs = self.framebuffer_ref, []
+
+        # Renderers draw into whichever framebuffer is bound, filling the viewport
+        glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer_ref)
+        glViewport(0, 0, self.size[0], self.size[1])
+
+    def create_egl_context(self):
+        """
+        Creates a context through EGL, without a surface
+        """
+        from OpenGL import EGL
+
+        # Without a display server, Mesa renders through its surfaceless platform
+        os.environ.setdefault("EGL_PLATFORM", "surfaceless")
+        self.display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+        if not EGL.eglInitialize(self.display, None, None):
+            raise Exception("Unable to initialise EGL")
+        EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+
+        config = EGL.EGLConfig()
+        config_count = EGL.EGLint()
+        # Configurations default to window surfaces, which surfaceless platforms do not offer
+        config_attributes = (EGL.EGLint * 5)(EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+                                             EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT, EGL.EGL_NONE)
+        EGL.eglChooseConfig(self.display, config_attributes, ctypes.pointer(config), 1, ctypes.pointer(config_count))
+        if config_count.value == 0:
+            raise Exception("No EGL configuration supports OpenGL")
+
+        context_attributes = (EGL.EGLint * 7)(
+            EGL.EGL_CONTEXT_MAJOR_VERSION, HeadlessContext.VERSION[0],
+            EGL.EGL_CONTEXT_MINOR_VERSION, HeadlessContext.VERSION[1],
+            EGL.EGL_CONTEXT_OPENGL_PROFILE_MASK, EGL.EGL_CONTEXT_OPENGL_CORE_PROFILE_BIT,
+            EGL.EGL_NONE
+        )
+        self.context = EGL.eglCreateContext(self.display, config, EGL.EGL_NO_CONTEXT, context_attributes)
+        if not self.context:
+            raise Exception(f"Unable to create an OpenGL {HeadlessContext.VERSION[0]}.{HeadlessContext.VERSION[1]} "
+                            f"context through EGL")
+
+        # Rendering goes to a framebuffer object, so the context needs no surface
+        if not EGL.eglMakeCurrent(self.display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, self.context):
+            raise Exception("Unable to make the EGL context current")
+
+    def create_osmesa_context(self):
+        """
+        Creates a context through OSMesa
+        """
+        from OpenGL import arrays, osmesa
+
+        attributes = arrays.GLintArray.asArray([
+            osmesa.OSMESA_FORMAT, osmesa.OSMESA_RGBA,
+            osmesa.OSMESA_DEPTH_BITS, 24,
+            osmesa.OSMESA_PROFILE, osmesa.OSMESA_CORE_PROFILE,
+            osmesa.OSMESA_CONTEXT_MAJOR_VERSION, HeadlessContext.VERSION[0],
+            osmesa.OSMESA_CONTEXT_MINOR_VERSION, HeadlessContext.VERSION[1],
+            0
+        ])
+        self.context = osmesa.OSMesaCreateContextAttribs(attributes, None)
+        if not self.context:
+            raise Exception("Unable to create an OSMesa context")
+
+        # OSMesa renders into memory it is given; everything is drawn into the framebuffer object,
+        # so a single pixel is enough
+        self.buffer = arrays.GLubyteArray.zeros((1, 1, 4))
+        if not osmesa.OSMesaMakeCurrent(self.context, self.buffer, GL_UNSIGNED_BYTE, 1, 1):
+            raise Exception("Unable to make the OSMesa context current")
+
+    def create_framebuffer(self, samples):
+        """
+        Creates a framebuffer with colour and depth renderbuffers the size of the context
+        :param samples: number of samples per pixel, or 0 for none
+        :return: (framebuffer reference, renderbuffer references)
+        """
+        width, height = self.size
+        framebuffer_ref = glGenFramebuffers(1)
+        glBindFramebuffer(GL_FRAMEBUFFER, framebuffer_ref)
+
+        renderbuffer_refs = glGenRenderbuffers(2)
+        for renderbuffer_ref, internal_format, attachment in zip(renderbuffer_refs,
+                                                                 [GL_RGBA8, GL_DEPTH_COMPONENT24],
+                                                                 [GL_COLOR_ATTACHMENT0, GL_DEPTH_ATTACHMENT]):
+            glBindRenderbuffer(GL_RENDERBUFFER, renderbuffer_ref)
+            glRenderbufferStorageMultisample(GL_RENDERBUFFER, samples, internal_format, width, height)
+            glFramebufferRenderbuffer(GL_FRAMEBUFFER, attachment, GL_RENDERBUFFER, renderbuffer_ref)
+        glBindRenderbuffer(GL_RENDERBUFFER, 0)
+
+        if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+            raise Exception(f"Unable to create a {width}x{height} framebuffer with {samples} samples")
+        return framebuffer_ref, list(renderbuffer_refs)
+
+    def resolve(self):
+        """
+        Resolves the samples of each pixel, if multisampled, into a framebuffer that can be read
+        :return: reference of framebuffer holding the rendered image
+        """
+        if self.samples > 0:
+            width, height = self.size
+            glBindFramebuffer(GL_READ_FRAMEBUFFER, self.framebuffer_ref)
+            glBindFramebuffer(GL_DRAW_FRAMEBUFFER, self.resolve_ref)
+            glBlitFramebuffer(0, 0, width, height, 0, 0, width, height, GL_COLOR_BUFFER_BIT, GL_NEAREST)
+            glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer_ref)
+        return self.resolve_ref
+
+    def read_pixels(self):
+        """
+        Reads the rendered image, waiting for rendering to finish
+        :return: array of shape (height, width, 3), top row first
+        """
+        width, height = self.size
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, self.resolve())
+
+        # Rows of RGB pixels are not padded to 4 bytes
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        data = glReadPixels(0, 0, width, height, GL_RGB, GL_UNSIGNED_BYTE)
+        glPixelStorei(GL_PACK_ALIGNMENT, 4)
+
+        glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer_ref)
+        # OpenGL stores the bottom row first
+        return np.frombuffer(data, dtype=np.uint8).reshape(height, width, 3)[::-1]
+
+    def save_image(self, file_route):
+        """
+        Saves the rendered image to a file
+        :param file_route: route to image file, its type given by its extension
+        """
+        pixels = np.ascontiguousarray(self.read_pixels())
+        pygame.image.save(pygame.image.frombuffer(pixels.tobytes(), self.size, "RGB"), file_route)
+
+    def release(self):
+        """
+        Deletes the framebuffers and destroys the context
+        """
+        glDeleteFramebuffers(1, [self.framebuffer_ref])
+        glDeleteRenderbuffers(len(self.renderbuffer_refs), self.renderbuffer_refs)
+        if self.samples > 0:
+            glDeleteFramebuffers(1, [self.resolve_ref])
+            glDeleteRenderbuffers(len(self.resolve_renderbuffer_refs), self.resolve_renderbuffer_refs)
+
+        if self.platform == "EGLPlatform":
+            from OpenGL import EGL
+            EGL.eglMakeCurrent(self.display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, EGL.EGL_NO_CONTEXT)
+            EGL.eglDestroyContext(self.display, self.context)
+            EGL.eglTerminate(self.display)
+        else:
+            from OpenGL import osmesa
+            osmesa.OSMesaDestroyContext(self.context)
@@ -0,0 +1,159 @@
+import numpy as np
+from math import log
+from OpenGL.GL import *
+from core.uniform_buffer import UniformBuffer
+from core.texture_buffer import TextureBuffer
+
+
+class LightClusters(UniformBuffer):
+    """
+    Divides the view frustum into a grid of clusters and assigns point lights to the clusters they reach,
+    so each fragment only evaluates the point lights of its own cluster
+    """
+    # Number of clusters across the screen, down the screen and along depth
+    GRID_SIZE = (16, 9, 24)
+
+    block_code = """
+    layout(std140) uniform ClusterBlock {
+        ivec4 cluster_count;
+        vec4 cluster_scale;
+    };
+
+    uniform isamplerBuffer cluster_grid;
+    uniform isamplerBuffer cluster_lights;
+
+    ivec2 getCluster(vec3 world_position) {
+        // Depth slices are spaced exponentially between the near and far planes
+        float depth = -(view_matrix * vec4(world_position, 1.0)).z;
+        vec3 cell = vec3(gl_FragCoord.xy * cluster_scale.xy, log(max(depth, 0.0001)) * cluster_scale.z - cluster_scale.w);
+        ivec3 clamped = clamp(ivec3(cell), ivec3(0), cluster_count.xyz - 1);
+        int index = (clamped.z * cluster_count.y + clamped.y) * cluster_count.x + clamped.x;
+        // Offset into cluster_lights and number of lights
+        return texelFetch(cluster_grid, index).xy;
+    }
+    """
+
+    def __init__(self, enabled=True):
+        """
+        Creates the cluster uniform block and the buffer textures holding the cluster grid and light lists
+        :param enabled: whether shaders should read point lights from clusters
+        """
+        super().__init__("ClusterBlock", UniformBuffer.CLUSTER, 32)
+        self.enabled = enabled
+
+        # ivec4 cluster_count followed by vec4 cluster_scale
+        self.data = np.zeros(8, dtype=np.float32)
+        self.data.view(np.int32)[0:4] = [*LightClusters.GRID_SIZE, int(enabled)]
+        self.upload_data(self.data)
+
+        # Offset and count of lights for each cluster, and the concatenated light lists
+        self.grid_buffer = TextureBuffer("cluster_grid", TextureBuffer.CLUSTER_GRID, GL_RG32I)
+        self.light_index_buffer = TextureBuffer("cluster_lights", TextureBuffer.CLUSTER_LIGHTS, GL_R32I)
+
+        # Number of light and cluster pairs in the last frame
+        self.assignment_count = 0
+
+    def update(self, camera, light_buffer, screen_size):
+        """
+        Assigns point lights to clusters and uploads the grid and light lists
+        :param camera: camera to render with
+        :param light_buffer: LightBuffer holding the lights of the scene
+        :param screen_size: (width, height) of the render target
+        """
+        size_x, size_y, size_z = LightClusters.GRID_SIZE
+        near, far = camera.near, camera.far
+        log_ratio = log(far / near)
+
+        # Scales from fragment coordinates and log depth to cluster coordinates
+        self.data[4:8] = [size_x / screen_size[0], size_y / screen_size[1],
+                          size_z / log_ratio, size_z * log(near) / log_ratio]
+        self.upload_data(self.data)
+
+        grid, light_indices = self.assign(camera, light_buffer)
+        self.grid_buffer.upload_data(grid)
+        self.light_index_buffer.upload_data(light_indices)
+
+    def assign(self, camera, light_buffer):
+        """
+        Finds the clusters reached by each point light, handling all lights at once
+        :param camera: camera to render with
+        :param light_buffer: LightBuffer holding the lights of the scene
+        :return: (grid of [offset, count] per cluster, concatenated light indices)
+        """
+        size_x, size_y, size_z = LightClusters.GRID_SIZE
+        cluster_count = size_x * size_y * size_z
+        near, far = camera.near, camera.far
+
+        indices, positions, radii = light_buffer.get_point_lights()
+        radii = np.minimum(radii, far)
+
+        # Light positions in view space, with depth increasing away from the camera
+        view = camera.view_matrix
+        centres = positions @ view[:3, :3].T + view[:3, 3]
+        depths = -centres[:, 2]
+
+        # Depth slices covered by each light's sphere
+        log_ratio = log(far / near)
+        nearest = np.clip(depths - radii, near, far)
+        furthest = np.clip(depths + radii, near, far)
+        z_start = np.floor(np.log(nearest / near) * size_z / log_ratio).astype(int)
+        z_end = np.floor(np.log(furthest / near) * size_z / log_ratio).astype(int)
+
+        # Screen tiles covered by each light, from the projected corners of its view space bounding box
+        signs = np.array([[x, y, z] for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)])
+        corners = centres[:, None, :] + radii[:, None, None] * signs[None, :, :]
+        corners = np.concatenate([corners, np.ones(corners.shape[:2] + (1,))], axis=2)
+        clip = corners @ camera.project_matrix.T
+        ndc = clip[:, :, 0:2] / np.maximum(clip[:, :, 3:4], 1e-6)
+        ndc_min = ndc.min(axis=1)
+        ndc_max = ndc.max(axis=1)
+
+        # A box crossing the near plane may project anywhere, so covers the whole screen
+        crosses_near = depths - radii < near
+        ndc_min[crosses_near] = -1
+        ndc_max[crosses_near] = 1
+
+        tiles = np.array([size_x, size_y])
+        tile_start = np.floor((ndc_min + 1) / 2 * tiles).astype(int)
+        tile_end = np.floor((ndc_max + 1) / 2 * tiles).astype(int)
+
+        # Discard lights entirely outside the frustum
+        visible = ((depths + radii > near) & (depths - radii < far) &
+                   (tile_end[:, 0] >= 0) & (tile_start[:, 0] < size_x) &
+                   (tile_end[:, 1] >= 0) & (tile_start[:, 1] < size_y))
+        indices = indices[visible]
+        tile_start = np.clip(tile_start[visible], 0, tiles - 1)
+        tile_end = np.clip(tile_end[visible], 0, tiles - 1)
+        z_start = np.clip(z_start[visible], 0, size_z - 1)
+        z_end = np.clip(z_end[visible], 0, size_z - 1)
+
+        # Expand each light's range of clusters into (light, cluster) pairs
+        count_x = tile_end[:, 0] - tile_start[:, 0] + 1
+        count_y = tile_end[:, 1] - tile_start[:, 1] + 1
+        count_z = z_end - z_start + 1
+        pair_counts = count_x * count_y * count_z
+        pair_light = np.repeat(np.arange(len(indices)), pair_counts)
+        local = np.arange(pair_counts.sum()) - np.repeat(np.cumsum(pair_counts) - pair_counts, pair_counts)
+
+        cell_x = tile_start[pair_light, 0] + local % count_x[pair_light]
+        cell_y = tile_start[pair_light, 1] + (local // count_x[pair_light]) % count_y[pair_light]
+        cell_z = z_start[pair_light] + local // (count_x[pair_light] * count_y[pair_light])
+        cluster_ids = (cell_z * size_y + cell_y) * size_x + cell_x
+
+        # Group pairs by cluster, giving each cluster a contiguous range of light indices
+        order = np.argsort(cluster_ids, kind="stable")
+        light_indices = indices[pair_light[order]].astype(np.int32)
+        counts = np.bincount(cluster_ids, minlength=cluster_count)
+        grid = np.zeros((cluster_count, 2), dtype=np.int32)
+        grid[:, 0] = np.cumsum(counts) - counts
+        grid[:, 1] = counts
+
+        self.assignment_count = len(light_indices)
+        return grid, light_indices
+
+    def bind(self):
+        """
+        Binds the grid and light list buffer textures to their texture units
+        """
+        self.grid_buffer.bind()
+        self.light_index_buffer.bind()
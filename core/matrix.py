@@ -107,6 +107,23 @@ class Matrix(object):
                          [0, 0, b, c],
                          [0, 0, -1, 0]]).astype(float)
 
+    @staticmethod
+    def make_orthographic(left=-1, right=1, bottom=-1, top=1, near=-1, far=1):
+        """
+        Returns a projection matrix for a box, without perspective
+        :param left: x of left plane
+        :param right: x of right plane
+        :param bottom: y of bottom plane
+        :param top: y of top plane
+        :param near: distance to near plane
+        :param far: distance to far plane
+        :return: Projection matrix
+        """
+        return np.array([[2/(right - left), 0, 0, -(right + left)/(right - left)],
+                         [0, 2/(top - bottom), 0, -(top + bottom)/(top - bottom)],
+                         [0, 0, -2/(far - near), -(far + near)/(far - near)],
+                         [0, 0, 0, 1]]).astype(float)
+
     @staticmethod
     def make_look_at(position, target):
         """
@@ -1,4 +1,5 @@
 from core.object3d import Object3D
+from core.program_reflection import ProgramReflection
 from OpenGL.GL import *
 
 
@@ -21,10 +22,39 @@ class Mesh(Object3D):
         # Visibility boolean
         self.visible = True
 
-        # Set associations between attributes in geometry and shader variables in material
+        # Whether the mesh casts shadows, and whether it moves, so is drawn into shadow maps every frame
+        # instead of into their cache
+        self.cast_shadow = True
+        self.dynamic = False
+
+        # Attributes are associated with shader variables when the mesh is first drawn,
+        # as the program drawing it is only known then
         self.vao_ref = glGenVertexArrays(1)
+        # Program the VAO was last set up for, and locations of the attributes it enables
+        self.vao_program_ref = None
+        self.enabled_attributes = {}
+
+    def bind_vertex_array(self, program_ref):
+        """
+        Binds the VAO, first associating the attributes read by the program;
+        attributes the program never reads are not bound
+        :param program_ref: program the mesh is about to be drawn with
+        """
         glBindVertexArray(self.vao_ref)
-        for variable_name, attribute_object in geometry.attributes.items():
-            attribute_object.associate_variable(material.program_ref, variable_name)
-        # Unbind VAO
-        glBindVertexArray(0)
+        if program_ref == self.vao_program_ref:
+            return
+        self.vao_program_ref = program_ref
+
+        reflection = ProgramReflection.get(program_ref)
+        unused = reflection.unused_attributes(self.geometry.attributes.keys())
+
+        # Disable attributes enabled for the previous program that this one does not read at the same location
+        for variable_name, location in list(self.enabled_attributes.items()):
+            if reflection.locate_attribute(variable_name) != location:
+                glDisableVertexAttribArray(location)
+                del self.enabled_attributes[variable_name]
+
+        for variable_name, attribute_object in self.geometry.attributes.items():
+            if variable_name in unused or variable_name in self.enabled_attributes:
+                continue
+            self.enabled_attributes[variable_name] = attribute_object.associate_variable(program_ref, variable_name)
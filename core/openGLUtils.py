@@ -1,16 +1,77 @@
+import os
+import struct
+from hashlib import sha256
+import numpy as np
 from OpenGL import GL
+from OpenGL.GL.KHR.parallel_shader_compile import glMaxShaderCompilerThreadsKHR
+from OpenGL.GL.ARB.parallel_shader_compile import glMaxShaderCompilerThreadsARB
 
 
 # static methods to load and compile shaders
 class OpenGLUtils(object):
+    # Standard vertex attributes are bound to the same location in every program,
+    # so a mesh's vertex array object can be drawn with any program
+    ATTRIBUTE_LOCATIONS = {
+        "vertex_position": 0,
+        "vertex_normal": 1,
+        "vertex_uv": 2,
+        "vertex_colour": 3,
+        "face_normal": 4
+    }
+
+    # Linked programs keyed by a hash of their shader source, so identical materials share one program
+    program_cache = {}
+    # Number of programs compiled and linked, as opposed to taken from the cache
+    compile_count = 0
+
+    # Programs submitted but not yet checked, with their shaders, materials and functions waiting on them
+    pending_programs = {}
+    # Whether programs are being submitted together, to be checked by finish_batch
+    batching = False
+    # Whether the driver compiles shaders on background threads, checked by start_batch
+    parallel_compile = None
+
+    # Folder holding linked program binaries between runs; None disables the on-disk cache
+    binary_cache_folder = os.path.join(os.path.expanduser("~"), ".cache", "street_scene", "programs")
+    # Number of programs loaded from the on-disk cache
+    binary_load_count = 0
+    # Whether the driver can save and load program binaries, checked once a context exists
+    binary_supported = None
+
     @staticmethod
-    def initialise_shader(shader_code, shader_type):
+    def source_hash(vertex_shader_code, fragment_shader_code):
+        """
+        Returns a key identifying a pair of shaders
+        :param vertex_shader_code: vertex shader source
+        :param fragment_shader_code: fragment shader source
+        :return: hex digest of both sources
+        """
+        source = vertex_shader_code + "\0" + fragment_shader_code
+        return sha256(source.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def initialise_shader(shader_code, shader_type, owner="program"):
         """
         Initialises a given shader
         :param shader_code: code used by shader
         :param shader_type: whether a Vertex or Fragment
+        :param owner: name of material using the shader, shown in errors
         :return:
         """
+        shader_ref = OpenGLUtils.submit_shader(shader_code, shader_type)
+        OpenGLUtils.check_shader(shader_ref, shader_type, owner)
+
+        # compilation success
+        return shader_ref
+
+    @staticmethod
+    def submit_shader(shader_code, shader_type):
+        """
+        Starts compiling a shader without waiting for the result
+        :param shader_code: code used by shader
+        :param shader_type: whether a Vertex or Fragment
+        :return: shader reference
+        """
         # specify OpenGL version
         shader_code = "#version 330\n " + shader_code
 
@@ -20,7 +81,16 @@ class OpenGLUtils(object):
         GL.glShaderSource(shader_ref, shader_code)
         # compile source code
         GL.glCompileShader(shader_ref)
+        return shader_ref
 
+    @staticmethod
+    def check_shader(shader_ref, shader_type, owner):
+        """
+        Waits for a shader to compile, raising an exception if it failed
+        :param shader_ref: shader reference
+        :param shader_type: whether a Vertex or Fragment
+        :param owner: name of material using the shader, shown in errors
+        """
         # check compilation was successful
         compile_success = GL.glGetShaderiv(shader_ref, GL.GL_COMPILE_STATUS)
 
@@ -29,26 +99,52 @@ class OpenGLUtils(object):
             error_message = GL.glGetShaderInfoLog(shader_ref)
             GL.glDeleteShader(shader_ref)
             # convert byte string to char string
-            error_message = "\n" + error_message.decode("utf-8")
+            stage = "vertex" if shader_type == GL.GL_VERTEX_SHADER else "fragment"
+            error_message = f"\nError compiling {stage} shader of {owner}:\n" + error_message.decode("utf-8")
             # raise exception
             raise Exception(error_message)
 
-        # compilation success
-        return shader_ref
-
     @staticmethod
-    def initialise_program(vertex_shader_code, fragment_shader_code):
+    def initialise_program(vertex_shader_code, fragment_shader_code, owner="program"):
         """
-        Initialises an OpenGL program using the two shaders
+        Initialises an OpenGL program using the two shaders, reusing the program
+        of any earlier call with the same source; during a batch, errors are only raised by finish_batch
         :param vertex_shader_code: vertex shader to use
         :param fragment_shader_code: fragment shader to use
+        :param owner: name of material using the program, shown in errors
         :return:
         """
+        key = OpenGLUtils.source_hash(vertex_shader_code, fragment_shader_code)
+        if key in OpenGLUtils.program_cache:
+            program_ref = OpenGLUtils.program_cache[key]
+            if program_ref in OpenGLUtils.pending_programs:
+                OpenGLUtils.pending_programs[program_ref]["owners"].append(owner)
+            return program_ref
+
+        # Load a binary saved by an earlier run, or compile and save one
+        binary_path = OpenGLUtils.binary_path(key)
+        program_ref = OpenGLUtils.load_program_binary(binary_path)
+        if program_ref is None:
+            program_ref, shader_refs = OpenGLUtils.submit_program(vertex_shader_code, fragment_shader_code)
+            pending = {"shaders": shader_refs, "owners": [owner], "binary_path": binary_path, "callbacks": []}
+            OpenGLUtils.pending_programs[program_ref] = pending
+            if not OpenGLUtils.batching:
+                OpenGLUtils.check_program(program_ref)
+
+        OpenGLUtils.program_cache[key] = program_ref
+        return program_ref
+
+    @staticmethod
+    def submit_program(vertex_shader_code, fragment_shader_code):
+        """
+        Starts compiling the two shaders and linking them into a new program, without waiting for the result
+        :param vertex_shader_code: vertex shader to use
+        :param fragment_shader_code: fragment shader to use
+        :return: program reference, and list of (shader reference, shader type)
+        """
         # compile shaders and store refs
-        vertex_shader_ref = OpenGLUtils.initialise_shader(
-            vertex_shader_code, GL.GL_VERTEX_SHADER)
-        fragment_shader_ref = OpenGLUtils.initialise_shader(
-            fragment_shader_code, GL.GL_FRAGMENT_SHADER)
+        vertex_shader_ref = OpenGLUtils.submit_shader(vertex_shader_code, GL.GL_VERTEX_SHADER)
+        fragment_shader_ref = OpenGLUtils.submit_shader(fragment_shader_code, GL.GL_FRAGMENT_SHADER)
 
         # create program
         program_ref = GL.glCreateProgram()
@@ -57,9 +153,38 @@ class OpenGLUtils(object):
         GL.glAttachShader(program_ref, vertex_shader_ref)
         GL.glAttachShader(program_ref, fragment_shader_ref)
 
+        # fix locations of standard attributes before linking
+        for variable_name, location in OpenGLUtils.ATTRIBUTE_LOCATIONS.items():
+            GL.glBindAttribLocation(program_ref, location, variable_name)
+
+        # allow the linked program to be saved to disk
+        if OpenGLUtils.supports_binaries():
+            GL.glProgramParameteri(program_ref, GL.GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL.GL_TRUE)
+
         # link vertex shader to fragment shader
         GL.glLinkProgram(program_ref)
 
+        OpenGLUtils.compile_count += 1
+        return program_ref, [(vertex_shader_ref, GL.GL_VERTEX_SHADER), (fragment_shader_ref, GL.GL_FRAGMENT_SHADER)]
+
+    @staticmethod
+    def check_program(program_ref):
+        """
+        Waits for a submitted program to link, raising an exception naming its materials if it failed;
+        on success the program is saved to disk and functions waiting for it are run
+        :param program_ref: program returned by initialise_program
+        """
+        pending = OpenGLUtils.pending_programs.pop(program_ref)
+        owner = ", ".join(sorted(set(pending["owners"])))
+
+        # a failed compile explains a failed link, so shaders are checked first
+        for shader_ref, shader_type in pending["shaders"]:
+            try:
+                OpenGLUtils.check_shader(shader_ref, shader_type, owner)
+            except Exception:
+                GL.glDeleteProgram(program_ref)
+                raise
+
         # check linking success
         link_success = GL.glGetProgramiv(program_ref, GL.GL_LINK_STATUS)
         if not link_success:
@@ -68,9 +193,158 @@ class OpenGLUtils(object):
             # free memory
             GL.glDeleteProgram(program_ref)
 
-            error_message = "\n" + error_message.decode("utf-8")
+            error_message = f"\nError linking program of {owner}:\n" + error_message.decode("utf-8")
             # raise exception
             raise Exception(error_message)
 
+        # shaders are no longer needed once linked
+        for shader_ref, shader_type in pending["shaders"]:
+            GL.glDetachShader(program_ref, shader_ref)
+            GL.glDeleteShader(shader_ref)
+
         # linking successful
+        OpenGLUtils.save_program_binary(pending["binary_path"], program_ref)
+        for function in pending["callbacks"]:
+            function()
+
+    @staticmethod
+    def when_linked(program_ref, function):
+        """
+        Runs a function that queries or sets program state once the program has linked;
+        outside a batch, or for a program that has already linked, it runs immediately
+        :param program_ref: program returned by initialise_program
+        :param function: function taking no arguments
+        """
+        if program_ref in OpenGLUtils.pending_programs:
+            OpenGLUtils.pending_programs[program_ref]["callbacks"].append(function)
+        else:
+            function()
+
+    @staticmethod
+    def start_batch():
+        """
+        Starts submitting programs without checking them, so the driver may compile them in the background
+        """
+        OpenGLUtils.batching = True
+
+        # ask for as many compiler threads as the driver allows
+        if OpenGLUtils.parallel_compile is None:
+            extension_count = GL.glGetIntegerv(GL.GL_NUM_EXTENSIONS)
+            extensions = {GL.glGetStringi(GL.GL_EXTENSIONS, i) for i in range(extension_count)}
+            khr_compile = b"GL_KHR_parallel_shader_compile" in extensions
+            arb_compile = b"GL_ARB_parallel_shader_compile" in extensions
+            OpenGLUtils.parallel_compile = khr_compile or arb_compile
+            # drivers offering only the ARB extension lack the KHR entry point
+            if khr_compile:
+                glMaxShaderCompilerThreadsKHR(0xFFFFFFFF)
+            elif arb_compile:
+                glMaxShaderCompilerThreadsARB(0xFFFFFFFF)
+
+    @staticmethod
+    def finish_batch():
+        """
+        Checks every program submitted since start_batch, in the order they were submitted
+        """
+        OpenGLUtils.batching = False
+        for program_ref in list(OpenGLUtils.pending_programs):
+            OpenGLUtils.check_program(program_ref)
+
+    @staticmethod
+    def supports_binaries():
+        """
+        Checks whether the driver offers at least one program binary format
+        :return: True if program binaries can be saved and loaded
+        """
+        if OpenGLUtils.binary_supported is None:
+            try:
+                format_count = GL.glGetIntegerv(GL.GL_NUM_PROGRAM_BINARY_FORMATS)
+                OpenGLUtils.binary_supported = int(format_count) > 0 and bool(GL.glProgramBinary)
+            except GL.GLError:
+                OpenGLUtils.binary_supported = False
+        return OpenGLUtils.binary_supported
+
+    @staticmethod
+    def binary_path(key):
+        """
+        Returns the file a program binary is cached in; binaries only load on the driver that created them,
+        so the driver is part of the file name
+        :param key: hash of shader source
+        :return: path of binary file, or None if the on-disk cache is not used
+        """
+        if OpenGLUtils.binary_cache_folder is None or not OpenGLUtils.supports_binaries():
+            return None
+
+        driver = [GL.glGetString(name) for name in (GL.GL_VENDOR, GL.GL_RENDERER, GL.GL_VERSION)]
+        identity = key + "\0" + "\0".join(name.decode("utf-8") for name in driver)
+        # attribute locations are fixed at link time, so also belong to the binary
+        identity += "\0" + repr(sorted(OpenGLUtils.ATTRIBUTE_LOCATIONS.items()))
+        file_name = sha256(identity.encode("utf-8")).hexdigest() + ".bin"
+        return os.path.join(OpenGLUtils.binary_cache_folder, file_name)
+
+    @staticmethod
+    def load_program_binary(binary_path):
+        """
+        Creates a program from a binary saved by an earlier run
+        :param binary_path: path of binary file
+        :return: program reference, or None if there is no binary or the driver rejects it
+        """
+        if binary_path is None or not os.path.isfile(binary_path):
+            return None
+
+        with open(binary_path, "rb") as binary_file:
+            contents = binary_file.read()
+        if len(contents) <= 4:
+            return None
+        binary_format, = struct.unpack("<I", contents[:4])
+        binary = np.frombuffer(contents, dtype=np.uint8, offset=4)
+
+        program_ref = GL.glCreateProgram()
+        try:
+            GL.glProgramBinary(program_ref, binary_format, binary, len(binary))
+            linked = GL.glGetProgramiv(program_ref, GL.GL_LINK_STATUS)
+        except GL.GLError:
+            # a corrupt file may hold a format the driver does not know, which it reports as GL_INVALID_ENUM
+            linked = False
+
+        # a driver update or a different GPU may reject the binary, so compile instead
+        if not linked:
+            GL.glDeleteProgram(program_ref)
+            try:
+                os.remove(binary_path)
+            except OSError:
+                # the cache folder may be read-only, or the file already removed by another run
+                pass
+            return None
+
+        OpenGLUtils.binary_load_count += 1
         return program_ref
+
+    @staticmethod
+    def save_program_binary(binary_path, program_ref):
+        """
+        Saves a linked program to disk, so later runs can skip compiling it
+        :param binary_path: path of binary file
+        :param program_ref: linked program
+        """
+        if binary_path is None:
+            return
+
+        length = GL.glGetProgramiv(program_ref, GL.GL_PROGRAM_BINARY_LENGTH)
+        if length <= 0:
+            return
+        binary = np.zeros(length, dtype=np.uint8)
+        written = np.zeros(1, dtype=np.int32)
+        binary_format = np.zeros(1, dtype=np.uint32)
+        GL.glGetProgramBinary(program_ref, length, written, binary_format, binary)
+
+        # write to a temporary file first, so an interrupted write never leaves a partial binary
+        try:
+            os.makedirs(OpenGLUtils.binary_cache_folder, exist_ok=True)
+            temporary_path = binary_path + ".tmp"
+            with open(temporary_path, "wb") as binary_file:
+                binary_file.write(struct.pack("<I", int(binary_format[0])))
+                binary_file.write(binary[:written[0]].tobytes())
+            os.replace(temporary_path, binary_path)
+        except OSError:
+            # the cache only saves time, so a read-only or full disk is not an error
+            pass
@@ -0,0 +1,136 @@
+import ctypes
+import numpy as np
+from OpenGL.GL import *
+
+
+class ProgramReflection(object):
+    """
+    Lists the active uniforms, uniform blocks and attributes of a linked program once,
+    so variables are found in lookup tables instead of being queried by name
+    """
+    # Reflection of each program, created when first requested
+    reflections = {}
+
+    # OpenGL types accepted for each Uniform data type
+    UNIFORM_TYPES = {
+        "int": (GL_INT,),
+        "bool": (GL_BOOL,),
+        "float": (GL_FLOAT,),
+        "vec2": (GL_FLOAT_VEC2,),
+        "vec3": (GL_FLOAT_VEC3,),
+        "vec4": (GL_FLOAT_VEC4,),
+        "mat4": (GL_FLOAT_MAT4,),
+        "sampler2D": (GL_SAMPLER_2D,),
+        "samplerCube": (GL_SAMPLER_CUBE,),
+        "sampler2DArray": (GL_SAMPLER_2D_ARRAY,)
+    }
+
+    # GLSL names of OpenGL types, for error messages
+    TYPE_NAMES = {
+        GL_INT: "int", GL_BOOL: "bool", GL_FLOAT: "float",
+        GL_FLOAT_VEC2: "vec2", GL_FLOAT_VEC3: "vec3", GL_FLOAT_VEC4: "vec4",
+        GL_INT_VEC2: "ivec2", GL_INT_VEC3: "ivec3", GL_INT_VEC4: "ivec4",
+        GL_FLOAT_MAT3: "mat3", GL_FLOAT_MAT4: "mat4",
+        GL_SAMPLER_2D: "sampler2D", GL_SAMPLER_CUBE: "samplerCube", GL_SAMPLER_2D_ARRAY: "sampler2DArray",
+        GL_SAMPLER_BUFFER: "samplerBuffer", GL_INT_SAMPLER_BUFFER: "isamplerBuffer"
+    }
+
+    def __init__(self, program_ref):
+        """
+        Lists the active variables of a program
+        :param program_ref: reference to linked OpenGL program
+        """
+        self.program_ref = program_ref
+
+        # Uniforms outside blocks, as name: (location, type, array size)
+        self.uniforms = {}
+        for index in range(glGetProgramiv(program_ref, GL_ACTIVE_UNIFORMS)):
+            name, size, data_type = glGetActiveUniform(program_ref, index)
+            name = ProgramReflection.base_name(name.decode("utf-8"))
+            location = glGetUniformLocation(program_ref, name)
+            # Members of uniform blocks have no location
+            if location != -1:
+                self.uniforms[name] = (location, data_type, size)
+
+        # Uniform blocks, as name: block index
+        self.blocks = {}
+        for index in range(glGetProgramiv(program_ref, GL_ACTIVE_UNIFORM_BLOCKS)):
+            length = np.zeros(1, dtype=np.int32)
+            glGetActiveUniformBlockiv(program_ref, index, GL_UNIFORM_BLOCK_NAME_LENGTH, length)
+            name = ctypes.create_string_buffer(int(length[0]))
+            glGetActiveUniformBlockName(program_ref, index, int(length[0]), None, name)
+            self.blocks[name.value.decode("utf-8")] = index
+
+        # Attributes read by the vertex shader, as name: (location, type)
+        self.attributes = {}
+        for index in range(glGetProgramiv(program_ref, GL_ACTIVE_ATTRIBUTES)):
+            name, size, data_type = glGetActiveAttrib(program_ref, index)
+            name = ProgramReflection.base_name(name.decode("utf-8"))
+            # Built-in inputs such as gl_VertexID are listed without a location
+            location = glGetAttribLocation(program_ref, name)
+            if location != -1:
+                self.attributes[name] = (location, data_type)
+
+    @staticmethod
+    def get(program_ref):
+        """
+        Returns the reflection of a program, listing its variables on first use
+        :param program_ref: reference to linked OpenGL program
+        :return: ProgramReflection
+        """
+        reflection = ProgramReflection.reflections.get(program_ref)
+        if reflection is None:
+            reflection = ProgramReflection(program_ref)
+            ProgramReflection.reflections[program_ref] = reflection
+        return reflection
+
+    @staticmethod
+    def base_name(name):
+        """
+        Removes the index OpenGL adds to the names of arrays
+        :param name: name listed by OpenGL
+        :return: name as declared
+        """
+        return name[:-3] if name.endswith("[0]") else name
+
+    def locate_uniform(self, variable_name, data_type=None):
+        """
+        Finds the location of a uniform, checking it is declared with the expected type
+        :param variable_name: name of uniform
+        :param data_type: Uniform data type, such as vec3; None skips the check
+        :return: location, or -1 if the program does not use the uniform
+        """
+        if variable_name not in self.uniforms:
+            return -1
+
+        location, gl_type, size = self.uniforms[variable_name]
+        if data_type is not None and gl_type not in ProgramReflection.UNIFORM_TYPES[data_type]:
+            glsl_type = ProgramReflection.TYPE_NAMES.get(gl_type, hex(gl_type))
+            raise Exception(f"Uniform {variable_name} is a {data_type}, but the shader declares a {glsl_type}")
+        return location
+
+    def locate_block(self, block_name):
+        """
+        Finds the index of a uniform block
+        :param block_name: name of uniform block
+        :return: block index, or None if the program does not use the block
+        """
+        return self.blocks.get(block_name)
+
+    def locate_attribute(self, variable_name):
+        """
+        Finds the location of an attribute
+        :param variable_name: name of attribute
+        :return: location, or -1 if the program does not read the attribute
+        """
+        if variable_name not in self.attributes:
+            return -1
+        return self.attributes[variable_name][0]
+
+    def unused_attributes(self, attribute_names):
+        """
+        Reports which of a geometry's attributes the program never reads
+        :param attribute_names: names of attributes
+        :return: list of names the program does not read
+        """
+        return [name for name in attribute_names if name not in self.attributes]
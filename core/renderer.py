@@ -1,14 +1,24 @@
 from OpenGL.GL import *
+import numpy as np
 from core.mesh import Mesh
+from core.frame_profiler import FrameProfiler
+from core.openGLUtils import OpenGLUtils
+from core.uniform import Uniform
+from core.uniform_buffer import CameraBuffer, DrawBuffer
+from core.texture_buffer import LightBuffer
+from core.light_clusters import LightClusters
+from core.shadow_cascades import ShadowCascades
 from light.light import Light
-import pygame
+from texture.texture import Texture
 
 
 class Renderer(object):
-    def __init__(self, clear_colour=[0, 0, 0]):
+    def __init__(self, clear_colour=[0, 0, 0], clustered_shading=False, depth_prepass=False):
         """
         Creates an object to render the scene
         :param clear_colour:
+        :param clustered_shading: whether point lights are assigned to view frustum clusters instead of meshes
+        :param depth_prepass: whether the depth of opaque meshes is drawn first, so each pixel is shaded once
         """
         glEnable(GL_DEPTH_TEST)
         glClearColor(clear_colour[0], clear_colour[1], clear_colour[2], 1.0)
@@ -17,7 +27,36 @@ class Renderer(object):
         glEnable(GL_BLEND)
         glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
 
-        self.window_size = pygame.display.get_surface().get_size()
+        # Size of the render target, whether a window or an offscreen framebuffer, from the viewport it was given
+        self.window_size = tuple(int(size) for size in glGetIntegerv(GL_VIEWPORT)[2:4])
+
+        # Buffers filled once per frame and read by all programs
+        self.camera_buffer = CameraBuffer()
+        self.light_buffer = LightBuffer()
+        self.light_clusters = LightClusters(enabled=clustered_shading)
+        self.clustered_shading = clustered_shading
+        self.shadow_cascades = ShadowCascades()
+        # Per-draw records for every mesh, uploaded with a single write per frame
+        self.draw_buffer = DrawBuffer()
+
+        # Features of the scene selecting material variants, such as the number of each type of light
+        self.scene_defines = {}
+
+        # Number of glUniform* calls issued and skipped during the last frame
+        self.uniform_upload_count = 0
+        self.uniform_skip_count = 0
+
+        # Program in use, and number of program switches during the last frame
+        self.current_program_ref = None
+        self.program_switch_count = 0
+
+        # Number of draw calls issued during the last frame, including those drawing shadow casters
+        self.draw_count = 0
+
+        # Depth test and depth writes in use
+        self.depth_prepass = depth_prepass
+        self.current_depth_func = GL_LESS
+        self.current_depth_mask = True
 
     def render(self, scene, camera):
         """
@@ -25,54 +64,281 @@ class Renderer(object):
         :param scene: scene to render
         :param camera: camera to render with
         """
+        profiler = FrameProfiler.active
+
         # Clear buffers
+        if profiler is not None:
+            profiler.begin("clear", gpu=True)
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        if profiler is not None:
+            profiler.end()
+
+        mesh_list = self.prepare_frame(scene, camera)
+
+        if self.depth_prepass:
+            if profiler is not None:
+                profiler.begin("depth pre-pass", gpu=True)
+            self.depth_pass(mesh_list)
+            if profiler is not None:
+                profiler.end()
+
+        if profiler is not None:
+            profiler.begin("draw submission", gpu=True)
+        for mesh_index, mesh in enumerate(mesh_list):
+            self.draw_mesh(mesh_index, mesh)
+        if profiler is not None:
+            profiler.end()
+
+        self.finish_frame()
+
+    def prepare_frame(self, scene, camera):
+        """
+        Uploads camera, light and per-draw data shared by all meshes drawn this frame
+        :param scene: scene to render
+        :param camera: camera to render with
+        :return: list of visible meshes, in the order of their per-draw records
+        """
+        # Reset uniform statistics for this frame
+        Uniform.upload_count = 0
+        Uniform.skip_count = 0
+        self.current_program_ref = None
+        self.program_switch_count = 0
+        self.draw_count = 0
+
+        # Replace placeholders with the textures that finished decoding since the last frame
+        Texture.upload_loaded()
+
+        profiler = FrameProfiler.active
+        if profiler is not None:
+            profiler.begin("scene traversal")
 
         # Update camera view matrix
         camera.update_view_matrix()
 
+        mesh_list, light_list = self.get_meshes_and_lights(scene)
+
+        if profiler is not None:
+            profiler.end()
+            profiler.begin("uniform upload")
+
+        # Upload camera and light data once for all meshes
+        self.camera_buffer.update(camera)
+        self.light_buffer.update(light_list)
+        if self.clustered_shading:
+            self.light_clusters.update(camera, self.light_buffer, self.window_size)
+        self.light_buffer.bind()
+        self.light_clusters.bind()
+
+        if profiler is not None:
+            profiler.end()
+            profiler.begin("draw sorting")
+
+        # Switch materials to the variants matching the scene's lights
+        self.update_scene_defines()
+        self.select_variants(mesh_list)
+
+        # Draw meshes grouped by program and texture; a change of material within a group
+        # then only binds a different per-draw record
+        mesh_list.sort(key=self.get_sort_key)
+
+        # Choose the most relevant point lights for each mesh from its bounds;
+        # with clustered shading, point lights are read from clusters instead
+        world_matrices = np.array([mesh.get_world_matrix() for mesh in mesh_list]).reshape(-1, 4, 4)
+        if self.clustered_shading:
+            light_indices = np.full((len(mesh_list), LightBuffer.MAX_MESH_LIGHTS), -1, dtype=np.int32)
+        else:
+            bounding_spheres = np.array([mesh.geometry.get_bounding_sphere() for mesh in mesh_list]).reshape(-1, 4)
+            light_indices = self.light_buffer.select_lights(world_matrices, bounding_spheres)
+
+        if profiler is not None:
+            profiler.end()
+            profiler.begin("draw buffer upload")
+
+        # Pack model matrices, material fields and lights of all visible meshes, and upload them together
+        self.draw_buffer.update(mesh_list, world_matrices, light_indices)
+
+        if profiler is not None:
+            profiler.end()
+            profiler.begin("shadows", gpu=True)
+
+        # Redraw the parts of the shadow map that are out of date, reading casters from their per-draw records;
+        # casters are drawn with their own program, so the next program used must be made current
+        self.shadow_cascades.update(camera, light_list, mesh_list, world_matrices, self.draw_buffer)
+        self.shadow_cascades.bind()
+        self.current_program_ref = None
+
+        if profiler is not None:
+            profiler.end()
+
+        return mesh_list
+
+    @staticmethod
+    def get_meshes_and_lights(scene):
+        """
+        Extracts the visible meshes and the lights of a scene
+        :param scene: scene to render
+        :return: (list of meshes, list of lights ordered by light type)
+        """
         # Extract list of Mesh objects
         descendant_list = scene.get_descendant_list()
-        mesh_filter = lambda x: isinstance(x, Mesh)
+        mesh_filter = lambda x: isinstance(x, Mesh) and x.visible
         mesh_list = list(filter(mesh_filter, descendant_list))
 
-        # Extract list of lights
+        # Extract list of lights; ambient then directional lights come first,
+        # so shaders find them at fixed indices
         light_filter = lambda x: isinstance(x, Light)
-        light_list = list(filter(light_filter, descendant_list))
-        while len(light_list) < 4:
-            light_list.append(Light())
+        light_list = sorted(filter(light_filter, descendant_list), key=lambda light: light.light_type)
 
+        return mesh_list, light_list
+
+    def update_scene_defines(self):
+        """
+        Counts the lights of each type held by the light buffer, for selecting material variants
+        """
+        light_types = self.light_buffer.light_types
+        point_count = int(np.count_nonzero(light_types == Light.POINT))
+        self.scene_defines = {
+            "NUM_AMBIENT_LIGHTS": int(np.count_nonzero(light_types == Light.AMBIENT)),
+            "NUM_DIR_LIGHTS": int(np.count_nonzero(light_types == Light.DIRECTIONAL)),
+            "NUM_POINT_LIGHTS": 0 if self.clustered_shading else min(point_count, LightBuffer.MAX_MESH_LIGHTS),
+            "CLUSTERED": self.clustered_shading
+        }
+
+    def select_variants(self, mesh_list):
+        """
+        Switches the material of each mesh to the variant matching the scene
+        :param mesh_list: list of meshes to draw
+        """
         for mesh in mesh_list:
-            # If mesh is not visible, continue
-            if not mesh.visible:
-                continue
+            mesh.material.select_variant(self.scene_defines)
 
-            glUseProgram(mesh.material.program_ref)
+    @staticmethod
+    def get_sort_key(mesh):
+        """
+        Returns the key meshes are ordered by when drawn
+        :param mesh: mesh to draw
+        :return: key grouping meshes by program and texture, with meshes drawn last after all others
+        """
+        return (mesh.material.draw_last,) + mesh.material.get_sort_key()
 
-            # Bind VAO
-            glBindVertexArray(mesh.vao_ref)
+    def use_program(self, program_ref):
+        """
+        Makes a program current, unless it is already in use
+        :param program_ref: reference to OpenGL program
+        """
+        if program_ref != self.current_program_ref:
+            glUseProgram(program_ref)
+            self.current_program_ref = program_ref
+            self.program_switch_count += 1
 
-            # Update Uniform matrices
-            mesh.material.uniforms["model_matrix"].data = mesh.get_world_matrix()
-            mesh.material.uniforms["view_matrix"].data = camera.view_matrix
-            mesh.material.uniforms["projection_matrix"].data = camera.project_matrix
+    def set_depth_test(self, depth_func, depth_mask):
+        """
+        Sets the depth comparison and whether depth is written, unless they are already set
+        :param depth_func: OpenGL depth comparison, such as GL_LESS
+        :param depth_mask: whether passing fragments write their depth
+        """
+        if depth_func != self.current_depth_func:
+            glDepthFunc(depth_func)
+            self.current_depth_func = depth_func
+        if depth_mask != self.current_depth_mask:
+            glDepthMask(depth_mask)
+            self.current_depth_mask = depth_mask
 
-            # Update light uniforms
-            if "light0" in mesh.material.uniforms.keys():
-                for light_number in range(4):
-                    light_name = "light" + str(light_number)
-                    light_object = light_list[light_number]
-                    mesh.material.uniforms[light_name].data = light_object
+    def compile_materials(self, scene):
+        """
+        Compiles the material variants needed to draw a scene together, instead of as each is first drawn,
+        so the driver can compile them in parallel
+        :param scene: scene to render
+        """
+        mesh_list, light_list = self.get_meshes_and_lights(scene)
+        self.light_buffer.update(light_list)
+        self.update_scene_defines()
 
-            if "view_position" in mesh.material.uniforms.keys():
-                mesh.material.uniforms["view_position"].data = camera.get_world_position()
+        OpenGLUtils.start_batch()
+        self.select_variants(mesh_list)
+        if self.depth_prepass:
+            for mesh in mesh_list:
+                mesh.material.get_depth_program()
+        OpenGLUtils.finish_batch()
 
-            # Update all material Uniforms
-            for variable_name, uniform_object in mesh.material.uniforms.items():
-                uniform_object.upload_data()
+    def depth_pass(self, mesh_list):
+        """
+        Writes the depth of opaque meshes without shading them, so the following pass shades
+        only the nearest fragment of each pixel
+        :param mesh_list: list of meshes returned by prepare_frame
+        """
+        glColorMask(GL_FALSE, GL_FALSE, GL_FALSE, GL_FALSE)
+        self.set_depth_test(GL_LESS, True)
 
-            # Update render settings
-            mesh.material.update_render_settings()
+        for mesh_index, mesh in enumerate(mesh_list):
+            # Meshes drawn last cover only pixels no other mesh reaches, so gain nothing from the pre-pass
+            if mesh.material.draw_last:
+                continue
 
-            # Draw the meshes
+            # Vertex shader of the material's own variant, so the depth written is the depth later tested
+            program_ref = mesh.material.get_depth_program()
+            self.use_program(program_ref)
+            mesh.bind_vertex_array(program_ref)
+            self.draw_buffer.bind_record(mesh_index)
+
+            # Culling and other settings decide which faces are drawn, so must match the shading pass
+            mesh.material.update_render_settings()
             glDrawArrays(mesh.material.settings["draw_style"], 0, mesh.geometry.vertex_count)
+            self.draw_count += 1
+
+        glColorMask(GL_TRUE, GL_TRUE, GL_TRUE, GL_TRUE)
+
+    def draw_mesh(self, mesh_index, mesh):
+        """
+        Draws a mesh with its own material
+        :param mesh_index: position of mesh in the list returned by prepare_frame
+        :param mesh: mesh to draw
+        """
+        self.use_program(mesh.material.program_ref)
+
+        # Bind VAO, with the attributes this program reads
+        mesh.bind_vertex_array(mesh.material.program_ref)
+
+        # Select the per-draw record of this mesh
+        self.draw_buffer.bind_record(mesh_index)
+
+        # Update material Uniforms read by the program; values the program already holds are skipped
+        for uniform_object in mesh.material.active_uniforms:
+            uniform_object.upload_data()
+
+        # Update render settings
+        mesh.material.update_render_settings()
+
+        # Meshes drawn last, such as the sky box at the far plane, fill only pixels nothing nearer was drawn on;
+        # opaque meshes whose depth was drawn by the pre-pass are shaded only where they are nearest
+        if mesh.material.draw_last:
+            self.set_depth_test(GL_LEQUAL, True)
+        elif self.depth_prepass:
+            self.set_depth_test(GL_EQUAL, False)
+        else:
+            self.set_depth_test(GL_LESS, True)
+
+        # Draw the meshes
+        glDrawArrays(mesh.material.settings["draw_style"], 0, mesh.geometry.vertex_count)
+        self.draw_count += 1
+
+    def finish_frame(self):
+        """
+        Completes the frame and records its statistics
+        """
+        # Allow range of draw buffer used this frame to be reused once the GPU is done with it;
+        # the fence flushes the frame's commands, which software renderers such as llvmpipe then execute
+        profiler = FrameProfiler.active
+        if profiler is not None:
+            profiler.begin("flush")
+        self.draw_buffer.finish_frame()
+        if profiler is not None:
+            profiler.end()
+
+        # Restore depth writes, which clearing the depth buffer respects
+        self.set_depth_test(GL_LESS, True)
+
+        # Store uniform and draw statistics of this frame
+        self.uniform_upload_count = Uniform.upload_count
+        self.uniform_skip_count = Uniform.skip_count
+        self.draw_count += self.shadow_cascades.caster_draw_count
@@ -0,0 +1,327 @@
+import numpy as np
+from OpenGL.GL import *
+from core.matrix import Matrix
+from core.openGLUtils import OpenGLUtils
+from core.uniform_buffer import UniformBuffer, DrawBuffer
+from core.texture_buffer import LightBuffer
+from light.light import Light
+
+
+class ShadowCascades(UniformBuffer):
+    """
+    Shadow map of a directional light, split into cascades covering growing distances around the camera.
+    Static casters are drawn into a cached map that is only redrawn when the light turns or a cascade moves;
+    each frame the cache is copied and the dynamic casters, such as the car, are drawn over the copy
+    """
+    # Greatest number of cascades, fixed by the size of the uniform block
+    MAX_CASCADES = 4
+
+    # Texture unit of the shadow map, after those of the deferred G-buffer
+    TEXTURE_UNIT = 10
+
+    # Ratio between the distances covered by neighbouring cascades
+    SPLIT_RATIO = 3
+
+    # Fraction of its radius a cascade moves by at a time, so its cache is redrawn only after
+    # the camera has travelled that far
+    SNAP_FRACTION = 0.25
+
+    # Slope-scaled and constant depth offsets of casters, and offset of receivers along their normal in texels
+    SLOPE_OFFSET = 2.0
+    CONSTANT_OFFSET = 2.0
+    NORMAL_OFFSET = 1.5
+
+    block_code = """
+    layout(std140) uniform ShadowBlock {
+        mat4 shadow_matrices[4];
+        vec4 cascade_distances;
+        vec4 cascade_texel_sizes;
+        int shadow_light;
+        int cascade_count;
+    };
+
+    uniform sampler2DArrayShadow shadow_map;
+
+    float getShadow(vec3 point_position, vec3 point_normal) {
+        // Cascades are spheres around the camera, so the smallest one holding the point is used
+        float distance = length(point_position - view_position);
+        for (int i = 0; i < cascade_count; i++)
+        {
+            if (distance < cascade_distances[i])
+            {
+                // Offset along the normal, so surfaces do not shadow themselves
+                vec3 offset_position = point_position + point_normal * cascade_texel_sizes[i] * %(normal_offset)s;
+                vec4 coord = shadow_matrices[i] * vec4(offset_position, 1);
+                // Compares against the 4 nearest texels and blends the results
+                return texture(shadow_map, vec4(coord.xy, i, coord.z));
+            }
+        }
+        return 1.0;
+    }
+    """ % {"normal_offset": NORMAL_OFFSET}
+
+    vs_code = DrawBuffer.block_code + """
+    uniform mat4 light_matrix;
+
+    in vec3 vertex_position;
+
+    void main() {
+        gl_Position = light_matrix * model_matrix * vec4(vertex_position, 1);
+    }
+    """
+
+    fs_code = """
+    void main() {
+    }
+    """
+
+    def __init__(self, cascade_count=3, resolution=1024, distance=60):
+        """
+        Creates the shadow uniform block; shadow maps are allocated once a light casts shadows
+        :param cascade_count: number of cascades, at most MAX_CASCADES
+        :param resolution: width and height of each cascade in texels
+        :param distance: distance from the camera up to which shadows are drawn
+        """
+        super().__init__("ShadowBlock", UniformBuffer.SHADOW, 76 * 4)
+        self.cascade_count = min(cascade_count, ShadowCascades.MAX_CASCADES)
+        self.resolution = resolution
+
+        # Radius of each cascade around the camera, each SPLIT_RATIO times the last
+        self.distances = [distance / ShadowCascades.SPLIT_RATIO ** (self.cascade_count - 1 - i)
+                          for i in range(self.cascade_count)]
+
+        # Cascades are moved in whole steps, each a whole number of texels so shadow edges do not shimmer,
+        # and are widened by a step so the camera's surroundings stay covered between moves
+        self.steps = []
+        self.half_sizes = []
+        for radius in self.distances:
+            texel_size = 2 * radius * (1 + ShadowCascades.SNAP_FRACTION) / resolution
+            step = max(round(radius * ShadowCascades.SNAP_FRACTION / texel_size), 1) * texel_size
+            self.steps.append(step)
+            self.half_sizes.append(radius + step)
+
+        # 4 shadow matrices, cascade distances, texel sizes, then index of shadowing light and number of cascades
+        self.data = np.zeros(76, dtype=np.float32)
+        self.data.view(np.int32)[72:74] = [-1, 0]
+        self.upload_data(self.data)
+
+        # Light casting shadows this frame, and its index in the light buffer
+        self.light = None
+        self.light_index = -1
+
+        # Maps and programs are created when first needed
+        self.program_ref = None
+        self.cache_ref = None
+        self.texture_ref = None
+
+        # Bounds each cascade's cache was drawn for, the static casters they were drawn from,
+        # and the dynamic casters the shadow map was last drawn with
+        self.cache_keys = [None] * self.cascade_count
+        self.static_key = None
+        self.dynamic_key = None
+
+        # Number of cascades whose cache was redrawn, and number of casters drawn, during the last frame
+        self.cache_redraw_count = 0
+        self.caster_draw_count = 0
+
+    def allocate(self):
+        """
+        Creates the caster program, and depth texture arrays holding the cache and the shadow map
+        """
+        self.program_ref = OpenGLUtils.initialise_program(ShadowCascades.vs_code, ShadowCascades.fs_code,
+                                                          "ShadowCascades")
+        UniformBuffer.bind_block(self.program_ref, "DrawBlock", UniformBuffer.DRAW)
+        self.matrix_location = glGetUniformLocation(self.program_ref, "light_matrix")
+
+        self.cache_ref, self.cache_framebuffers = self.create_texture(compare=False)
+        self.texture_ref, self.framebuffers = self.create_texture(compare=True)
+
+    def create_texture(self, compare):
+        """
+        Creates a depth texture array with a layer per cascade, and a framebuffer drawing into each layer
+        :param compare: whether sampling compares against the stored depth
+        :return: (texture reference, list of framebuffer references)
+        """
+        texture_ref = glGenTextures(1)
+        glActiveTexture(GL_TEXTURE0 + ShadowCascades.TEXTURE_UNIT)
+        glBindTexture(GL_TEXTURE_2D_ARRAY, texture_ref)
+        glTexImage3D(GL_TEXTURE_2D_ARRAY, 0, GL_DEPTH_COMPONENT24, self.resolution, self.resolution,
+                     self.cascade_count, 0, GL_DEPTH_COMPONENT, GL_FLOAT, None)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+        if compare:
+            # Linear filtering of a comparison blends the results of the 4 nearest texels
+            glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+            glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+            glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_COMPARE_MODE, GL_COMPARE_REF_TO_TEXTURE)
+            glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_COMPARE_FUNC, GL_LEQUAL)
+        else:
+            glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+            glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+
+        # The render target bound by the caller, which may be an offscreen framebuffer, is bound again afterwards
+        target_ref = glGetIntegerv(GL_DRAW_FRAMEBUFFER_BINDING)
+        framebuffer_refs = []
+        for layer in range(self.cascade_count):
+            framebuffer_ref = glGenFramebuffers(1)
+            glBindFramebuffer(GL_FRAMEBUFFER, framebuffer_ref)
+            glFramebufferTextureLayer(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, texture_ref, 0, layer)
+            glDrawBuffer(GL_NONE)
+            glReadBuffer(GL_NONE)
+            framebuffer_refs.append(framebuffer_ref)
+        glBindFramebuffer(GL_FRAMEBUFFER, target_ref)
+        return texture_ref, framebuffer_refs
+
+    @staticmethod
+    def find_light(light_list):
+        """
+        Finds the directional light casting shadows
+        :param light_list: list of lights ordered by light type, as held by the light buffer
+        :return: (light, index in list), or (None, -1) if no light casts shadows
+        """
+        for index, light in enumerate(light_list):
+            if light.light_type == Light.DIRECTIONAL and light.cast_shadows:
+                return light, index
+        return None, -1
+
+    def update(self, camera, light_list, mesh_list, world_matrices, draw_buffer):
+        """
+        Moves the cascades with the camera, redraws the caches of any that moved, and draws the dynamic casters
+        over the caches if they moved or the caches changed
+        :param camera: camera to render with
+        :param light_list: list of lights ordered by light type, as held by the light buffer
+        :param mesh_list: list of meshes in the order of their per-draw records
+        :param world_matrices: array of mesh world matrices, shape (meshes, 4, 4)
+        :param draw_buffer: DrawBuffer holding the per-draw records of this frame
+        """
+        self.cache_redraw_count = 0
+        self.caster_draw_count = 0
+
+        self.light, self.light_index = ShadowCascades.find_light(light_list)
+        if self.light is None:
+            self.data.view(np.int32)[72:74] = [-1, 0]
+            self.upload_data(self.data)
+            return
+        if self.program_ref is None:
+            self.allocate()
+
+        # Light space axes, looking along the light's direction
+        direction = np.array(self.light.get_direction(), dtype=float)
+        direction /= np.linalg.norm(direction)
+        up = [0, 1, 0] if abs(direction[1]) < 0.99 else [1, 0, 0]
+        right = np.cross(direction, up)
+        right /= np.linalg.norm(right)
+        up = np.cross(right, direction)
+        light_view = np.identity(4)
+        light_view[:3, :3] = [right, up, -direction]
+
+        casters = [index for index, mesh in enumerate(mesh_list) if mesh.cast_shadow]
+        static = np.array([index for index in casters if not mesh_list[index].dynamic], dtype=int)
+        dynamic = np.array([index for index in casters if mesh_list[index].dynamic], dtype=int)
+        centres, radii = LightBuffer.transform_spheres(
+            world_matrices[casters].reshape(-1, 4, 4),
+            np.array([mesh_list[index].geometry.get_bounding_sphere() for index in casters]).reshape(-1, 4))
+        # Caster bounds in light space, indexed like the per-draw records
+        light_centres = np.zeros((len(mesh_list), 3))
+        light_radii = np.zeros(len(mesh_list))
+        light_centres[casters] = centres @ light_view[:3, :3].T
+        light_radii[casters] = radii
+
+        # Caches are drawn from the static casters, so are invalid once any of them changes or moves
+        static_key = (tuple(direction), tuple(id(mesh_list[index]) for index in static),
+                      world_matrices[static].tobytes())
+        if static_key != self.static_key:
+            self.static_key = static_key
+            self.cache_keys = [None] * self.cascade_count
+            # Depth range enclosing every static caster; dynamic casters outside it are clamped to it
+            if len(static) > 0:
+                depths = -light_centres[static, 2]
+                self.depth_range = ((depths - light_radii[static]).min() - 1,
+                                    (depths + light_radii[static]).max() + 1)
+            else:
+                self.depth_range = (-1, 1)
+
+        dynamic_key = (tuple(id(mesh_list[index]) for index in dynamic), world_matrices[dynamic].tobytes())
+        dynamic_changed = dynamic_key != self.dynamic_key
+        self.dynamic_key = dynamic_key
+
+        # Casters are drawn without colour, into each layer in turn
+        target_ref = glGetIntegerv(GL_DRAW_FRAMEBUFFER_BINDING)
+        viewport = glGetIntegerv(GL_VIEWPORT)
+        cull_face = glIsEnabled(GL_CULL_FACE)
+        glViewport(0, 0, self.resolution, self.resolution)
+        glDisable(GL_CULL_FACE)
+        glEnable(GL_DEPTH_CLAMP)
+        glEnable(GL_POLYGON_OFFSET_FILL)
+        glPolygonOffset(ShadowCascades.SLOPE_OFFSET, ShadowCascades.CONSTANT_OFFSET)
+        glUseProgram(self.program_ref)
+
+        camera_position = light_view[:3, :3] @ np.array(camera.get_world_position(), dtype=float)
+        for cascade in range(self.cascade_count):
+            step = self.steps[cascade]
+            half_size = self.half_sizes[cascade]
+            centre = np.round(camera_position[:2] / step) * step
+            near, far = self.depth_range
+            projection = Matrix.make_orthographic(centre[0] - half_size, centre[0] + half_size,
+                                                  centre[1] - half_size, centre[1] + half_size, near, far)
+            light_matrix = projection @ light_view
+
+            # Map from world space into the texture and depth range of the cascade
+            bias = np.array([[0.5, 0, 0, 0.5], [0, 0.5, 0, 0.5], [0, 0, 0.5, 0.5], [0, 0, 0, 1]])
+            self.data[cascade * 16:cascade * 16 + 16] = (bias @ light_matrix).T.ravel()
+
+            # Only casters overlapping the cascade are drawn
+            overlapping = np.all(np.abs(light_centres[:, :2] - centre) < half_size + light_radii[:, None], axis=1)
+
+            cache_key = tuple(centre)
+            if cache_key != self.cache_keys[cascade]:
+                self.cache_keys[cascade] = cache_key
+                glBindFramebuffer(GL_FRAMEBUFFER, self.cache_framebuffers[cascade])
+                glClear(GL_DEPTH_BUFFER_BIT)
+                self.draw_casters(light_matrix, static[overlapping[static]], mesh_list, draw_buffer)
+                self.cache_redraw_count += 1
+            elif not dynamic_changed:
+                continue
+
+            # Copy the cache, then draw the dynamic casters over it
+            glBindFramebuffer(GL_READ_FRAMEBUFFER, self.cache_framebuffers[cascade])
+            glBindFramebuffer(GL_DRAW_FRAMEBUFFER, self.framebuffers[cascade])
+            glBlitFramebuffer(0, 0, self.resolution, self.resolution, 0, 0, self.resolution, self.resolution,
+                              GL_DEPTH_BUFFER_BIT, GL_NEAREST)
+            self.draw_casters(light_matrix, dynamic[overlapping[dynamic]], mesh_list, draw_buffer)
+
+        glDisable(GL_POLYGON_OFFSET_FILL)
+        glDisable(GL_DEPTH_CLAMP)
+        if cull_face:
+            glEnable(GL_CULL_FACE)
+        glBindFramebuffer(GL_FRAMEBUFFER, target_ref)
+        glViewport(*viewport)
+
+        self.data[64:64 + self.cascade_count] = self.distances
+        self.data[68:68 + self.cascade_count] = [2 * half_size / self.resolution for half_size in self.half_sizes]
+        self.data.view(np.int32)[72:74] = [self.light_index, self.cascade_count]
+        self.upload_data(self.data)
+
+    def draw_casters(self, light_matrix, indices, mesh_list, draw_buffer):
+        """
+        Draws the depth of casters into the bound framebuffer
+        :param light_matrix: matrix from world space into the cascade
+        :param indices: indices of casters in mesh_list, which are also those of their per-draw records
+        :param mesh_list: list of meshes in the order of their per-draw records
+        :param draw_buffer: DrawBuffer holding the per-draw records of this frame
+        """
+        glUniformMatrix4fv(self.matrix_location, 1, GL_TRUE, light_matrix.astype(np.float32))
+        for index in indices:
+            mesh = mesh_list[index]
+            mesh.bind_vertex_array(self.program_ref)
+            draw_buffer.bind_record(index)
+            glDrawArrays(mesh.material.settings["draw_style"], 0, mesh.geometry.vertex_count)
+        self.caster_draw_count += len(indices)
+
+    def bind(self):
+        """
+        Binds the shadow map to its texture unit
+        """
+        if self.texture_ref is not None:
+            glActiveTexture(GL_TEXTURE0 + ShadowCascades.TEXTURE_UNIT)
+            glBindTexture(GL_TEXTURE_2D_ARRAY, self.texture_ref)
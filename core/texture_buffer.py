@@ -0,0 +1,210 @@
+import numpy as np
+from OpenGL.GL import *
+from light.light import Light
+from core.program_reflection import ProgramReflection
+
+
+class TextureBuffer(object):
+    """
+    Defines a buffer texture, giving shaders indexed access to an array of any length
+    """
+    # Fixed texture units of the shared buffer textures
+    LIGHT_DATA = 2
+    CLUSTER_GRID = 3
+    CLUSTER_LIGHTS = 4
+    DEFERRED_LIGHTS = 5
+
+    def __init__(self, sampler_name, texture_unit, internal_format):
+        """
+        Creates a buffer and a texture reading from it
+        :param sampler_name: name of samplerBuffer in shaders
+        :param texture_unit: texture unit the texture is bound to
+        :param internal_format: format of each texel, such as GL_RGBA32F
+        """
+        self.sampler_name = sampler_name
+        self.texture_unit = texture_unit
+        self.internal_format = internal_format
+
+        # Reference to available buffer and texture
+        self.buffer_ref = glGenBuffers(1)
+        self.texture_ref = glGenTextures(1)
+
+        # Size of buffer storage in bytes
+        self.size = 0
+        self.allocate(256)
+
+    def allocate(self, size):
+        """
+        Allocates buffer storage and attaches it to the texture
+        :param size: size of buffer in bytes
+        """
+        self.size = size
+        glBindBuffer(GL_TEXTURE_BUFFER, self.buffer_ref)
+        glBufferData(GL_TEXTURE_BUFFER, size, None, GL_STREAM_DRAW)
+        glBindBuffer(GL_TEXTURE_BUFFER, 0)
+
+        glActiveTexture(GL_TEXTURE0 + self.texture_unit)
+        glBindTexture(GL_TEXTURE_BUFFER, self.texture_ref)
+        glTexBuffer(GL_TEXTURE_BUFFER, self.internal_format, self.buffer_ref)
+
+    def upload_data(self, data):
+        """
+        Uploads an array into the buffer with a single write, growing the buffer if needed
+        :param data: numpy array matching the internal format
+        """
+        if data.nbytes > self.size:
+            self.allocate(max(data.nbytes, self.size * 2))
+        if data.nbytes == 0:
+            return
+        glBindBuffer(GL_TEXTURE_BUFFER, self.buffer_ref)
+        glBufferSubData(GL_TEXTURE_BUFFER, 0, data.nbytes, data)
+        glBindBuffer(GL_TEXTURE_BUFFER, 0)
+
+    def bind(self):
+        """
+        Binds the texture to its texture unit
+        """
+        glActiveTexture(GL_TEXTURE0 + self.texture_unit)
+        glBindTexture(GL_TEXTURE_BUFFER, self.texture_ref)
+
+    @staticmethod
+    def bind_sampler(program_ref, sampler_name, texture_unit):
+        """
+        Sets a samplerBuffer in a program to read from a texture unit
+        :param program_ref: reference to OpenGL program
+        :param sampler_name: name of sampler
+        :param texture_unit: texture unit to use
+        """
+        variable_ref = ProgramReflection.get(program_ref).locate_uniform(sampler_name)
+        # Check that program uses sampler
+        if variable_ref == -1:
+            return
+        glUseProgram(program_ref)
+        glUniform1i(variable_ref, texture_unit)
+        glUseProgram(0)
+
+
+class LightBuffer(TextureBuffer):
+    """
+    Buffer texture holding every light in the scene, and selecting the lights relevant to each mesh
+    """
+    # Number of lights evaluated for each mesh
+    MAX_MESH_LIGHTS = 8
+
+    # Each light is stored as 4 RGBA texels, so 16 floats
+    LIGHT_SIZE = 16
+
+    block_code = """
+    struct Light {
+        int light_type;
+        vec3 colour;
+        vec3 direction;
+        vec3 position;
+        vec3 attenuation;
+    };
+
+    uniform samplerBuffer light_data;
+
+    Light getLight(int index) {
+        vec4 colour_type = texelFetch(light_data, index * 4);
+        Light light;
+        light.light_type = int(colour_type.w);
+        light.colour = colour_type.rgb;
+        light.direction = texelFetch(light_data, index * 4 + 1).xyz;
+        light.position = texelFetch(light_data, index * 4 + 2).xyz;
+        light.attenuation = texelFetch(light_data, index * 4 + 3).xyz;
+        return light;
+    }
+    """
+
+    def __init__(self):
+        """
+        Creates the light buffer texture
+        """
+        super().__init__("light_data", TextureBuffer.LIGHT_DATA, GL_RGBA32F)
+        self.data = np.zeros((0, LightBuffer.LIGHT_SIZE), dtype=np.float32)
+
+        # Number of lights held, and their type, radius of influence and peak intensity
+        self.light_count = 0
+        self.light_types = np.zeros(0, dtype=np.int32)
+        self.radii = np.zeros(0)
+        self.intensities = np.zeros(0)
+
+    def update(self, light_list):
+        """
+        Packs light data and uploads it
+        :param light_list: list of lights in scene
+        """
+        self.light_count = len(light_list)
+        if len(self.data) != self.light_count:
+            self.data = np.zeros((self.light_count, LightBuffer.LIGHT_SIZE), dtype=np.float32)
+
+        self.light_types = np.array([light.light_type for light in light_list], dtype=np.int32)
+        self.radii = np.array([light.get_radius() for light in light_list])
+        self.intensities = np.array([max(light.colour) for light in light_list])
+
+        for index, light in enumerate(light_list):
+            self.data[index, 0:3] = light.colour
+            self.data[index, 4:7] = light.get_direction()
+            self.data[index, 8:11] = light.get_position()
+            self.data[index, 12:15] = light.attenuation
+        self.data[:, 3] = self.light_types
+        # Store radius alongside direction, for use when assigning lights to clusters
+        self.data[:, 7] = np.minimum(self.radii, np.finfo(np.float32).max)
+        self.upload_data(self.data)
+
+    def get_point_lights(self):
+        """
+        Returns the indices, positions and radii of all point lights
+        :return: (indices, positions, radii)
+        """
+        indices = np.flatnonzero(self.light_types == Light.POINT)
+        return indices, self.data[indices, 8:11], self.radii[indices]
+
+    @staticmethod
+    def transform_spheres(world_matrices, bounding_spheres):
+        """
+        Transforms bounding spheres into world coordinates, scaling radius by the largest axis scale
+        :param world_matrices: array of mesh world matrices, shape (meshes, 4, 4)
+        :param bounding_spheres: array of local [x, y, z, radius] bounding spheres, shape (meshes, 4)
+        :return: (array of world centres, array of world radii)
+        """
+        centres = np.einsum("mij,mj->mi", world_matrices[:, :3, :3], bounding_spheres[:, :3])
+        centres += world_matrices[:, :3, 3]
+        scales = np.linalg.norm(world_matrices[:, :3, :3], axis=1).max(axis=1)
+        return centres, bounding_spheres[:, 3] * scales
+
+    def select_lights(self, world_matrices, bounding_spheres):
+        """
+        Chooses the most relevant point lights for each mesh, comparing every light against every mesh at once;
+        lights without a position apply to every mesh, so are not chosen
+        :param world_matrices: array of mesh world matrices, shape (meshes, 4, 4)
+        :param bounding_spheres: array of local [x, y, z, radius] bounding spheres, shape (meshes, 4)
+        :return: array of light indices, shape (meshes, MAX_MESH_LIGHTS), padded with -1
+        """
+        mesh_count = len(world_matrices)
+        count = self.light_count
+        selected = np.full((mesh_count, LightBuffer.MAX_MESH_LIGHTS), -1, dtype=np.int32)
+        if mesh_count == 0 or count == 0:
+            return selected
+
+        centres, radii = LightBuffer.transform_spheres(world_matrices, bounding_spheres)
+
+        # Distance from each light to the closest point of each mesh's bounds
+        positions = self.data[:, 8:11]
+        distances = np.linalg.norm(centres[:, None, :] - positions[None, :, :], axis=2) - radii[:, None]
+        distances = np.maximum(distances, 0)
+
+        # Score lights by their attenuated intensity at that point
+        attenuation = self.data[:, 12:15]
+        falloff = attenuation[:, 0] + attenuation[:, 1] * distances + attenuation[:, 2] * distances ** 2
+        scores = self.intensities / np.maximum(falloff, 1e-6)
+        in_range = (distances < self.radii) & (self.light_types == Light.POINT)
+        scores[~in_range] = -1
+
+        # Keep the highest scoring lights, in order of score
+        keep = min(LightBuffer.MAX_MESH_LIGHTS, count)
+        order = np.argsort(-scores, axis=1, kind="stable")[:, :keep]
+        relevant = np.take_along_axis(scores, order, axis=1) >= 0
+        selected[:, :keep] = np.where(relevant, order, -1)
+        return selected
@@ -1,10 +1,43 @@
+from itertools import count
+import numpy as np
 from OpenGL.GL import *
+from core.program_reflection import ProgramReflection
 
 
 class Uniform(object):
     """
     Defines Uniform object to be used by and passed to shaders
     """
+    # Every change of value receives a new version from this counter,
+    # so a version number is unique across all Uniform objects
+    version_counter = count(1)
+
+    # Last version uploaded to each location, stored per program
+    program_versions = {}
+
+    # Texture bound to each (texture unit, target) pair
+    bound_textures = {}
+
+    # Texture target read by each sampler type
+    SAMPLER_TARGETS = {
+        "sampler2D": GL_TEXTURE_2D,
+        "samplerCube": GL_TEXTURE_CUBE_MAP,
+        "sampler2DArray": GL_TEXTURE_2D_ARRAY
+    }
+
+    # Per-frame statistics, reset by the renderer before each frame
+    upload_count = 0
+    skip_count = 0
+
+    # Fields of a light structure and their data types
+    LIGHT_FIELDS = {
+        "light_type": "int",
+        "colour": "vec3",
+        "direction": "vec3",
+        "position": "vec3",
+        "attenuation": "vec3"
+    }
+
     def __init__(self, data_type, data):
         """
         Creates a Uniform object
@@ -12,27 +45,103 @@ class Uniform(object):
         :param data: data to be supplied to shader as a uniform
         """
         self.data_type = data_type
+
+        # Packed form of data sent to the shader, and its version
+        self.value = None
+        self.version = 0
+        self._data = None
         self.data = data
 
         # Reference to variable location in program
         self.variable_ref = None
 
+        # Function used to upload value, resolved when variable is located
+        self.upload_function = None
+        # Versions already uploaded into the located program
+        self.uploaded_versions = None
+
+    @property
+    def data(self):
+        """
+        Returns the data supplied to the uniform
+        :return: uniform data
+        """
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        """
+        Sets the data of the uniform, packing it into the form sent to the shader;
+        the version is only changed if the packed value differs from the previous one
+        :param data: data to be supplied to shader
+        """
+        self._data = data
+        value = self.pack(data)
+
+        if self.version != 0:
+            if isinstance(value, np.ndarray) or isinstance(self.value, np.ndarray):
+                unchanged = np.array_equal(value, self.value) if self.value is not None else False
+            else:
+                unchanged = value == self.value
+            if unchanged:
+                return
+
+        self.value = value
+        self.version = next(Uniform.version_counter)
+
+    def pack(self, data):
+        """
+        Converts data into the form uploaded to the shader
+        :param data: data supplied to uniform
+        :return: packed value
+        """
+        if data is None:
+            return None
+
+        if self.data_type in ("int", "bool"):
+            return int(data)
+        elif self.data_type == "float":
+            return float(data)
+        elif self.data_type in ("vec2", "vec3", "vec4"):
+            return tuple(float(x) for x in data)
+        elif self.data_type == "mat4":
+            # Keep matrices as contiguous float32, so no conversion is needed on upload
+            return np.ascontiguousarray(data, dtype=np.float32)
+        elif self.data_type in Uniform.SAMPLER_TARGETS:
+            texture_object_ref, texture_unit_ref = data
+            return int(texture_object_ref), int(texture_unit_ref)
+        elif self.data_type == "Light":
+            return (
+                data.light_type,
+                tuple(data.colour),
+                tuple(data.get_direction()),
+                tuple(data.get_position()),
+                tuple(data.attenuation)
+            )
+        else:
+            raise Exception(f"Unknown Uniform data type: {self.data_type}")
+
     def locate_variable(self, program_ref, variable_name):
         """
-        Locates variable in program
+        Locates variable in program, checking the shader declares it with the same type,
+        and resolves the function used to upload data
         :param program_ref: reference in memory to OpenGL program
         :param variable_name: name of variable
         :return:
         """
+        if self.data_type not in Uniform.upload_functions:
+            raise Exception(f"Unknown Uniform data type: {self.data_type}")
+
+        # Locations are taken from the program's reflection, listed once per program
+        reflection = ProgramReflection.get(program_ref)
         if self.data_type == "Light":
             self.variable_ref = {}
-            self.variable_ref["light_type"] = glGetUniformLocation(program_ref, variable_name + ".light_type")
-            self.variable_ref["colour"] = glGetUniformLocation(program_ref, variable_name + ".colour")
-            self.variable_ref["direction"] = glGetUniformLocation(program_ref, variable_name + ".direction")
-            self.variable_ref["position"] = glGetUniformLocation(program_ref, variable_name + ".position")
-            self.variable_ref["attenuation"] = glGetUniformLocation(program_ref, variable_name + ".attenuation")
+            for field, field_type in Uniform.LIGHT_FIELDS.items():
+                self.variable_ref[field] = reflection.locate_uniform(variable_name + "." + field, field_type)
         else:
-            self.variable_ref = glGetUniformLocation(program_ref, variable_name)
+            self.variable_ref = reflection.locate_uniform(variable_name, self.data_type)
+        self.upload_function = Uniform.upload_functions[self.data_type]
+        self.uploaded_versions = Uniform.program_versions.setdefault(program_ref, {})
 
     def add_uniform(self, data_type, variable_name, data):
         """
@@ -45,52 +154,92 @@ class Uniform(object):
 
     def upload_data(self):
         """
-        Uploads uniform data to the shaders
+        Uploads uniform data to the shaders, skipping values the program already holds
         """
         # check if variable exists
         if self.variable_ref == -1:
             return
 
-        if self.data_type == "int":
-            glUniform1i(self.variable_ref, self.data)
-        elif self.data_type == "bool":
-            glUniform1i(self.variable_ref, self.data)
-        elif self.data_type == "float":
-            glUniform1f(self.variable_ref, self.data)
-        elif self.data_type == "vec2":
-            glUniform2f(self.variable_ref, self.data[0], self.data[1])
-        elif self.data_type == "vec3":
-            glUniform3f(self.variable_ref, self.data[0], self.data[1], self.data[2])
-        elif self.data_type == "vec4":
-            glUniform4f(self.variable_ref, self.data[0], self.data[1], self.data[2], self.data[3])
-        elif self.data_type == "mat4":
-            glUniformMatrix4fv(self.variable_ref, 1, GL_TRUE, self.data)
-        elif self.data_type == "sampler2D":
-            texture_object_ref, texture_unit_ref = self.data
-            # Activate texture unit
-            glActiveTexture(GL_TEXTURE0 + texture_unit_ref)
-            # Associate object to active unit
-            glBindTexture(GL_TEXTURE_2D, texture_object_ref)
-            # Upload texture unit to uniform variable in shader
-            glUniform1i(self.variable_ref, texture_unit_ref)
-        elif self.data_type == "samplerCube":
-            texture_object_ref, texture_unit_ref = self.data
-            glActiveTexture(GL_TEXTURE0 + texture_unit_ref)
-            glBindTexture(GL_TEXTURE_CUBE_MAP, texture_object_ref)
-            glUniform1i(self.variable_ref, texture_unit_ref)
-        elif self.data_type == "Light":
-            glUniform1i(self.variable_ref["light_type"], self.data.light_type)
-            glUniform3f(self.variable_ref["colour"], self.data.colour[0], self.data.colour[1], self.data.colour[2])
+        # Location keys are hashable for every data type
+        key = self.variable_ref if self.data_type != "Light" else self.variable_ref["light_type"]
+        if self.uploaded_versions.get(key) == self.version:
+            # Samplers must still have their texture bound to the correct unit
+            if self.data_type in Uniform.SAMPLER_TARGETS:
+                Uniform.bind_texture(self.data_type, self.value)
+            Uniform.skip_count += 1
+            return
 
-            direction = self.data.get_direction()
-            glUniform3f(self.variable_ref["direction"], direction[0], direction[1], direction[2])
+        self.upload_function(self.variable_ref, self.value)
+        self.uploaded_versions[key] = self.version
+        # A light structure is uploaded with one call per field
+        Uniform.upload_count += 5 if self.data_type == "Light" else 1
 
-            position = self.data.get_position()
-            glUniform3f(self.variable_ref["position"], position[0], position[1], position[2])
+    @staticmethod
+    def bind_texture(data_type, value):
+        """
+        Binds a texture to a texture unit, unless it is already bound there
+        :param data_type: sampler2D, samplerCube or sampler2DArray
+        :param value: (texture_object_ref, texture_unit_ref)
+        """
+        texture_object_ref, texture_unit_ref = value
+        target = Uniform.SAMPLER_TARGETS[data_type]
+        if Uniform.bound_textures.get((texture_unit_ref, target)) == texture_object_ref:
+            return
 
-            glUniform3f(self.variable_ref["attenuation"],
-                        self.data.attenuation[0],
-                        self.data.attenuation[1],
-                        self.data.attenuation[2])
-        else:
-            raise Exception(f"Unknown Uniform data type: {self.data_type}")
+        # Activate texture unit
+        glActiveTexture(GL_TEXTURE0 + texture_unit_ref)
+        # Associate object to active unit
+        glBindTexture(target, texture_object_ref)
+        Uniform.bound_textures[(texture_unit_ref, target)] = texture_object_ref
+
+    @staticmethod
+    def forget_texture(texture_object_ref):
+        """
+        Removes a deleted texture from the record of bound textures, as OpenGL may reuse its name
+        :param texture_object_ref: reference to deleted texture
+        """
+        for key, bound_ref in list(Uniform.bound_textures.items()):
+            if bound_ref == texture_object_ref:
+                del Uniform.bound_textures[key]
+
+    @staticmethod
+    def upload_sampler(data_type, variable_ref, value):
+        """
+        Binds the texture of a sampler and uploads its texture unit
+        :param data_type: sampler2D, samplerCube or sampler2DArray
+        :param variable_ref: location of sampler
+        :param value: (texture_object_ref, texture_unit_ref)
+        """
+        Uniform.bind_texture(data_type, value)
+        # Upload texture unit to uniform variable in shader
+        glUniform1i(variable_ref, value[1])
+
+    @staticmethod
+    def upload_light(variable_ref, value):
+        """
+        Uploads the fields of a light structure
+        :param variable_ref: dictionary of field locations
+        :param value: packed light fields
+        """
+        light_type, colour, direction, position, attenuation = value
+        glUniform1i(variable_ref["light_type"], light_type)
+        glUniform3f(variable_ref["colour"], *colour)
+        glUniform3f(variable_ref["direction"], *direction)
+        glUniform3f(variable_ref["position"], *position)
+        glUniform3f(variable_ref["attenuation"], *attenuation)
+
+
+# Functions used to upload each data type, resolved once per located uniform
+Uniform.upload_functions = {
+    "int": glUniform1i,
+    "bool": glUniform1i,
+    "float": glUniform1f,
+    "vec2": lambda ref, value: glUniform2f(ref, *value),
+    "vec3": lambda ref, value: glUniform3f(ref, *value),
+    "vec4": lambda ref, value: glUniform4f(ref, *value),
+    "mat4": lambda ref, value: glUniformMatrix4fv(ref, 1, GL_TRUE, value),
+    "sampler2D": lambda ref, value: Uniform.upload_sampler("sampler2D", ref, value),
+    "samplerCube": lambda ref, value: Uniform.upload_sampler("samplerCube", ref, value),
+    "sampler2DArray": lambda ref, value: Uniform.upload_sampler("sampler2DArray", ref, value),
+    "Light": Uniform.upload_light
+}
@@ -0,0 +1,217 @@
+import numpy as np
+from OpenGL.GL import *
+from core.program_reflection import ProgramReflection
+
+
+class UniformBuffer(object):
+    """
+    Defines a uniform buffer object, holding a std140 uniform block shared by all programs
+    """
+    # Fixed binding points of the shared uniform blocks
+    CAMERA = 0
+    CLUSTER = 1
+    DRAW = 2
+    SHADOW = 3
+
+    def __init__(self, block_name, binding_point, size):
+        """
+        Creates a uniform buffer and binds it to a binding point
+        :param block_name: name of uniform block in shaders
+        :param binding_point: binding point shared by buffer and blocks
+        :param size: size of buffer in bytes
+        """
+        self.block_name = block_name
+        self.binding_point = binding_point
+        self.size = size
+
+        # Reference to available buffer
+        self.buffer_ref = glGenBuffers(1)
+        glBindBuffer(GL_UNIFORM_BUFFER, self.buffer_ref)
+        glBufferData(GL_UNIFORM_BUFFER, size, None, GL_DYNAMIC_DRAW)
+        glBindBuffer(GL_UNIFORM_BUFFER, 0)
+
+        # Attach buffer to its binding point
+        glBindBufferBase(GL_UNIFORM_BUFFER, binding_point, self.buffer_ref)
+
+    def upload_data(self, data):
+        """
+        Uploads a float32 array into the buffer with a single write
+        :param data: numpy array laid out according to std140
+        """
+        glBindBuffer(GL_UNIFORM_BUFFER, self.buffer_ref)
+        glBufferSubData(GL_UNIFORM_BUFFER, 0, data.nbytes, data)
+        glBindBuffer(GL_UNIFORM_BUFFER, 0)
+
+    @staticmethod
+    def bind_block(program_ref, block_name, binding_point):
+        """
+        Associates a uniform block in a program with a binding point
+        :param program_ref: reference to OpenGL program
+        :param block_name: name of uniform block
+        :param binding_point: binding point to use
+        """
+        block_index = ProgramReflection.get(program_ref).locate_block(block_name)
+        # Check that program uses block
+        if block_index is None:
+            return
+        glUniformBlockBinding(program_ref, block_index, binding_point)
+
+
+class CameraBuffer(UniformBuffer):
+    """
+    Uniform buffer holding the view and projection matrices and position of the camera
+    """
+    block_code = """
+    layout(std140) uniform CameraBlock {
+        mat4 view_matrix;
+        mat4 projection_matrix;
+        vec3 view_position;
+    };
+    """
+
+    def __init__(self):
+        """
+        Creates the camera uniform buffer, laid out as 2 mat4s and a vec3 padded to a vec4
+        """
+        super().__init__("CameraBlock", UniformBuffer.CAMERA, 36 * 4)
+        self.data = np.zeros(36, dtype=np.float32)
+
+    def update(self, camera):
+        """
+        Packs camera data and uploads it
+        :param camera: camera to render with
+        """
+        # std140 stores matrices in column-major order
+        self.data[0:16] = camera.view_matrix.T.ravel()
+        self.data[16:32] = camera.project_matrix.T.ravel()
+        self.data[32:35] = camera.get_world_position()
+        self.upload_data(self.data)
+
+
+class DrawBuffer(UniformBuffer):
+    """
+    Uniform buffer holding one record of per-draw data for every mesh drawn in a frame;
+    all records are packed into a staging array and uploaded with a single write
+    """
+    # Number of frames whose records are kept in separate ranges of the buffer,
+    # so records are never written whilst the GPU may still be reading them
+    FRAME_COUNT = 3
+
+    block_code = """
+    layout(std140) uniform DrawBlock {
+        mat4 model_matrix;
+        vec3 base_colour;
+        float specular_strength;
+        float shininess;
+        float reflectivity;
+        int light_count;
+        float texture_layer;
+        ivec4 light_indices[2];
+    };
+    """
+
+    # Size of the block in bytes, and offset in floats of each material field
+    RECORD_SIZE = 128
+    MATERIAL_FIELDS = {
+        "base_colour": (16, 3),
+        "specular_strength": (19, 1),
+        "shininess": (20, 1),
+        "reflectivity": (21, 1),
+        "texture_layer": (23, 1)
+    }
+
+    def __init__(self, capacity=64):
+        """
+        Creates the per-draw uniform buffer
+        :param capacity: number of records per frame the buffer initially holds
+        """
+        # Each record must start on a multiple of the uniform buffer offset alignment
+        alignment = glGetIntegerv(GL_UNIFORM_BUFFER_OFFSET_ALIGNMENT)
+        self.stride = -(-DrawBuffer.RECORD_SIZE // alignment) * alignment
+
+        self.capacity = capacity
+        super().__init__("DrawBlock", UniformBuffer.DRAW, self.stride * capacity * DrawBuffer.FRAME_COUNT)
+
+        # Staging array holding the records of a single frame
+        self.data = np.zeros((capacity, self.stride // 4), dtype=np.float32)
+
+        # Range of buffer written this frame, and fences marking when each range is free
+        self.frame_index = 0
+        self.fences = [None] * DrawBuffer.FRAME_COUNT
+
+    def resize(self, capacity):
+        """
+        Reallocates the buffer to hold more records per frame
+        :param capacity: number of records per frame
+        """
+        self.capacity = capacity
+        self.size = self.stride * capacity * DrawBuffer.FRAME_COUNT
+        self.data = np.zeros((capacity, self.stride // 4), dtype=np.float32)
+
+        # The new storage is not in use by the GPU, so previous fences can be dropped
+        for fence in self.fences:
+            if fence is not None:
+                glDeleteSync(fence)
+        self.fences = [None] * DrawBuffer.FRAME_COUNT
+
+        glBindBuffer(GL_UNIFORM_BUFFER, self.buffer_ref)
+        glBufferData(GL_UNIFORM_BUFFER, self.size, None, GL_DYNAMIC_DRAW)
+        glBindBuffer(GL_UNIFORM_BUFFER, 0)
+
+    def update(self, mesh_list, world_matrices, light_indices):
+        """
+        Packs the records of all meshes drawn this frame and uploads them with a single write
+        :param mesh_list: list of meshes in the order they will be drawn
+        :param world_matrices: array of mesh world matrices, shape (meshes, 4, 4)
+        :param light_indices: array of lights chosen for each mesh, padded with -1
+        """
+        count = len(mesh_list)
+        if count > self.capacity:
+            self.resize(max(count, self.capacity * 2))
+
+        self.frame_index = (self.frame_index + 1) % DrawBuffer.FRAME_COUNT
+
+        # Wait until the GPU has finished reading this range, FRAME_COUNT frames ago
+        fence = self.fences[self.frame_index]
+        if fence is not None:
+            glClientWaitSync(fence, GL_SYNC_FLUSH_COMMANDS_BIT, 1000000000)
+            glDeleteSync(fence)
+            self.fences[self.frame_index] = None
+
+        if count == 0:
+            return
+
+        # Model matrices are written for all meshes at once, in column-major order
+        records = self.data[:count]
+        records[:, 0:16] = world_matrices.transpose(0, 2, 1).reshape(count, 16)
+        records[:, 16:24] = [mesh.material.get_draw_data() for mesh in mesh_list]
+
+        # Light count and indices are ints, so are written through an int32 view
+        integer_records = records.view(np.int32)
+        integer_records[:, 22] = (light_indices >= 0).sum(axis=1)
+        integer_records[:, 24:24 + light_indices.shape[1]] = light_indices
+
+        glBindBuffer(GL_UNIFORM_BUFFER, self.buffer_ref)
+        glBufferSubData(GL_UNIFORM_BUFFER, self.frame_offset(), records.nbytes, records)
+        glBindBuffer(GL_UNIFORM_BUFFER, 0)
+
+    def frame_offset(self):
+        """
+        Returns the offset of the range of buffer used by this frame
+        :return: offset in bytes
+        """
+        return self.frame_index * self.capacity * self.stride
+
+    def bind_record(self, index):
+        """
+        Binds the record of a mesh to the DrawBlock binding point
+        :param index: position of mesh in the list given to update
+        """
+        glBindBufferRange(GL_UNIFORM_BUFFER, self.binding_point, self.buffer_ref,
+                          self.frame_offset() + index * self.stride, DrawBuffer.RECORD_SIZE)
+
+    def finish_frame(self):
+        """
+        Marks the point after which the range used by this frame may be rewritten
+        """
+        self.fences[self.frame_index] = glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
@@ -11,6 +11,8 @@ class Geometry(object):
         self.attributes = {}
         # Store number of vertices
         self.vertex_count = None
+        # Sphere enclosing vertex positions, calculated when first needed
+        self.bounding_sphere = None
 
     def count_vertices(self):
         """
@@ -51,6 +53,7 @@ class Geometry(object):
             # Add to new data list
             new_position_data.append(new_position)
         self.attributes[variable_name].data = new_position_data
+        self.bounding_sphere = None
 
         # Extract rotation submatrix
         rotation_matrix = np.array([
@@ -69,16 +72,19 @@ class Geometry(object):
             new_vertex_normal_data.append(new_normal)
         self.attributes["vertex_normal"].data = new_vertex_normal_data
 
-        old_face_normal_data = self.attributes["face_normal"].data
-        new_face_normal_data = []
-        for old_normal in old_face_normal_data:
-            new_normal = old_normal.copy()
-            new_normal = rotation_matrix @ new_normal
-            new_face_normal_data.append(new_normal)
-        self.attributes["face_normal"].data = new_face_normal_data
+        # Face normals may have been dropped
+        if "face_normal" in self.attributes:
+            old_face_normal_data = self.attributes["face_normal"].data
+            new_face_normal_data = []
+            for old_normal in old_face_normal_data:
+                new_normal = old_normal.copy()
+                new_normal = rotation_matrix @ new_normal
+                new_face_normal_data.append(new_normal)
+            self.attributes["face_normal"].data = new_face_normal_data
 
-        # Upload new data
-        self.attributes[variable_name].upload_data()
+        # Upload new data to attributes already on the GPU
+        for attribute_object in self.attributes.values():
+            attribute_object.upload_data()
 
     def merge(self, other_geometry):
         """
@@ -92,3 +98,39 @@ class Geometry(object):
 
         # Update number of vertices
         self.count_vertices()
+        self.bounding_sphere = None
+
+    def drop_attribute(self, variable_name):
+        """
+        Removes an attribute from this geometry, freeing its data and buffer
+        :param variable_name: name of attribute
+        """
+        attribute_object = self.attributes.pop(variable_name, None)
+        if attribute_object is not None:
+            attribute_object.delete_buffer()
+
+    def release_data(self):
+        """
+        Frees CPU-side data once meshes using this geometry have been drawn: attributes no program has read
+        are dropped, and the CPU copies of uploaded attributes are freed; the geometry can no longer be changed
+        """
+        # Bounds are calculated from positions, so are kept
+        self.get_bounding_sphere()
+
+        for variable_name, attribute_object in list(self.attributes.items()):
+            if attribute_object.buffer_ref is None:
+                self.drop_attribute(variable_name)
+            else:
+                attribute_object.release_data()
+
+    def get_bounding_sphere(self):
+        """
+        Calculates a sphere enclosing all vertex positions, cached until positions change
+        :return: [x, y, z, radius] in local coordinates
+        """
+        if self.bounding_sphere is None:
+            positions = np.array(self.attributes["vertex_position"].data, dtype=float).reshape(-1, 3)
+            centre = (positions.min(axis=0) + positions.max(axis=0)) / 2
+            radius = np.linalg.norm(positions - centre, axis=1).max()
+            self.bounding_sphere = [centre[0], centre[1], centre[2], radius]
+        return self.bounding_sphere
@@ -5,12 +5,14 @@ class DirectionalLight(Light):
     """
     A light object with colour and direction
     """
-    def __init__(self, colour=[1, 1, 1], direction=[0, -1, 0]):
+    def __init__(self, colour=[1, 1, 1], direction=[0, -1, 0], cast_shadows=False):
         """
         Creates a light with colour and direction
         :param colour: RGB colour of light
         :param direction: direction of light
+        :param cast_shadows: whether meshes block the light, using cascaded shadow maps
         """
         super().__init__(Light.DIRECTIONAL)
         self.colour = colour
+        self.cast_shadows = cast_shadows
         self.set_direction(direction)
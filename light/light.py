@@ -1,4 +1,5 @@
 from core.object3d import Object3D
+from math import inf, sqrt
 
 
 class Light(Object3D):
@@ -9,6 +10,9 @@ class Light(Object3D):
     DIRECTIONAL = 2
     POINT = 3
 
+    # Fraction of full intensity below which a point light no longer contributes
+    CUTOFF = 1 / 256
+
     def __init__(self, light_type=0):
         """
         Creates a light
@@ -18,3 +22,22 @@ class Light(Object3D):
         self.light_type = light_type
         self.colour = [1, 1, 1]
         self.attenuation = [1, 0, 0]
+
+    def get_radius(self):
+        """
+        Calculates the radius of influence of the light from its colour and attenuation
+        :return: distance beyond which the light falls below the cutoff; infinite if not a point light
+        """
+        if self.light_type != Light.POINT:
+            return inf
+
+        # Solve constant + linear * d + quadratic * d^2 = intensity / cutoff for d
+        constant, linear, quadratic = self.attenuation
+        limit = max(self.colour) / Light.CUTOFF - constant
+        if limit <= 0:
+            return 0
+        if quadratic > 0:
+            return (-linear + sqrt(linear * linear + 4 * quadratic * limit)) / (2 * quadratic)
+        if linear > 0:
+            return limit / linear
+        return inf
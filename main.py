@@ -1,9 +1,19 @@
+import os
+import sys
+
+# PyOpenGL chooses how to create contexts when OpenGL is first imported, so rendering without a window
+# must select EGL before any import below
+if "--headless" in sys.argv:
+    os.environ.setdefault("PYOPENGL_PLATFORM", "egl")
+
 # Import core classes
 from core.base import Base
 from core.renderer import Renderer
+from core.deferred_renderer import DeferredRenderer
 from core.scene import Scene
 from core.camera import Camera
 from core.mesh import Mesh
+from core.frame_profiler import FrameProfiler
 
 # Import geometry classes
 from geometry.obj_geometry import OBJGeometry
@@ -34,8 +44,25 @@ from OpenGL.GL import *
 # Import Math functions
 from math import pi
 
+# Import command line parsing
+import argparse
+
 
 class Main(Base):
+    def __init__(self, screen_size=[768, 768], deferred=False, clustered=False, depth_prepass=False, headless=False):
+        """
+        Creates the street scene program
+        :param screen_size: [width, height] of window
+        :param deferred: whether lit materials are shaded with the deferred renderer
+        :param clustered: whether the forward renderer assigns point lights to clusters
+        :param depth_prepass: whether the forward renderer draws the depth of opaque meshes before shading them
+        :param headless: whether to render offscreen without a window
+        """
+        super().__init__(screen_size, headless=headless)
+        self.deferred = deferred
+        self.clustered = clustered
+        self.depth_prepass = depth_prepass
+
     def initialise(self):
         """
         Creates a class extended the Base program class, creating the street scene
@@ -43,7 +70,10 @@ class Main(Base):
         print("Initialising program...")
 
         # Initialise renderer, scene tree and camera with aspect ratio 1920:1000
-        self.renderer = Renderer()
+        if self.deferred:
+            self.renderer = DeferredRenderer()
+        else:
+            self.renderer = Renderer(clustered_shading=self.clustered, depth_prepass=self.depth_prepass)
         self.scene = Scene()
         self.camera = Camera(aspect_ratio=1920 / 1000)
 
@@ -56,7 +86,7 @@ class Main(Base):
         self.rig.set_position([-11, 2, 0])
         self.rig.set_direction([1, 0, 0])
 
-        # Initialise the sky box using supplied textures
+        # Initialise the sky box using supplied textures, decoded while the rest of the scene is built
         print("Initialising skybox...")
         self.cube_map = CubeMapTexture(
             file_names=[
@@ -67,12 +97,15 @@ class Main(Base):
                 "nz.png",
                 "pz.png"
             ],
-            folder_route="images/field_skybox"
+            folder_route="images/field_skybox",
+            background=True
         )
         # Create skybox with area 1000^2
         sky_box_geo = BoxGeometry(width=1000, height=1000, depth=1000)
         sky_box_mat = CubeMapMaterial(self.cube_map)
         sky_box = Mesh(sky_box_geo, sky_box_mat)
+        # The sky box encloses the scene, so would shadow all of it
+        sky_box.cast_shadow = False
         self.scene.add(sky_box)
 
         # Initialise the lighting components - 1 ambient light and 1 directional light
@@ -83,7 +116,7 @@ class Main(Base):
         print("Initialising directional sunlight...")
         # Directional light uses RGB colour mimicking afternoon sunlight
         directional = DirectionalLight(
-            colour=[1, 0.839, 0.666], direction=[-1, -1, -2]
+            colour=[1, 0.839, 0.666], direction=[-1, -1, -2], cast_shadows=True
         )
         self.scene.add(directional)
 
@@ -143,6 +176,10 @@ class Main(Base):
         self.add_building(position=[-5.25, 0, 5])
         self.add_building(brick_colour=[0.949, 0.905, 0.749], position=[0, 0, 5])
 
+        # Compile the material variants needed by the scene's lights together
+        print("Compiling shaders...")
+        self.renderer.compile_materials(self.scene)
+
         print("Initialisation complete!\nRunning program...")
 
     def update(self):
@@ -230,7 +267,7 @@ class Main(Base):
         # Import the car, wheels and window OBJs and create meshes
         car_geo = OBJGeometry(file_name="Car.obj", has_normals=True)
         if texture is not None:
-            car_mat = PhongMaterial(texture=Texture(texture), properties={"base_colour": body_colour})
+            car_mat = PhongMaterial(texture=Texture(texture, background=True), properties={"base_colour": body_colour})
         else:
             car_mat = PhongMaterial(properties={"base_colour": body_colour})
         car_mesh = Mesh(car_geo, car_mat)
@@ -248,6 +285,9 @@ class Main(Base):
 
         # Allow the 3 meshes to be used by the class
         self.whole_car = [car_mesh, wheels_mesh, window_mesh]
+        # The car is driven, so its shadow is redrawn every frame rather than cached with the street's
+        for mesh in self.whole_car:
+            mesh.dynamic = True
 
         self.set_pos_rot_scale(
             position=position,
@@ -274,14 +314,14 @@ class Main(Base):
         # Import trunk and leaf models, using textures if supplied
         trunk_geo = OBJGeometry(file_name="tree_trunk.obj", has_normals=True)
         if trunk_texture is not None:
-            trunk_mat = LambertMaterial(texture=Texture(trunk_texture))
+            trunk_mat = LambertMaterial(texture=Texture(trunk_texture, background=True))
         else:
             trunk_mat = LambertMaterial(properties={"base_colour": trunk_colour})
         trunk_mesh = Mesh(trunk_geo, trunk_mat)
 
         leaf_geo = OBJGeometry(file_name="tree_leaves.obj", has_normals=True)
         if leaf_texture is not None:
-            leaf_mat = LambertMaterial(texture=Texture(leaf_texture))
+            leaf_mat = LambertMaterial(texture=Texture(leaf_texture, background=True))
         else:
             leaf_mat = LambertMaterial(properties={"base_colour": leaf_colour})
         leaf_mesh = Mesh(leaf_geo, leaf_mat)
@@ -352,13 +392,15 @@ class Main(Base):
         # Apply texture if supplied
         if texture is not None:
             floor_mat = TextureMaterial(
-                texture=Texture(texture, properties={"wrap": GL_REPEAT})
+                texture=Texture(texture, properties={"wrap": GL_REPEAT}, background=True)
             )
         else:
             floor_mat = LambertMaterial(
                 properties={"base_colour": colour}
             )
         floor_mesh = Mesh(floor_geo, floor_mat)
+        # Floors lie flat under everything else, so only receive shadows
+        floor_mesh.cast_shadow = False
         # Set position, rotation and scale
         self.set_pos_rot_scale(
             position=position,
@@ -408,5 +450,34 @@ class Main(Base):
 
 
 if __name__ == '__main__':
-    # Run the main class with screen size 1920x1000
-    Main(screen_size=[1920, 1000]).run()
+    # Choose renderer at startup
+    parser = argparse.ArgumentParser(description="Street Scene")
+    parser.add_argument("--deferred", action="store_true", help="use deferred shading for lit materials")
+    parser.add_argument("--clustered", action="store_true", help="use clustered forward shading for point lights")
+    parser.add_argument("--depth-prepass", action="store_true", help="draw depth before shading, shading each pixel once")
+    parser.add_argument("--headless", action="store_true",
+                        help="render offscreen through EGL without a window; set PYOPENGL_PLATFORM=osmesa to use OSMesa")
+    parser.add_argument("--size", default="1920x1000", help="width and height of window or image, as WIDTHxHEIGHT")
+    parser.add_argument("--frames", type=int, help="number of frames to render before exiting; 1 when headless")
+    parser.add_argument("--output", help="image file the last frame is saved to when headless")
+    parser.add_argument("--capture", help="record every frame to a video through ffmpeg, such as flythrough.mp4, "
+                                          "or to numbered images, such as frames/%%05d.png")
+    parser.add_argument("--profile", action="store_true",
+                        help="time each phase of every frame on the CPU and GPU, printing a summary on exit")
+    parser.add_argument("--trace", help="JSON file a Chrome trace of the profiled frames is written to")
+    args = parser.parse_args()
+
+    screen_size = [int(size) for size in args.size.lower().split("x")]
+    frame_count = args.frames
+    if args.headless and frame_count is None:
+        frame_count = 1
+
+    # Writing a trace implies profiling
+    profiler = None
+    if args.profile or args.trace is not None:
+        profiler = FrameProfiler(trace=args.trace is not None)
+
+    # Run the main class with screen size 1920x1000 unless another is given
+    Main(screen_size=screen_size, deferred=args.deferred, clustered=args.clustered,
+         depth_prepass=args.depth_prepass, headless=args.headless).run(frame_count, args.output, args.capture,
+                                                                      profiler, args.trace)
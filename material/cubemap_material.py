@@ -1,16 +1,17 @@
 from material.material import Material
+from core.uniform_buffer import CameraBuffer, DrawBuffer
 
 
 class CubeMapMaterial(Material):
     """
     A material which uses a cube-map for texturing
     """
+    # Sky boxes are drawn at the far plane, so are drawn last, only where no other mesh covers them
+    draw_last = True
+
     def __init__(self, cube_map):
-        vs_code = """
-        uniform mat4 projection_matrix;
-        uniform mat4 view_matrix;
-        uniform mat4 model_matrix;
-        
+        vs_code = CameraBuffer.block_code + DrawBuffer.block_code + """
+        invariant gl_Position;
         in vec3 vertex_position;
         out vec3 tex_coords;
         
@@ -37,4 +38,3 @@ class CubeMapMaterial(Material):
 
         # Add the cube-map as a uniform
         self.add_uniform("samplerCube", "cube_map", [cube_map.texture_ref, 1])
-        self.locate_uniforms()
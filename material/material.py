@@ -1,21 +1,46 @@
 from core.openGLUtils import OpenGLUtils
 from core.uniform import Uniform
+from core.uniform_buffer import DrawBuffer
+from material.shader import Shader
+from texture.texture_array import TextureLayer
 from OpenGL.GL import *
+import numpy as np
 
 
 class Material(object):
     """
-    A class holding all details of the material of a mesh and handles shaders
+    An instance of a Shader, holding the parameter values and textures of the material of a mesh;
+    parameters are packed into the mesh's per-draw record, so materials of one kind share one program
     """
-    def __init__(self, vs_code, fs_code):
-        self.program_ref = OpenGLUtils.initialise_program(vs_code, fs_code)
+    # Features of the scene, set by the renderer, that select the variant of this material
+    scene_features = ()
+
+    # Whether meshes are drawn after all others, passing the depth test wherever nothing nearer was drawn
+    draw_last = False
+
+    def __init__(self, vs_code, fs_code, defines={}):
+        """
+        Creates a material
+        :param vs_code: vertex shader code
+        :param fs_code: fragment shader code
+        :param defines: features of this material, such as {"HAS_TEXTURE": True}
+        """
+        self.shader = Shader.get(vs_code, fs_code, type(self).__name__)
+        self.defines = dict(defines)
+
+        # Variant in use, and the scene features it was selected for
+        self.variant_key = None
+        self.program_ref = None
+        self.scene_defines = None
 
         # Store Uniform objects
         self.uniforms = {}
-        # Standard Uniform objects
-        self.uniforms["model_matrix"] = Uniform("mat4", None)
-        self.uniforms["view_matrix"] = Uniform("mat4", None)
-        self.uniforms["projection_matrix"] = Uniform("mat4", None)
+        # Uniforms read by the current variant as uniforms, rather than from the per-draw record
+        self.active_uniforms = []
+
+        # Material fields of the per-draw record, repacked only when their uniforms change
+        self.draw_data = np.zeros(8, dtype=np.float32)
+        self.draw_data_versions = None
 
         # Store OpenGL render settings
         self.settings = {}
@@ -30,12 +55,94 @@ class Material(object):
         """
         self.uniforms[variable_name] = Uniform(data_type, data)
 
+    @staticmethod
+    def get_texture_defines(texture):
+        """
+        Returns the features selecting how a material samples its texture
+        :param texture: Texture, TextureLayer or None
+        :return: {"HAS_TEXTURE": bool, "HAS_TEXTURE_ARRAY": bool}
+        """
+        is_layer = isinstance(texture, TextureLayer)
+        return {"HAS_TEXTURE": texture is not None and not is_layer, "HAS_TEXTURE_ARRAY": is_layer}
+
+    def add_texture(self, texture):
+        """
+        Supplies a texture as a sampler; a layer of a texture array is sampled from its shared page,
+        with the layer index stored in the per-draw record, so meshes using one page share a binding
+        :param texture: Texture or TextureLayer
+        """
+        if isinstance(texture, TextureLayer):
+            self.add_uniform("sampler2DArray", "texture_array", [texture.texture_ref, 1])
+            self.add_uniform("float", "texture_layer", texture.layer)
+        else:
+            self.add_uniform("sampler2D", "texture", [texture.texture_ref, 1])
+
+    def select_variant(self, scene_defines):
+        """
+        Switches to the variant matching this material and the scene, compiling it if needed
+        :param scene_defines: features of the scene, such as {"NUM_DIR_LIGHTS": 1}
+        """
+        # Most frames use the same scene features as the last
+        if scene_defines == self.scene_defines:
+            return
+        self.scene_defines = dict(scene_defines)
+
+        defines = dict(self.defines)
+        for name in self.scene_features:
+            defines[name] = scene_defines.get(name, 0)
+        key = tuple(sorted(defines.items()))
+        if key == self.variant_key:
+            return
+
+        self.variant_key = key
+        self.program_ref = self.shader.get_variant(key)
+        self.locate_uniforms()
+
+    def get_depth_program(self):
+        """
+        Returns the depth-only program of the current variant, used by the depth pre-pass
+        :return: program reference
+        """
+        return self.shader.get_depth_variant(self.variant_key)
+
     def locate_uniforms(self):
         """
-        Initialises all Uniform variable references
+        Initialises all Uniform variable references in the current variant, once it has linked
+        """
+        program_ref = self.program_ref
+
+        def locate():
+            for variable_name, uniform_object in self.uniforms.items():
+                uniform_object.locate_variable(program_ref, variable_name)
+            self.active_uniforms = [uniform_object for uniform_object in self.uniforms.values()
+                                    if uniform_object.variable_ref != -1]
+
+        OpenGLUtils.when_linked(program_ref, locate)
+
+    def get_draw_data(self):
+        """
+        Returns the material fields of the per-draw record, packed as in DrawBlock
+        :return: float32 array of base_colour, specular_strength, shininess, reflectivity and texture_layer
+        """
+        fields = DrawBuffer.MATERIAL_FIELDS
+        versions = tuple(self.uniforms[name].version for name in fields if name in self.uniforms)
+        if versions != self.draw_data_versions:
+            for name, (offset, size) in fields.items():
+                if name in self.uniforms:
+                    # Offsets are relative to the start of the record, after the model matrix
+                    self.draw_data[offset - 16:offset - 16 + size] = self.uniforms[name].value
+            self.draw_data_versions = versions
+        return self.draw_data
+
+    def get_sort_key(self):
+        """
+        Returns a key grouping materials by program, then by texture, so draws can be ordered
+        to switch programs and textures as rarely as possible
+        :return: (program reference, texture references)
         """
-        for variable_name, uniform_object in self.uniforms.items():
-            uniform_object.locate_variable(self.program_ref, variable_name)
+        textures = tuple(uniform_object.value[0] for uniform_object in self.uniforms.values()
+                         if uniform_object.data_type in Uniform.SAMPLER_TARGETS)
+        return self.program_ref, textures
 
     def update_render_settings(self):
         """
@@ -1,4 +1,8 @@
 from material.material import Material
+from core.uniform_buffer import CameraBuffer, DrawBuffer
+from core.texture_buffer import LightBuffer
+from core.light_clusters import LightClusters
+from core.shadow_cascades import ShadowCascades
 from OpenGL.GL import *
 
 
@@ -6,11 +10,11 @@ class PhongMaterial(Material):
     """
     A material which uses Phong shading
     """
+    scene_features = ("NUM_AMBIENT_LIGHTS", "NUM_DIR_LIGHTS", "NUM_POINT_LIGHTS", "CLUSTERED")
+
     def __init__(self, texture=None, properties={}):
-        vs_code = """
-        uniform mat4 projection_matrix;
-        uniform mat4 view_matrix;
-        uniform mat4 model_matrix;
+        vs_code = CameraBuffer.block_code + DrawBuffer.block_code + """
+        invariant gl_Position;
 
         in vec3 vertex_position;
         in vec2 vertex_uv;
@@ -29,69 +33,45 @@ class PhongMaterial(Material):
         }
         """
 
-        fs_code = """
-        struct Light {
-            int light_type;
-            vec3 colour;
-            vec3 direction;
-            vec3 position;
-            vec3 attenuation;
-        };
-
-        uniform Light light0;
-        uniform Light light1;
-        uniform Light light2;
-        uniform Light light3;
-        uniform vec3 view_position;
-        uniform float specular_strength;
-        uniform float shininess;
-
-        vec3 lightCalc(Light light, vec3 point_position, vec3 point_normal) {
-            float ambient = 0;
-            float diffuse = 0;
+        fs_code = CameraBuffer.block_code + LightBuffer.block_code + LightClusters.block_code + \
+            ShadowCascades.block_code + DrawBuffer.block_code + """
+
+        vec3 lightCalc(Light light, vec3 light_direction, float attenuation, vec3 point_position, vec3 point_normal) {
+            float diffuse = max(dot(point_normal, -light_direction), 0.0);
+            diffuse *= attenuation;
             float specular = 0;
-            float attenuation = 1;
-            vec3 light_direction = vec3(0, 0, 0);
 
-            if (light.light_type == 1)
-            {
-                ambient = 1;
-            }
-            else if (light.light_type == 2)
+            if (diffuse > 0)
             {
-                light_direction = normalize(light.direction);
+                vec3 view_direction = normalize(view_position - point_position);
+                vec3 reflect_direction = reflect(light_direction, point_normal);
+                specular = max(dot(view_direction, reflect_direction), 0.0);
+                specular = specular_strength * pow(specular, shininess);
             }
-            else if (light.light_type == 3)
-            {
-                light_direction = normalize(point_position - light.position);
-                float distance = length(light.position - point_position);
 
-                attenuation = 1.0 / (light.attenuation[0] +
-                                    light.attenuation[1] * distance +
-                                    light.attenuation[2] * distance * distance);
-            }
+            return light.colour * (diffuse + specular);
+        }
 
-            if (light.light_type > 1)
-            {
-                point_normal = normalize(point_normal);
-                diffuse = max(dot(point_normal, -light_direction), 0.0);
-                diffuse *= attenuation;
-                
-                if (diffuse > 0)
-                {
-                    vec3 view_direction = normalize(view_position - point_position);
-                    vec3 reflect_direction = reflect(light_direction, point_normal);
-                    specular = max(dot(view_direction, reflect_direction), 0.0);
-                    specular = specular_strength * pow(specular, shininess);
-                }
-            }
+        vec3 directionalCalc(Light light, vec3 point_position, vec3 point_normal) {
+            return lightCalc(light, normalize(light.direction), 1.0, point_position, point_normal);
+        }
+
+        vec3 pointCalc(Light light, vec3 point_position, vec3 point_normal) {
+            vec3 light_direction = normalize(point_position - light.position);
+            float distance = length(light.position - point_position);
 
-            return light.colour * (ambient + diffuse + specular);
+            float attenuation = 1.0 / (light.attenuation[0] +
+                                       light.attenuation[1] * distance +
+                                       light.attenuation[2] * distance * distance);
+            return lightCalc(light, light_direction, attenuation, point_position, point_normal);
         }
 
-        uniform vec3 base_colour;
-        uniform bool use_texture;
+        #if HAS_TEXTURE
         uniform sampler2D texture;
+        #endif
+        #if HAS_TEXTURE_ARRAY
+        uniform sampler2DArray texture_array;
+        #endif
 
         in vec3 position;
         in vec2 UV;
@@ -102,33 +82,59 @@ class PhongMaterial(Material):
         void main() {
             vec4 colour = vec4(base_colour, 1.0);
 
-            if (use_texture)
+            #if HAS_TEXTURE
+            colour *= texture2D(texture, UV);
+            #endif
+            #if HAS_TEXTURE_ARRAY
+            colour *= texture(texture_array, vec3(UV, texture_layer));
+            #endif
+
+            vec3 point_normal = normalize(normal);
+            vec3 total = vec3(0, 0, 0);
+
+            // Lights are ordered by type, so ambient and directional lights come first
+            for (int i = 0; i < NUM_AMBIENT_LIGHTS; i++)
             {
-                colour *= texture2D(texture, UV);
+                total += getLight(i).colour;
+            }
+            for (int i = NUM_AMBIENT_LIGHTS; i < NUM_AMBIENT_LIGHTS + NUM_DIR_LIGHTS; i++)
+            {
+                vec3 light_colour = directionalCalc(getLight(i), position, point_normal);
+                // One directional light may be blocked by shadow casters
+                if (i == shadow_light)
+                {
+                    light_colour *= getShadow(position, point_normal);
+                }
+                total += light_colour;
             }
 
-            vec3 total = vec3(0, 0, 0);
-            total += lightCalc(light0, position, normal);
-            total += lightCalc(light1, position, normal);
-            total += lightCalc(light2, position, normal);
-            total += lightCalc(light3, position, normal);
+            // Only the point lights chosen for this mesh are evaluated
+            for (int i = 0; i < NUM_POINT_LIGHTS && i < light_count; i++)
+            {
+                total += pointCalc(getLight(light_indices[i / 4][i % 4]), position, point_normal);
+            }
+
+            // With clustered shading, point lights are read from the fragment's cluster
+            #if CLUSTERED
+            ivec2 cluster = getCluster(position);
+            for (int i = 0; i < cluster.y; i++)
+            {
+                int light_index = texelFetch(cluster_lights, cluster.x + i).x;
+                total += pointCalc(getLight(light_index), position, point_normal);
+            }
+            #endif
 
             colour *= vec4(total, 1);
             fragColor = colour;
         }
         """
-        super().__init__(vs_code, fs_code)
+        super().__init__(vs_code, fs_code, defines=self.get_texture_defines(texture))
         if "base_colour" in properties.keys():
             self.add_uniform("vec3", "base_colour", properties["base_colour"])
         else:
             self.add_uniform("vec3", "base_colour", [1, 1, 1])
 
-        # Add lights and shading coefficients as uniforms
-        self.add_uniform("Light", "light0", None)
-        self.add_uniform("Light", "light1", None)
-        self.add_uniform("Light", "light2", None)
-        self.add_uniform("Light", "light3", None)
-        self.add_uniform("vec3", "view_position", [0, 0, 0])
+        # Add shading coefficients as uniforms; lights are read from the light block
         self.add_uniform("float", "specular_strength", 1)
 
         # Shininess controls how the specular highlight looks
@@ -136,13 +142,7 @@ class PhongMaterial(Material):
             self.add_uniform("float", "shininess", properties["shininess"])
         else:
             self.add_uniform("float", "shininess", 32)
-        self.add_uniform("bool", "use_texture", 0)
-
-        # Use texture if supplied
-        if texture is None:
-            self.add_uniform("bool", "use_texture", False)
-        else:
-            self.add_uniform("bool", "use_texture", True)
-            self.add_uniform("sampler2D", "texture", [texture.texture_ref, 1])
 
-        self.locate_uniforms()
+        # Apply texture if supplied
+        if texture is not None:
+            self.add_texture(texture)
@@ -0,0 +1,95 @@
+from core.openGLUtils import OpenGLUtils
+from core.uniform_buffer import UniformBuffer
+from core.texture_buffer import TextureBuffer
+from core.shadow_cascades import ShadowCascades
+
+
+class Shader(object):
+    """
+    Shader code shared by every material of one kind, compiled into program variants
+    with features switched on and off by #defines
+    """
+    # Shaders keyed by a hash of their source, so materials of the same kind share one Shader
+    shaders = {}
+
+    # Fragment shader of depth-only programs, which write no colour
+    DEPTH_FS_CODE = """
+    void main() {
+    }
+    """
+
+    def __init__(self, vs_code, fs_code, name):
+        """
+        Creates a shader; variants are compiled when first requested
+        :param vs_code: vertex shader code
+        :param fs_code: fragment shader code
+        :param name: name of the material kind using the shader, shown in errors
+        """
+        self.vs_code = vs_code
+        self.fs_code = fs_code
+        self.name = name
+
+        # Compiled programs keyed by their sorted defines, and their depth-only counterparts
+        self.variants = {}
+        self.depth_variants = {}
+
+    @staticmethod
+    def get(vs_code, fs_code, name):
+        """
+        Returns the shader with the given source, creating it on first use
+        :param vs_code: vertex shader code
+        :param fs_code: fragment shader code
+        :param name: name of the material kind using the shader
+        :return: Shader
+        """
+        key = OpenGLUtils.source_hash(vs_code, fs_code)
+        if key not in Shader.shaders:
+            Shader.shaders[key] = Shader(vs_code, fs_code, name)
+        return Shader.shaders[key]
+
+    def get_variant(self, variant_key):
+        """
+        Returns the program of a variant, compiling it if needed
+        :param variant_key: sorted tuple of (define name, value) pairs
+        :return: program reference
+        """
+        if variant_key not in self.variants:
+            header = "".join(f"#define {name} {int(value)}\n" for name, value in variant_key)
+            program_ref = OpenGLUtils.initialise_program(header + self.vs_code, header + self.fs_code, self.name)
+            # Program may still be compiling, so shared data is connected once it has linked
+            OpenGLUtils.when_linked(program_ref, lambda: Shader.bind_shared_data(program_ref))
+            self.variants[variant_key] = program_ref
+        return self.variants[variant_key]
+
+    def get_depth_variant(self, variant_key):
+        """
+        Returns a program running the vertex shader of a variant with an empty fragment shader, compiling it if needed;
+        material vertex shaders declare gl_Position invariant, so it writes exactly the depth the variant itself would
+        :param variant_key: sorted tuple of (define name, value) pairs
+        :return: program reference
+        """
+        if variant_key not in self.depth_variants:
+            header = "".join(f"#define {name} {int(value)}\n" for name, value in variant_key)
+            program_ref = OpenGLUtils.initialise_program(header + self.vs_code, Shader.DEPTH_FS_CODE,
+                                                         self.name + " depth")
+            OpenGLUtils.when_linked(program_ref, lambda: Shader.bind_shared_data(program_ref))
+            self.depth_variants[variant_key] = program_ref
+        return self.depth_variants[variant_key]
+
+    @staticmethod
+    def bind_shared_data(program_ref):
+        """
+        Connects a program to the uniform blocks and buffer textures shared by all programs
+        :param program_ref: reference to OpenGL program
+        """
+        # Camera, cluster, per-draw and shadow data are read from uniform blocks shared by all programs
+        UniformBuffer.bind_block(program_ref, "CameraBlock", UniformBuffer.CAMERA)
+        UniformBuffer.bind_block(program_ref, "ClusterBlock", UniformBuffer.CLUSTER)
+        UniformBuffer.bind_block(program_ref, "DrawBlock", UniformBuffer.DRAW)
+        UniformBuffer.bind_block(program_ref, "ShadowBlock", UniformBuffer.SHADOW)
+
+        # Lights and light clusters are read from buffer textures on fixed texture units
+        TextureBuffer.bind_sampler(program_ref, "light_data", TextureBuffer.LIGHT_DATA)
+        TextureBuffer.bind_sampler(program_ref, "cluster_grid", TextureBuffer.CLUSTER_GRID)
+        TextureBuffer.bind_sampler(program_ref, "cluster_lights", TextureBuffer.CLUSTER_LIGHTS)
+        TextureBuffer.bind_sampler(program_ref, "shadow_map", ShadowCascades.TEXTURE_UNIT)
@@ -1,4 +1,5 @@
 from material.material import Material
+from core.uniform_buffer import CameraBuffer, DrawBuffer
 from OpenGL.GL import *
 
 
@@ -7,10 +8,8 @@ class TextureMaterial(Material):
     A shader with no shading, but applies a texture
     """
     def __init__(self, texture, properties={}):
-        vs_code = """
-        uniform mat4 projection_matrix;
-        uniform mat4 view_matrix;
-        uniform mat4 model_matrix;
+        vs_code = CameraBuffer.block_code + DrawBuffer.block_code + """
+        invariant gl_Position;
         in vec3 vertex_position;
         in vec2 vertex_uv;
         out vec2 UV;
@@ -21,24 +20,30 @@ class TextureMaterial(Material):
         }
         """
 
-        fs_code = """
-        uniform vec3 base_colour;
+        fs_code = DrawBuffer.block_code + """
+        #if HAS_TEXTURE_ARRAY
+        uniform sampler2DArray texture_array;
+        #else
         uniform sampler2D texture;
+        #endif
         in vec2 UV;
         out vec4 fragColor;
         
         void main() {
             vec4 colour = vec4(base_colour, 1);
+            #if HAS_TEXTURE_ARRAY
+            fragColor = colour * texture(texture_array, vec3(UV, texture_layer));
+            #else
             fragColor = colour * texture2D(texture, UV);
+            #endif
         }
         """
 
-        super().__init__(vs_code, fs_code)
+        super().__init__(vs_code, fs_code, defines=self.get_texture_defines(texture))
 
         self.add_uniform("vec3", "base_colour", [1, 1, 1])
         # Supply texture as a uniform
-        self.add_uniform("sampler2D", "texture", [texture.texture_ref, 1])
-        self.locate_uniforms()
+        self.add_texture(texture)
 
         # Set up render settings
         self.settings["double_side"] = True
@@ -1,24 +1,31 @@
-import pygame
+import os
+import numpy as np
 from texture.texture import Texture
 from OpenGL.GL import *
 from texture.image_wrapper import ImageWrapper
+from texture.texture_container import TextureContainer
+from texture.texture_streamer import TextureStreamer
 
 
 class CubeMapTexture(Texture):
     """
     Creates a cube-map texture based on 6 given images
     """
-    def __init__(self, file_names=None, folder_route=None, target=GL_TEXTURE_CUBE_MAP, properties={}):
+    def __init__(self, file_names=None, folder_route=None, target=GL_TEXTURE_CUBE_MAP, properties={}, background=False):
         """
-        Creates a cubemap texture for use in environment mapping and skyboxes
+        Creates a cubemap texture for use in environment mapping and skyboxes; a cubemap already loaded
+        from the same images with the same properties is shared
         :param file_names: file names in order [x-, x+, y-, y+, z-, z+]
         :param folder_route: route to files
         :param target: defaults to GL_TEXTURE_CUBE_MAP
         :param properties:
+        :param background: whether the faces are uploaded once decoded, sampling a placeholder until then
         """
         self.surface = None
         self.target = target
         self.format = GL_RGB
+        self.released = False
+        self.futures = None
 
         # Default property values
         self.properties = {
@@ -47,38 +54,118 @@ class CubeMapTexture(Texture):
             self.folder_route = "../images"
         else:
             self.folder_route = folder_route
+        file_routes = [f"{self.folder_route}/{file_name}" for file_name in self.file_names]
 
-        # Create and bind to a texture
+        # Share the texture of a cubemap made from the same images
+        self.shared_key = self.get_shared_key(file_routes)
+        entry = Texture.shared.get(self.shared_key)
+        if entry is not None:
+            self.texture_ref = entry[0]
+            entry[2] += 1
+            return
+
+        # Create a texture
         self.texture_ref = glGenTextures(1)
+        Texture.shared[self.shared_key] = [self.texture_ref, None, 1, self]
+
+        # Faces and their mip chains are read from the cache file if it is newer than every image
+        self.cache_route = self.get_cache_route()
+        container = TextureContainer.find_baked(self.cache_route, file_routes)
+        if container is not None:
+            self.upload_faces(container.faces, container.format, background)
+            return
+
+        # Decode all 6 images and build their mip chains in parallel on worker threads
+        self.futures = [ImageWrapper.load_async(file_route, self.format, mipmaps=True) for file_route in file_routes]
+        if background:
+            # Sample a placeholder on every face until the images are ready
+            Texture.loading.append(self)
+            self.bind(target=self.target)
+            for i in range(6):
+                glTexImage2D(GL_TEXTURE_CUBE_MAP_POSITIVE_X + i, 0, GL_RGBA, 1, 1, 0, GL_RGBA, GL_UNSIGNED_BYTE,
+                             Texture.PLACEHOLDER)
+            self.set_parameters()
+            self.unbind(target=self.target)
+        else:
+            self.finish_loading(background=False)
+
+    def get_shared_key(self, file_routes):
+        """
+        Returns the key under which the cubemap of a set of images is shared
+        :param file_routes: routes to the image of each face
+        :return: (resolved paths, target, sorted properties)
+        """
+        return (tuple(os.path.realpath(file_route) for file_route in file_routes), self.target,
+                tuple(sorted(self.properties.items())))
+
+    def get_cache_route(self):
+        """
+        Returns the route of the file caching the decoded faces, next to the images
+        :return: absolute route to cache file, as it is written while models may change the working directory
+        """
+        names = "_".join(os.path.splitext(file_name)[0] for file_name in self.file_names)
+        return os.path.abspath(f"{self.folder_route}/cube_{names}{TextureContainer.EXTENSION}")
+
+    def finish_loading(self, background=True):
+        """
+        Uploads the decoded faces, and caches them with their mip chains for the next launch
+        :param background: whether the faces are streamed over the following frames
+        """
+        futures = self.futures
+        self.futures = None
+        if not self.is_loading_shared():
+            return
+        faces = [future.result().levels for future in futures]
+        # Write the cache on a worker thread, as it is not needed until the next launch
+        ImageWrapper.pool.submit(self.write_cache, faces)
+        self.upload_faces(faces, self.format, background)
+
+    def write_cache(self, faces):
+        """
+        Writes the faces and their mip chains into the cache file
+        :param faces: list of 6 mip chains, largest level first
+        """
+        try:
+            TextureContainer.write(self.cache_route, faces, flipped=True)
+        except OSError:
+            # The cache is optional, so a read-only image folder only costs decoding at each launch
+            pass
+
+    def upload_faces(self, faces, pixel_format, background=False):
+        """
+        Allocates immutable storage for every face and level, then uploads them
+        :param faces: list of 6 mip chains, each a list of arrays of shape (height, width, channels)
+        :param pixel_format: GL_RGB or GL_RGBA
+        :param background: whether the faces are streamed over the following frames
+        """
+        targets = [(GL_TEXTURE_CUBE_MAP_POSITIVE_X + i, levels) for i, levels in enumerate(faces)]
+        if background:
+            Texture.get_streamer().add(self, targets, GL_RGB, pixel_format)
+            return
+
         self.bind(target=self.target)
+        TextureStreamer.allocate(self.target, targets, GL_RGB, pixel_format)
+        glTexParameteri(self.target, GL_TEXTURE_MAX_LEVEL, len(faces[0]) - 1)
 
-        # Load all 6 images and send to each face of the cubemap
-        for i in range(6):
-            image = ImageWrapper(file_route=f"{self.folder_route}/{self.file_names[i]}", img_format=self.format)
-            if image:
-                width = image.get_width()
-                height = image.get_height()
-                data = image.data()
-
-                glTexImage2D(
-                    GL_TEXTURE_CUBE_MAP_POSITIVE_X + i,
-                    0,
-                    self.format,
-                    width,
-                    height,
-                    0,
-                    self.format,
-                    GL_UNSIGNED_BYTE,
-                    data
-                )
-            else:
-                print(f"Failed to load image texture: {self.folder_route}/{self.file_names[i]}")
+        # Rows of RGB levels are not padded to 4 bytes
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+        for target, levels in targets:
+            for level, pixels in enumerate(levels):
+                height, width = pixels.shape[:2]
+                glTexSubImage2D(target, level, 0, 0, width, height, pixel_format, GL_UNSIGNED_BYTE,
+                                np.ascontiguousarray(pixels))
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
 
+        self.set_parameters()
+        self.unbind(target=self.target)
+
+    def set_parameters(self):
+        """
+        Sets the filters and wrap of the bound cubemap from its properties
+        """
         glTexParameteri(self.target, GL_TEXTURE_MAG_FILTER, self.properties["mag_filter"])
         glTexParameteri(self.target, GL_TEXTURE_MIN_FILTER, self.properties["min_filter"])
 
         glTexParameteri(self.target, GL_TEXTURE_WRAP_S, self.properties["wrap"])
         glTexParameteri(self.target, GL_TEXTURE_WRAP_T, self.properties["wrap"])
         glTexParameteri(self.target, GL_TEXTURE_WRAP_R, self.properties["wrap"])
-
-        self.unbind(target=self.target)
@@ -1,11 +1,18 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pygame
 from OpenGL.GL import *
+from texture.texture_container import TextureContainer
 
 
 class ImageWrapper:
     """
     Creates a wrapper to load and deal with a given image
     """
+    # Worker threads decoding images in the background, created when first needed
+    pool = None
+
     def __init__(self, file_route, img_format):
         """
         Creates a wrapper to load and parse image
@@ -16,11 +23,52 @@ class ImageWrapper:
         self.format = img_format
         self.image = pygame.image.load(file_route)
 
+        # Byte string of image in its own format, stored once converted
+        self.pixel_data = None
+
+        # Mip chain of image, largest level first, if built when decoded
+        self.levels = None
+
+    @staticmethod
+    def load_async(file_route, img_format, mipmaps=False):
+        """
+        Loads an image and converts it to a byte string on a worker thread
+        :param file_route: route to image file
+        :param img_format: colour format of image
+        :param mipmaps: whether the mip chain of the image is also built on the worker thread
+        :return: Future resolving to the ImageWrapper
+        """
+        if ImageWrapper.pool is None:
+            ImageWrapper.pool = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="image")
+        # Resolve the route now, as loading models changes the working directory while the image is decoded
+        return ImageWrapper.pool.submit(ImageWrapper.decode, os.path.abspath(file_route), img_format, mipmaps)
+
+    @staticmethod
+    def decode(file_route, img_format, mipmaps=False):
+        """
+        Loads an image and converts it to a byte string, so no decoding is left for the render thread
+        :param file_route: route to image file
+        :param img_format: colour format of image
+        :param mipmaps: whether the mip chain of the image is also built
+        :return: ImageWrapper
+        """
+        image = ImageWrapper(file_route, img_format)
+        image.pixel_data = image.data(img_format)
+        if mipmaps:
+            channels = 4 if img_format == GL_RGBA else 3
+            pixels = np.frombuffer(image.pixel_data, dtype=np.uint8)
+            image.levels = TextureContainer.build_mip_chain(
+                pixels.reshape(image.get_height(), image.get_width(), channels)
+            )
+        return image
+
     def flip(self):
         """
         Flips an image vertically
         """
         self.image = pygame.transform.flip(self.image, False, True)
+        self.pixel_data = None
+        self.levels = None
 
     def get_width(self):
         """
@@ -42,6 +90,8 @@ class ImageWrapper:
         :param img_format: colour format of image
         :return: byte string of image
         """
+        if img_format == self.format and self.pixel_data is not None:
+            return self.pixel_data
         if img_format == GL_RGBA:
             return pygame.image.tostring(self.image, "RGBA", 1)
         elif img_format == GL_RGB:
@@ -1,23 +1,38 @@
+import os
 import pygame
 from OpenGL.GL import *
 from texture.image_wrapper import ImageWrapper
+from texture.texture_container import TextureContainer
+from texture.texture_streamer import TextureStreamer
+from core.uniform import Uniform
 
 
 class Texture(object):
-    def __init__(self, file_name=None, target=GL_TEXTURE_2D, properties={}):
+    # Textures loaded from files, shared by every Texture with the same file and properties,
+    # as key: [texture reference, image, number of users, Texture that loads it]
+    shared = {}
+
+    # Textures sampling a placeholder while their images are decoded on worker threads
+    loading = []
+
+    # Colour of the placeholder, white so that material colours are unchanged
+    PLACEHOLDER = bytes([255, 255, 255, 255])
+
+    # Streams decoded images through pixel buffers over several frames, created when first needed
+    streamer = None
+
+    def __init__(self, file_name=None, target=GL_TEXTURE_2D, properties={}, background=False):
         """
-        Creates a 2D texture from a given image
-        :param file_name: file name of object
+        Creates a 2D texture from a given image; an image already loaded with the same properties is shared
+        :param file_name: file name of image, used from its baked file if one is up to date
         :param target: OpenGL target of texture
         :param properties: properties of texture (the mag and min filters and the wrap to use)
+        :param background: whether the image is decoded on a worker thread, leaving a placeholder until uploaded
         """
         # Pygame surface object to store image data
         self.surface = None
         self.target = target
 
-        # Generate texture reference
-        self.texture_ref = glGenTextures(1)
-
         # Default property values
         self.properties = {
             "mag_filter": GL_LINEAR,
@@ -28,9 +43,46 @@ class Texture(object):
         # Override default properties
         self.set_properties(properties)
 
-        if file_name is not None:
-            self.load_image(file_name)
-            self.upload_data()
+        # Key of shared texture, or None if this texture is not shared
+        self.shared_key = None
+        self.released = False
+
+        # Images being decoded for this texture, or None once uploaded
+        self.futures = None
+
+        if file_name is None:
+            # Generate texture reference
+            self.texture_ref = glGenTextures(1)
+            return
+
+        self.shared_key = self.get_shared_key(file_name)
+        entry = Texture.shared.get(self.shared_key)
+        if entry is None:
+            self.texture_ref = glGenTextures(1)
+            # Images baked with their mipmaps are uploaded without decoding
+            container = TextureContainer.find(file_name)
+            if container is not None and background:
+                self.stream_container(container)
+            elif container is not None:
+                self.upload_container(container)
+            elif background:
+                self.load_image_async(file_name)
+            else:
+                self.load_image(file_name)
+                self.upload_data()
+            entry = [self.texture_ref, self.surface, 0, self]
+            Texture.shared[self.shared_key] = entry
+        else:
+            self.texture_ref, self.surface = entry[0], entry[1]
+        entry[2] += 1
+
+    def get_shared_key(self, file_name):
+        """
+        Returns the key under which a loaded image is shared
+        :param file_name: image file name
+        :return: (resolved path, target, sorted properties)
+        """
+        return os.path.realpath(file_name), self.target, tuple(sorted(self.properties.items()))
 
     def load_image(self, file_name):
         """
@@ -39,6 +91,64 @@ class Texture(object):
         """
         self.surface = ImageWrapper(file_route=file_name, img_format=GL_RGBA)
 
+    def load_image_async(self, file_name):
+        """
+        Starts decoding an image on a worker thread, uploading a placeholder to sample until it is ready
+        :param file_name: image file name
+        """
+        self.futures = [ImageWrapper.load_async(file_name, GL_RGBA, mipmaps=True)]
+        Texture.loading.append(self)
+
+        self.bind(self.target)
+        glTexImage2D(self.target, 0, GL_RGBA, 1, 1, 0, GL_RGBA, GL_UNSIGNED_BYTE, Texture.PLACEHOLDER)
+        self.set_parameters()
+
+    def finish_loading(self):
+        """
+        Starts streaming the decoded image and its mip chain in place of the placeholder
+        """
+        futures = self.futures
+        self.futures = None
+        if not self.is_loading_shared():
+            return
+        self.surface = futures[0].result()
+        Texture.get_streamer().add(self, [(self.target, self.surface.levels)], GL_RGBA, GL_RGBA)
+        Texture.shared[self.shared_key][1] = self.surface
+
+    def is_loading_shared(self):
+        """
+        Returns whether this Texture loads a shared texture that is still in use; once deleted, its key may
+        be shared by a newer texture, which the decoded image must not be given to
+        :return: bool
+        """
+        entry = Texture.shared.get(self.shared_key)
+        return entry is not None and entry[3] is self
+
+    @staticmethod
+    def get_streamer():
+        """
+        Returns the streamer of texture uploads, creating it on first use
+        :return: TextureStreamer
+        """
+        if Texture.streamer is None:
+            Texture.streamer = TextureStreamer()
+        return Texture.streamer
+
+    @staticmethod
+    def upload_loaded():
+        """
+        Streams textures whose images have finished decoding, up to the per-frame byte budget;
+        called on the render thread before each frame
+        :return: number of bytes uploaded
+        """
+        ready = [texture for texture in Texture.loading if all(future.done() for future in texture.futures)]
+        for texture in ready:
+            Texture.loading.remove(texture)
+            texture.finish_loading()
+        if Texture.streamer is None:
+            return 0
+        return Texture.streamer.update()
+
     def set_properties(self, properties):
         """
         Set properties of texture object
@@ -73,6 +183,33 @@ class Texture(object):
         # Generate Mipmaps
         glGenerateMipmap(self.target)
 
+        self.set_parameters()
+
+    def upload_container(self, container):
+        """
+        Uploads every mip level of a baked texture file, instead of generating mipmaps
+        :param container: TextureContainer
+        """
+        self.bind(self.target)
+        container.upload(self.target)
+        glTexParameteri(self.target, GL_TEXTURE_MAX_LEVEL, len(container.levels) - 1)
+        self.set_parameters()
+        container.close()
+
+    def stream_container(self, container):
+        """
+        Streams every mip level of a baked texture file over the following frames
+        :param container: TextureContainer
+        """
+        levels = container.levels
+        if not container.flipped:
+            levels = [pixels[::-1] for pixels in levels]
+        Texture.get_streamer().add(self, [(self.target, levels)], GL_RGBA, container.format)
+
+    def set_parameters(self):
+        """
+        Sets the filters and wrap of the bound texture from its properties
+        """
         # Set texture mag and min filters
         glTexParameteri(self.target, GL_TEXTURE_MAG_FILTER, self.properties["mag_filter"])
         glTexParameteri(self.target, GL_TEXTURE_MIN_FILTER, self.properties["min_filter"])
@@ -85,10 +222,41 @@ class Texture(object):
         """
         Binds a named texture to a texture target - for use in making cubemaps
         """
+        # Texture unit 0 is reserved for uploads, so units used by materials keep their bindings
+        glActiveTexture(GL_TEXTURE0)
         glBindTexture(target, self.texture_ref)
 
     def unbind(self, target=GL_TEXTURE_2D):
         """
         Unbinds a named texture from a texture target
         """
+        glActiveTexture(GL_TEXTURE0)
         glBindTexture(target, 0)
+
+    def release(self):
+        """
+        Stops using the texture, deleting it once no other Texture shares it
+        """
+        if self.released:
+            return
+        self.released = True
+
+        # Other users keep the texture, and its image is still uploaded if loading
+        loader = self
+        if self.shared_key is not None:
+            entry = Texture.shared[self.shared_key]
+            entry[2] -= 1
+            if entry[2] > 0:
+                return
+            del Texture.shared[self.shared_key]
+            # The image is loaded by the Texture that created the texture, which may have been released already
+            loader = entry[3]
+
+        if loader in Texture.loading:
+            Texture.loading.remove(loader)
+        if Texture.streamer is not None:
+            Texture.streamer.cancel(loader)
+        glDeleteTextures([self.texture_ref])
+        Uniform.forget_texture(self.texture_ref)
+        self.texture_ref = None
+        self.surface = None
@@ -0,0 +1,140 @@
+import os
+import numpy as np
+from OpenGL.GL import *
+from texture.image_wrapper import ImageWrapper
+from texture.texture_container import TextureContainer
+
+
+class TextureArray(object):
+    """
+    A page of equally sized textures stored as the layers of one GL_TEXTURE_2D_ARRAY, so meshes
+    textured from the same page are drawn without binding a different texture
+    """
+    # Layers held by each page
+    LAYER_COUNT = 16
+
+    # Pages keyed by layer size and properties, each a list of pages filled in order
+    pages = {}
+
+    def __init__(self, width, height, properties):
+        """
+        Allocates every mip level of every layer
+        :param width: width of each layer
+        :param height: height of each layer
+        :param properties: mag and min filters and wrap of the page
+        """
+        self.width = width
+        self.height = height
+        self.properties = properties
+        self.layer_count = 0
+
+        self.texture_ref = glGenTextures(1)
+        self.bind()
+        level_count = int(np.log2(max(width, height))) + 1
+        for level in range(level_count):
+            glTexImage3D(GL_TEXTURE_2D_ARRAY, level, GL_RGBA8, max(width >> level, 1), max(height >> level, 1),
+                         TextureArray.LAYER_COUNT, 0, GL_RGBA, GL_UNSIGNED_BYTE, None)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MAX_LEVEL, level_count - 1)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MAG_FILTER, properties["mag_filter"])
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MIN_FILTER, properties["min_filter"])
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_S, properties["wrap"])
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_T, properties["wrap"])
+
+    @staticmethod
+    def get_page(width, height, properties):
+        """
+        Returns a page with a free layer of the given size and properties, creating one if all are full
+        :param width: width of layer
+        :param height: height of layer
+        :param properties: mag and min filters and wrap
+        :return: TextureArray
+        """
+        key = width, height, tuple(sorted(properties.items()))
+        page_list = TextureArray.pages.setdefault(key, [])
+        if not page_list or page_list[-1].layer_count == TextureArray.LAYER_COUNT:
+            page_list.append(TextureArray(width, height, properties))
+        return page_list[-1]
+
+    def add_layer(self, levels, pixel_format):
+        """
+        Uploads a mip chain into the next free layer
+        :param levels: list of arrays of shape (height, width, channels), largest first, bottom row first
+        :param pixel_format: GL_RGB or GL_RGBA
+        :return: index of layer
+        """
+        layer = self.layer_count
+        self.layer_count += 1
+
+        self.bind()
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+        for level, pixels in enumerate(levels):
+            height, width = pixels.shape[:2]
+            glTexSubImage3D(GL_TEXTURE_2D_ARRAY, level, 0, 0, layer, width, height, 1, pixel_format,
+                            GL_UNSIGNED_BYTE, np.ascontiguousarray(pixels))
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
+        return layer
+
+    def bind(self):
+        """
+        Binds the page for uploading
+        """
+        # Texture unit 0 is reserved for uploads, so units used by materials keep their bindings
+        glActiveTexture(GL_TEXTURE0)
+        glBindTexture(GL_TEXTURE_2D_ARRAY, self.texture_ref)
+
+
+class TextureLayer(object):
+    """
+    An image packed into a layer of a shared TextureArray page; given to a material in place of a Texture
+    """
+    # Layers already packed, keyed by resolved path and properties
+    layers = {}
+
+    def __init__(self, file_name, properties={}):
+        """
+        Packs an image into a page holding images of the same size and properties
+        :param file_name: file name of image, used from its baked file if one is up to date
+        :param properties: properties of texture (the mag and min filters and the wrap to use)
+        """
+        self.properties = {
+            "mag_filter": GL_LINEAR,
+            "min_filter": GL_LINEAR_MIPMAP_LINEAR,
+            "wrap": GL_REPEAT
+        }
+        for name, data in properties.items():
+            if name in self.properties.keys():
+                self.properties[name] = data
+            else:
+                raise Exception(f"No property named: {name}")
+
+        key = os.path.realpath(file_name), tuple(sorted(self.properties.items()))
+        if key not in TextureLayer.layers:
+            TextureLayer.layers[key] = self.pack(file_name)
+        self.page, self.layer = TextureLayer.layers[key]
+
+        # Materials sample the whole page, selecting the layer from their per-draw record
+        self.texture_ref = self.page.texture_ref
+
+    def pack(self, file_name):
+        """
+        Loads an image with its mip chain and uploads it into a free layer
+        :param file_name: file name of image
+        :return: (page, layer index)
+        """
+        container = TextureContainer.find(file_name)
+        if container is not None:
+            levels = container.levels if container.flipped else [pixels[::-1] for pixels in container.levels]
+            pixel_format = container.format
+        else:
+            levels = ImageWrapper.decode(file_name, GL_RGBA, mipmaps=True).levels
+            pixel_format = GL_RGBA
+
+        height, width = levels[0].shape[:2]
+        page = TextureArray.get_page(width, height, self.properties)
+        layer = page.add_layer(levels, pixel_format)
+
+        if container is not None:
+            # The upload has copied the pixels, so the views into the mapped file are released before unmapping it
+            del levels
+            container.close()
+        return page, layer
@@ -0,0 +1,222 @@
+import argparse
+import mmap
+import os
+import struct
+import numpy as np
+import pygame
+from OpenGL.GL import *
+
+
+class TextureContainer(object):
+    """
+    Reads a baked texture file holding every mip level of every face as raw pixels, so a texture
+    is uploaded without decoding an image or generating mipmaps
+    """
+    # File layout: header, then (offset, width, height) of each level of each face, then the pixels of each level
+    MAGIC = b"STEX"
+    VERSION = 2
+    HEADER = struct.Struct("<4sIIIIIII")
+    LEVEL = struct.Struct("<QII")
+
+    # Flag set when rows are stored bottom first, as OpenGL expects
+    FLIPPED = 1
+
+    # Extension of baked files, which are written next to their source images
+    EXTENSION = ".stex"
+
+    # Image file types converted by the baker
+    IMAGE_TYPES = (".png", ".jpg", ".jpeg", ".bmp", ".tga")
+
+    def __init__(self, file_route):
+        """
+        Maps a baked texture file into memory
+        :param file_route: route to baked file
+        """
+        self.file_route = file_route
+        with open(file_route, "rb") as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, flags, channels, width, height, face_count, level_count = \
+            TextureContainer.HEADER.unpack_from(self.buffer)
+        if magic != TextureContainer.MAGIC or version != TextureContainer.VERSION:
+            raise Exception(f"Not a version {TextureContainer.VERSION} texture file: {file_route}")
+
+        self.flipped = bool(flags & TextureContainer.FLIPPED)
+        self.channels = channels
+        self.format = GL_RGBA if channels == 4 else GL_RGB
+        self.width = width
+        self.height = height
+
+        # Pixels of each level of each face, as arrays reading directly from the mapped file
+        self.faces = []
+        for face in range(face_count):
+            levels = []
+            for level in range(level_count):
+                table_offset = TextureContainer.HEADER.size + (face * level_count + level) * TextureContainer.LEVEL.size
+                offset, level_width, level_height = TextureContainer.LEVEL.unpack_from(self.buffer, table_offset)
+                pixels = np.frombuffer(self.buffer, dtype=np.uint8, count=level_width * level_height * channels,
+                                       offset=offset)
+                levels.append(pixels.reshape(level_height, level_width, channels))
+            self.faces.append(levels)
+        # Levels of the only face of a 2D texture
+        self.levels = self.faces[0]
+
+    @staticmethod
+    def baked_route(file_route):
+        """
+        Returns the route of the baked file made from an image
+        :param file_route: route to image file
+        :return: route to baked file
+        """
+        return os.path.splitext(file_route)[0] + TextureContainer.EXTENSION
+
+    @staticmethod
+    def find(file_route):
+        """
+        Finds an up to date baked file for an image
+        :param file_route: route to image file, or to a baked file
+        :return: TextureContainer, or None if the image has not been baked since it last changed
+        """
+        if file_route.endswith(TextureContainer.EXTENSION):
+            return TextureContainer(file_route)
+        return TextureContainer.find_baked(TextureContainer.baked_route(file_route), [file_route])
+
+    @staticmethod
+    def find_baked(baked_route, file_routes):
+        """
+        Opens a baked file if it was written by this version after every image it was made from last changed
+        :param baked_route: route to baked file
+        :param file_routes: routes to source images
+        :return: TextureContainer, or None if the file is missing or out of date
+        """
+        if not os.path.exists(baked_route):
+            return None
+        if any(os.path.getmtime(baked_route) < os.path.getmtime(file_route) for file_route in file_routes):
+            return None
+        with open(baked_route, "rb") as file:
+            magic, version = struct.unpack("<4sI", file.read(8))
+        if magic != TextureContainer.MAGIC or version != TextureContainer.VERSION:
+            return None
+        return TextureContainer(baked_route)
+
+    def upload(self, target, internal_format=GL_RGBA):
+        """
+        Uploads every level to the bound texture
+        :param target: OpenGL target of texture, or the face of a cubemap
+        :param internal_format: format the texture is stored in
+        """
+        # Rows of RGB levels are not padded to 4 bytes
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+        for level, pixels in enumerate(self.levels):
+            if not self.flipped:
+                pixels = np.ascontiguousarray(pixels[::-1])
+            height, width = pixels.shape[:2]
+            glTexImage2D(target, level, internal_format, width, height, 0, self.format, GL_UNSIGNED_BYTE, pixels)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
+
+    def close(self):
+        """
+        Unmaps the file once its levels have been uploaded
+        """
+        self.faces = []
+        self.levels = []
+        self.buffer.close()
+
+    @staticmethod
+    def build_mip_chain(pixels):
+        """
+        Halves an image until it is 1 pixel in size, averaging each 2x2 block of pixels
+        :param pixels: array of shape (height, width, channels)
+        :return: list of levels, largest first
+        """
+        levels = [pixels]
+        while pixels.shape[0] > 1 or pixels.shape[1] > 1:
+            level = pixels.astype(np.float32)
+            height, width = level.shape[:2]
+            # A row or column left over from an odd size is dropped, as OpenGL rounds level sizes down
+            if height > 1:
+                level = (level[0:height - 1:2] + level[1:height:2]) / 2
+            if width > 1:
+                level = (level[:, 0:width - 1:2] + level[:, 1:width:2]) / 2
+            pixels = np.round(level).astype(np.uint8)
+            levels.append(pixels)
+        return levels
+
+    @staticmethod
+    def bake(file_route, baked_route=None, flip=True):
+        """
+        Converts an image into a baked file holding its full mip chain
+        :param file_route: route to image file
+        :param baked_route: route of file to write, defaulting to the image route with the baked extension
+        :param flip: whether rows are stored bottom first, so they are uploaded without flipping
+        :return: route of baked file
+        """
+        if baked_route is None:
+            baked_route = TextureContainer.baked_route(file_route)
+
+        image = pygame.image.load(file_route)
+        # Images without an alpha channel are stored as RGB, taking 3/4 of the space
+        mode = "RGBA" if image.get_flags() & pygame.SRCALPHA else "RGB"
+        width, height = image.get_size()
+        pixels = np.frombuffer(pygame.image.tostring(image, mode, flip), dtype=np.uint8)
+        levels = TextureContainer.build_mip_chain(pixels.reshape(height, width, len(mode)))
+
+        TextureContainer.write(baked_route, [levels], flip)
+        return baked_route
+
+    @staticmethod
+    def write(baked_route, faces, flipped=True):
+        """
+        Writes the mip chains of one or more equally sized faces into a baked file
+        :param baked_route: route of file to write
+        :param faces: list of mip chains, each a list of arrays of shape (height, width, channels), largest first
+        :param flipped: whether rows are stored bottom first
+        """
+        height, width, channels = faces[0][0].shape
+        level_count = len(faces[0])
+
+        # Pixels start after the header and level table, each level following the last
+        offset = TextureContainer.HEADER.size + len(faces) * level_count * TextureContainer.LEVEL.size
+        table = b""
+        for levels in faces:
+            for level in levels:
+                table += TextureContainer.LEVEL.pack(offset, level.shape[1], level.shape[0])
+                offset += level.nbytes
+
+        flags = TextureContainer.FLIPPED if flipped else 0
+        header = TextureContainer.HEADER.pack(TextureContainer.MAGIC, TextureContainer.VERSION, flags, channels,
+                                              width, height, len(faces), level_count)
+        # Write to a temporary file first, so a running program never maps a partly written file
+        with open(baked_route + ".tmp", "wb") as file:
+            file.write(header + table)
+            for levels in faces:
+                for level in levels:
+                    file.write(np.ascontiguousarray(level).tobytes())
+        os.replace(baked_route + ".tmp", baked_route)
+
+    @staticmethod
+    def bake_folder(folder_route, flip=True):
+        """
+        Bakes every image within a folder and its subfolders
+        :param folder_route: route to folder
+        :param flip: whether rows are stored bottom first
+        :return: list of routes of baked files
+        """
+        baked_routes = []
+        for root, folders, file_names in os.walk(folder_route):
+            for file_name in sorted(file_names):
+                if os.path.splitext(file_name)[1].lower() in TextureContainer.IMAGE_TYPES:
+                    baked_route = TextureContainer.bake(os.path.join(root, file_name), flip=flip)
+                    print(f"Baked {os.path.join(root, file_name)} into {baked_route}")
+                    baked_routes.append(baked_route)
+        return baked_routes
+
+
+if __name__ == '__main__':
+    # Bake images ahead of time, run from the repository root with: python -m texture.texture_container images
+    parser = argparse.ArgumentParser(description="Bake images into texture files with precomputed mipmaps")
+    parser.add_argument("folder", nargs="?", default="images", help="folder of images to bake")
+    parser.add_argument("--no-flip", action="store_true", help="store rows top first, flipping them when loaded")
+    args = parser.parse_args()
+
+    TextureContainer.bake_folder(args.folder, flip=not args.no_flip)
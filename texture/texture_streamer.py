@@ -0,0 +1,182 @@
+import ctypes
+import numpy as np
+from OpenGL.GL import *
+
+
+class TextureUpload(object):
+    """
+    Mip levels of one texture waiting to be streamed, smallest level first
+    """
+    def __init__(self, texture, faces, internal_format, pixel_format):
+        """
+        Creates an upload, to be advanced by the streamer
+        :param texture: Texture receiving the pixels
+        :param faces: list of (target, levels) pairs, one per face, levels largest first
+        :param internal_format: format the texture is stored in
+        :param pixel_format: format of the pixels, GL_RGB or GL_RGBA
+        """
+        self.texture = texture
+        self.faces = faces
+        self.internal_format = internal_format
+        self.pixel_format = pixel_format
+        self.level_count = len(faces[0][1])
+
+        # Position reached, as level, face within level and row within face
+        self.level = self.level_count - 1
+        self.face = 0
+        self.row = 0
+
+    def is_complete(self):
+        """
+        Returns whether every level has been uploaded
+        :return: bool
+        """
+        return self.level < 0
+
+
+class TextureStreamer(object):
+    """
+    Uploads textures through pixel buffer objects, spreading large textures across frames with a
+    per-frame byte budget. Levels are uploaded smallest first and the texture's base level lowered as
+    each completes, so it is always sampled from a complete, progressively sharper mip chain
+    """
+    # Bytes uploaded per frame
+    BYTE_BUDGET = 4 * 1024 * 1024
+
+    # Pixel buffers used in turn, so a buffer is not rewritten while the GPU may still be reading it
+    BUFFER_COUNT = 3
+
+    # Sized formats used to allocate storage
+    SIZED_FORMATS = {GL_RGB: GL_RGB8, GL_RGBA: GL_RGBA8}
+
+    def __init__(self, byte_budget=BYTE_BUDGET):
+        """
+        Creates the pixel buffers
+        :param byte_budget: number of bytes uploaded per frame
+        """
+        self.byte_budget = byte_budget
+        self.buffer_refs = glGenBuffers(TextureStreamer.BUFFER_COUNT)
+        self.buffer_index = 0
+
+        # Uploads in progress, in order of submission
+        self.uploads = []
+
+        # Bytes uploaded during the last frame
+        self.upload_bytes = 0
+
+    def add(self, texture, faces, internal_format=GL_RGBA, pixel_format=GL_RGBA):
+        """
+        Allocates every level of a texture and queues its pixels for streaming
+        :param texture: Texture receiving the pixels
+        :param faces: list of (target, levels) pairs, one per face, each level an array of shape (height, width, channels)
+        :param internal_format: format the texture is stored in
+        :param pixel_format: format of the pixels, GL_RGB or GL_RGBA
+        """
+        upload = TextureUpload(texture, faces, internal_format, pixel_format)
+
+        texture.bind(texture.target)
+        TextureStreamer.allocate(texture.target, faces, internal_format, pixel_format)
+        # Sample nothing finer than the levels already uploaded
+        glTexParameteri(texture.target, GL_TEXTURE_BASE_LEVEL, upload.level_count - 1)
+        glTexParameteri(texture.target, GL_TEXTURE_MAX_LEVEL, upload.level_count - 1)
+        texture.set_parameters()
+
+        self.uploads.append(upload)
+
+    @staticmethod
+    def allocate(texture_target, faces, internal_format, pixel_format):
+        """
+        Allocates every level of every face of the bound texture, as immutable storage where supported
+        :param texture_target: target the texture is bound to
+        :param faces: list of (target, levels) pairs, one per face, levels largest first
+        :param internal_format: format the texture is stored in
+        :param pixel_format: format of the pixels, GL_RGB or GL_RGBA
+        """
+        sized_format = TextureStreamer.SIZED_FORMATS.get(internal_format, internal_format)
+        levels = faces[0][1]
+        height, width = levels[0].shape[:2]
+        # Immutable storage lets the driver skip completeness checks when the texture is sampled
+        if bool(glTexStorage2D):
+            glTexStorage2D(texture_target, len(levels), sized_format, width, height)
+            return
+        for target, levels in faces:
+            for level, pixels in enumerate(levels):
+                height, width = pixels.shape[:2]
+                glTexImage2D(target, level, sized_format, width, height, 0, pixel_format, GL_UNSIGNED_BYTE, None)
+
+    def cancel(self, texture):
+        """
+        Stops streaming a texture, such as when it is deleted
+        :param texture: Texture receiving the pixels
+        """
+        self.uploads = [upload for upload in self.uploads if upload.texture is not texture]
+
+    def is_streaming(self, texture):
+        """
+        Returns whether a texture still has pixels waiting to be uploaded
+        :param texture: Texture
+        :return: bool
+        """
+        return any(upload.texture is texture for upload in self.uploads)
+
+    def update(self):
+        """
+        Uploads pixels until the byte budget of this frame is spent
+        :return: number of bytes uploaded
+        """
+        self.upload_bytes = 0
+        if not self.uploads:
+            return 0
+
+        # Rows of RGB pixels are not padded to 4 bytes
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+        while self.uploads and self.upload_bytes < self.byte_budget:
+            upload = self.uploads[0]
+            self.upload_bytes += self.upload_rows(upload, self.byte_budget - self.upload_bytes)
+            if upload.is_complete():
+                self.uploads.pop(0)
+        glBindBuffer(GL_PIXEL_UNPACK_BUFFER, 0)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
+        return self.upload_bytes
+
+    def upload_rows(self, upload, byte_limit):
+        """
+        Copies as many rows of the current face as fit within a byte limit into a pixel buffer,
+        and starts their transfer to the texture
+        :param upload: TextureUpload to advance
+        :param byte_limit: number of bytes that may be uploaded
+        :return: number of bytes uploaded
+        """
+        target, levels = upload.faces[upload.face]
+        pixels = levels[upload.level]
+        height, width, channels = pixels.shape
+        row_size = width * channels
+        # At least one row is uploaded, so an upload always advances
+        row_count = min(max(byte_limit // row_size, 1), height - upload.row)
+        rows = np.ascontiguousarray(pixels[upload.row:upload.row + row_count])
+
+        # Orphan the next buffer and write the rows into its new storage
+        buffer_ref = self.buffer_refs[self.buffer_index]
+        self.buffer_index = (self.buffer_index + 1) % TextureStreamer.BUFFER_COUNT
+        glBindBuffer(GL_PIXEL_UNPACK_BUFFER, buffer_ref)
+        glBufferData(GL_PIXEL_UNPACK_BUFFER, rows.nbytes, None, GL_STREAM_DRAW)
+        address = glMapBufferRange(GL_PIXEL_UNPACK_BUFFER, 0, rows.nbytes,
+                                   GL_MAP_WRITE_BIT | GL_MAP_INVALIDATE_BUFFER_BIT)
+        ctypes.memmove(address, rows.ctypes.data, rows.nbytes)
+        glUnmapBuffer(GL_PIXEL_UNPACK_BUFFER)
+
+        # Transfer reads from the bound pixel buffer, so returns without waiting for the copy
+        upload.texture.bind(upload.texture.target)
+        glTexSubImage2D(target, upload.level, 0, upload.row, width, row_count, upload.pixel_format,
+                        GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+
+        upload.row += row_count
+        if upload.row == height:
+            upload.row = 0
+            upload.face += 1
+            if upload.face == len(upload.faces):
+                # Level complete on every face, so it can be sampled
+                upload.face = 0
+                glTexParameteri(upload.texture.target, GL_TEXTURE_BASE_LEVEL, upload.level)
+                upload.level -= 1
+        return rows.nbytes